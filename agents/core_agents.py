@@ -3,8 +3,7 @@ from crewai_tools import FileReadTool, WebsiteSearchTool # Removed FileWriterToo
 from langchain_google_genai import ChatGoogleGenerativeAI
 import os
 import time
-from supabase import create_client, Client
-from utils import get_secret # Import get_secret from utils
+from utils import get_secret, LLM_MAX_OUTPUT_TOKENS, AGENT_VERBOSE # Import get_secret from utils
 
 # Usunięto zduplikowaną funkcję get_secret, teraz importowana z utils.py
 # api_key = get_secret('gemini_api_key') # Ta linia nie jest już potrzebna, klucz pobierany w get_llm
@@ -29,7 +28,7 @@ def get_llm():
         model="gemini-1.5-flash",  # Użyj stabilnej wersji, jeśli -2.0 nie działa
         google_api_key=os.getenv("GOOGLE_API_KEY"),
         temperature=0.3,
-        max_tokens=4096
+        max_tokens=LLM_MAX_OUTPUT_TOKENS
     )
     return llm
 
@@ -44,7 +43,9 @@ class SupabaseTool:
         supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
         if not supabase_url or not supabase_key:
             raise ValueError("BŁĄD: SUPABASE_URL lub SUPABASE_SERVICE_KEY nie są ustawione.")
-        self.client: Client = create_client(supabase_url, supabase_key)
+        from supabase import create_client # Import przy użyciu, agenci nie potrzebują klienta Supabase
+
+        self.client = create_client(supabase_url, supabase_key)
 
     def save_project(self, project_data):
         return self.client.table("project_generations").insert(project_data).execute()
@@ -66,7 +67,7 @@ class ProjectPlannerAgent(Agent):
             role="Project Planner",
             goal="Create a detailed project plan based on requirements.",
             backstory="You are an expert project manager with experience in web development.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm
         )
@@ -95,7 +96,7 @@ class CodeGeneratorAgent(Agent):
             role="Code Generator",
             goal="Generate code based on project plan.",
             backstory="You are a senior developer proficient in multiple frameworks.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             tools=[], # Usunięto FileWriterTool
             llm=llm
@@ -125,7 +126,7 @@ class CodeReviewerAgent(Agent):
             role="Code Reviewer",
             goal="Review code for quality and standards.",
             backstory="You are a meticulous code reviewer with a focus on best practices.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             tools=[FileReadTool()],
             llm=llm
@@ -155,7 +156,7 @@ class TestGeneratorAgent(Agent):
             role="Test Generator",
             goal="Generate automated tests for the project.",
             backstory="You are a QA engineer specializing in test automation.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             tools=[], # Usunięto FileWriterTool
             llm=llm
@@ -185,7 +186,7 @@ class DeploymentAgent(Agent):
             role="Deployment Specialist",
             goal="Deploy the project to a hosting platform.",
             backstory="You are a DevOps engineer with expertise in cloud deployments.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm
         )
@@ -214,7 +215,7 @@ class DatabaseAgent(Agent):
             role="Database Manager",
             goal="Manage database schema and migrations.",
             backstory="You are a database administrator with expertise in SQL and NoSQL.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm
         )
@@ -243,7 +244,7 @@ class MonitoringAgent(Agent):
             role="Monitoring Specialist",
             goal="Set up monitoring for the project.",
             backstory="You are an expert in observability and monitoring solutions.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm
         )
@@ -272,7 +273,7 @@ class FeedbackAgent(Agent):
             role="Feedback Analyst",
             goal="Collect and analyze feedback for the project.",
             backstory="You are an expert in user feedback analysis.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm
         )
@@ -301,15 +302,32 @@ class QualityAssuranceAgent(Agent):
             role="Quality Assurance Specialist",
             goal="Ensure code quality, standards compliance, and perform static analysis.",
             backstory="You are a meticulous QA specialist with expertise in code quality tools like SonarQube and linters.",
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             tools=[], # Add relevant tools later if needed, e.g., for running linters or interacting with SonarQube API
             llm=llm
         )
 
-    def create_quality_check_task(self, project_path):
+    def create_quality_check_task(self, project_path, files=None, lint_findings=None, prompt_context=None):
+        """
+        Creates the quality check task.
+        If files is given, the check is narrowed to those project-relative files;
+        lint_findings ({file: [finding, ...]}) from the local linters are passed along as context.
+        With prompt_context (prompt_cache.PromptContext) the shared project context is used when it is cached.
+        """
+        description = f"Perform quality checks and static analysis on the project in {project_path}."
+        if files:
+            description += f" Limit the analysis to these files: {', '.join(files)}."
+        if lint_findings:
+            finding_lines = "\n".join(
+                f"- {finding['file']}:{finding.get('line') or '?'} [{finding['rule']}] {finding['message']}"
+                for file_findings in lint_findings.values() for finding in file_findings
+            )
+            description += f" Local linters already reported:\n{finding_lines}\nFocus on these and on issues linters cannot detect."
+        if prompt_context is not None:
+            description = prompt_context.describe(self, description, inline_prefix=False)
         return Task(
-            description=f"Perform quality checks and static analysis on the project in {project_path}.",
+            description=description,
             agent=self,
             expected_output="A report detailing code quality issues, linting errors, and suggestions for improvement."
         )
\ No newline at end of file
@@ -1,10 +1,11 @@
 from crewai import Agent, Task
+from crewai_tools import FileReadTool # Odczyt plików, których pełna treść nie trafiła do kontekstu
 from langchain_google_genai import ChatGoogleGenerativeAI # Import ChatGoogleGenerativeAI
 import os
-from utils import get_secret # Import get_secret from utils
+from patching import PATCH_FORMAT_INSTRUCTIONS
+from utils import AGENT_VERBOSE
 
-# Usunięto zduplikowaną funkcję get_secret, teraz importowana z utils.py
-api_key = get_secret('gemini_api_key')
+# Klucz API jest czytany przy tworzeniu agenta (GOOGLE_API_KEY), nie przy imporcie modułu
 
 class ProjectEditorAgent(Agent): # Inherit directly from Agent
     def __init__(self, **kwargs): # Accept kwargs for potential future config from YAML
@@ -18,33 +19,58 @@ class ProjectEditorAgent(Agent): # Inherit directly from Agent
             temperature=0.7
         )
 
+        # role/goal/backstory z agents.yaml nie mogą zostać przekazane drugi raz przez **kwargs
         super().__init__(
-            role='Project Editor',
-            goal='Edit project files to implement requested changes',
-            backstory='Expert in web development and file management.',
-            verbose=kwargs.get('verbose', True), # Allow verbose to be set from kwargs
-            allow_delegation=kwargs.get('allow_delegation', False), # Allow delegation to be set from kwargs
+            role=kwargs.pop('role', 'Project Editor'),
+            goal=kwargs.pop('goal', 'Edit project files to implement requested changes'),
+            backstory=kwargs.pop('backstory', 'Expert in web development and file management.'),
+            verbose=kwargs.pop('verbose', AGENT_VERBOSE), # Allow verbose to be set from kwargs
+            allow_delegation=kwargs.pop('allow_delegation', False), # Allow delegation to be set from kwargs
+            tools=kwargs.pop('tools', [FileReadTool()]),
             llm=llm,
             **kwargs # Pass remaining kwargs to the parent Agent class
         )
 
-    def create_edit_task(self, project_name, changes):
+    def create_edit_task(self, project_name, changes, context_chunks=None, project_files=None):
+        """
+        Creates the edit task.
+        context_chunks are the most relevant fragments of the project (from ProjectIndex.context_for) and
+        project_files the list of all project files; when given, the agent works from these fragments
+        instead of regenerating the whole project.
+        """
+        if context_chunks is None:
+            context = """
+        If project files (e.g., index.html, style.css, script.js) do not exist, create them with a basic structure."""
+        else:
+            fragments = []
+            for chunk in context_chunks:
+                if chunk.get('full_file'):
+                    header = f"[{chunk['path']} - full file]"
+                else:
+                    header = f"[{chunk['path']} - partial, lines {chunk['start_line']}-{chunk['end_line']}]"
+                fragments.append(f"{header}\n{chunk['text']}\n")
+            fragments = "\n".join(fragments)
+            context = f"""
+        Project files: {', '.join(project_files or []) or 'none yet'}.
+        Most relevant fragments of the current code:
+        {fragments}
+        Return ONLY the files that must change to implement the request; untouched files must not be returned.
+        Files marked as partial are shown only in fragments; if the text you need to change is not shown, read the file with the file read tool first."""
+
         task_description = f"""
-        Edit project {project_name} in directory /app/{project_name} to implement changes: {changes}.
-        If project files (e.g., index.html, style.css, script.js) do not exist, create them with a basic structure.
-        Do NOT use FileWriterTool due to persistent errors. Instead, return the full content of each modified file in the following format:
-        --- <filename> ---
-        <content>
+        Edit project {project_name} in directory /app/projects/{project_name} to implement changes: {changes}.{context}
+        Do NOT use FileWriterTool due to persistent errors. Do NOT return whole existing files; return only the changed parts.
+        {PATCH_FORMAT_INSTRUCTIONS}
         For example:
         --- index.html ---
-        <!DOCTYPE html>
-        <html>
+        <<<<<<< SEARCH
         <body><h1>Test</h1></body>
-        </html>
-        Provide content for all modified files (index.html, style.css, script.js) to implement the changes.
+        =======
+        <body><h1>Test</h1><p>Hello</p></body>
+        >>>>>>> REPLACE
         """
         return Task(
             description=task_description,
             agent=self, # Use self as the agent instance
-            expected_output="File contents in --- <filename> --- format for all modified files"
+            expected_output="SEARCH/REPLACE blocks (or full content of new files) in --- <filename> --- format for all modified files"
         )
\ No newline at end of file
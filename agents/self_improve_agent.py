@@ -2,10 +2,9 @@ from crewai import Agent, Task
 from crewai_tools import FileReadTool # Import FileReadTool
 from langchain_google_genai import ChatGoogleGenerativeAI # Fixed syntax error
 import os
-from utils import get_secret # Import get_secret from utils
+from utils import AGENT_VERBOSE
 
-# Usunięto zduplikowaną funkcję get_secret, teraz importowana z utils.py
-api_key = get_secret('gemini_api_key')
+# Klucz API jest czytany przy tworzeniu agenta (GOOGLE_API_KEY), nie przy imporcie modułu
 
 class SelfImproveAgent(Agent):
     def __init__(self):
@@ -27,7 +26,7 @@ class SelfImproveAgent(Agent):
                 "You are an expert in code optimization and software engineering, specializing in Python and AI agent frameworks. "
                 "Your mission is to review agent code, identify inefficiencies, and propose actionable improvements using Gemini 2.0 Flash."
             ),
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             allow_delegation=False,
             llm=llm, # Pass the initialized llm instance
             tools=[FileReadTool()] # Add FileReadTool to the agent's tools
@@ -58,4 +57,35 @@ class SelfImproveAgent(Agent):
                 "A report containing at least 3 actionable suggestions for improving the code, "
                 "including code snippets and explanations."
             )
-        )
\ No newline at end of file
+        )
+
+    def create_fix_task(self, file_path, file_content, issues):
+        """
+        Tworzy zadanie naprawy problemów SonarQube dla jednego pliku.
+        Args:
+            file_path (str): Ścieżka pliku względem katalogu projektu (np. src/pages/index.js).
+            file_content (str): Aktualna zawartość pliku.
+            issues (list): Problemy SonarQube dotyczące tylko tego pliku (dicty z 'rule', 'line', 'message', 'severity').
+        Returns:
+            Task: Obiekt zadania dla CrewAI.
+        """
+        issue_lines = "\n".join(
+            f"- [{issue.get('rule')}] line {issue.get('line', '?')} ({issue.get('severity', 'UNKNOWN')}): {issue.get('message', '')}"
+            for issue in issues
+        )
+        task_description = (
+            f"Fix the following SonarQube issues in the file {file_path}.\n"
+            f"Issues:\n{issue_lines}\n\n"
+            f"Current content of {file_path}:\n"
+            f"{file_content}\n\n"
+            "Change only what is needed to resolve the listed issues and keep the behaviour unchanged. "
+            "Return the full corrected content of the file in the following format:\n"
+            f"--- {file_path} ---\n"
+            "<content>"
+        )
+
+        return Task(
+            description=task_description,
+            agent=self,
+            expected_output=f"Full corrected content of {file_path} in --- <filename> --- format"
+        )
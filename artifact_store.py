@@ -0,0 +1,464 @@
+import io
+import os
+import sys
+import stat
+import time
+import fcntl
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tarfile
+import tempfile
+import threading
+import subprocess
+
+from utils import FACTORY_CACHE_DIR
+from job_store import ARTIFACT_SKIP_DIRS
+
+ARTIFACT_STORE_DIR = os.getenv("ARTIFACT_STORE_DIR", os.path.join(FACTORY_CACHE_DIR, "artifacts"))
+# Sposób tworzenia drzew roboczych z obiektów: clone (reflink -> kopia; auto to alias), reflink, hardlink, copy.
+# hardlink dzieli inode ze wspólnym obiektem (tylko do odczytu, bez bitu wykonywania), więc tylko na wyraźne żądanie
+ARTIFACT_LINK_MODE = os.getenv("ARTIFACT_LINK_MODE", "clone")
+# Deduplikacja katalogów projects/<nazwa> po zapisie: reflink (bezpieczny copy-on-write), hardlink albo off.
+# hardlink wymaga, by wszystko zapisujące w projekcie podmieniało pliki atomowo (jak write_project_files).
+ARTIFACT_DEDUP_WORKTREE = os.getenv("ARTIFACT_DEDUP_WORKTREE", "reflink")
+ARTIFACT_KEEP_SNAPSHOTS = int(os.getenv("ARTIFACT_KEEP_SNAPSHOTS", "20"))
+ARTIFACT_ZSTD_LEVEL = int(os.getenv("ARTIFACT_ZSTD_LEVEL", "3"))
+CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # ioctl klonowania pliku (btrfs, XFS, bcachefs)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(source, target):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place_file(source, target, mode=ARTIFACT_LINK_MODE, file_mode=None):
+    """
+    Atomically places source at target as a reflink, hardlink or copy (clone and auto try a reflink and
+    fall back to a copy). A hardlink shares the source's inode and mode, so files whose file_mode needs
+    an exec bit are copied instead.
+    Returns:
+        str: The method used ("reflink", "hardlink" or "copy").
+    """
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    methods = {"auto": ("reflink", "copy"), "clone": ("reflink", "copy"), "hardlink": ("hardlink", "copy")}.get(mode, (mode,))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".tmp-")
+    os.close(fd)
+    try:
+        for method in methods:
+            try:
+                if method == "reflink":
+                    _reflink(source, tmp_path)
+                elif method == "hardlink":
+                    if file_mode is not None and file_mode & 0o111:
+                        continue
+                    os.unlink(tmp_path)
+                    os.link(source, tmp_path)
+                else:
+                    shutil.copyfile(source, tmp_path)
+                break
+            except OSError:
+                if not os.path.exists(tmp_path):
+                    open(tmp_path, "wb").close()
+                continue
+        else:
+            raise OSError(f"Cannot place {source} at {target} with {mode}")
+        if method != "hardlink" and file_mode is not None:
+            os.chmod(tmp_path, file_mode)
+        os.replace(tmp_path, target)
+        return method
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class _ChunkSink:
+    """Write-only file object collecting the compressed stream between yields."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of generated files shared by all projects and runs.
+    Every file version is stored once under objects/<sha256[:2]>/<sha256[2:]> (read-only); a snapshot
+    records the tree of one project after a run. Working trees are materialised from objects with
+    reflinks or copies (hardlinks on request), and projects are exported as a streaming tar.zst straight from the objects.
+    """
+
+    def __init__(self, root=ARTIFACT_STORE_DIR):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS objects (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    project TEXT NOT NULL,
+                    job_id TEXT,
+                    created_at REAL NOT NULL,
+                    files INTEGER NOT NULL,
+                    bytes INTEGER NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_project ON snapshots (project, id)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshot_files (
+                    snapshot_id INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    mode INTEGER NOT NULL,
+                    PRIMARY KEY (snapshot_id, path)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_files_sha ON snapshot_files (sha256)")
+            # Stan plików drzewa roboczego: niezmienione pliki (rozmiar, mtime, inode) nie są ponownie haszowane
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_cache (
+                    project TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    mode INTEGER NOT NULL,
+                    PRIMARY KEY (project, path)
+                )
+            """)
+
+    def object_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256[:2], sha256[2:])
+
+    def _store_object(self, path, sha256, size):
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            # Obiekt nie może dzielić inode z plikiem, który ktoś może jeszcze nadpisać w miejscu: reflink albo kopia
+            place_file(path, object_path, mode="clone", file_mode=0o444)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO objects (sha256, size, created_at) VALUES (?, ?, ?)", (sha256, size, time.time()))
+        return object_path
+
+    def _walk(self, project_dir):
+        for root, dirs, files in os.walk(project_dir):
+            dirs[:] = sorted(d for d in dirs if d not in ARTIFACT_SKIP_DIRS)
+            for name in sorted(files):
+                if name.startswith(".tmp-"):
+                    continue
+                file_path = os.path.join(root, name)
+                if os.path.islink(file_path):
+                    continue
+                yield os.path.relpath(file_path, project_dir).replace(os.sep, "/"), file_path
+
+    def ingest(self, project, project_dir, job_id=None, dedup_worktree=ARTIFACT_DEDUP_WORKTREE):
+        """
+        Stores every file of the project tree (new content only) and records a snapshot.
+        With dedup_worktree the working files are replaced by reflinks/hardlinks to their objects.
+        Returns:
+            tuple: (snapshot id, manifest [{"path", "size", "sha256"}])
+        """
+        with self._lock:
+            cached = {row[0]: row[1:] for row in self._conn.execute(
+                "SELECT path, size, mtime_ns, inode, sha256, mode FROM file_cache WHERE project = ?", (project,)
+            )}
+        manifest, rows, cache_rows, linked = [], [], [], 0
+        for rel_path, file_path in self._walk(project_dir):
+            try:
+                info = os.stat(file_path)
+                file_mode = stat.S_IMODE(info.st_mode)
+                known = cached.get(rel_path)
+                if known and known[:3] == (info.st_size, info.st_mtime_ns, info.st_ino) and os.path.exists(self.object_path(known[3])):
+                    # Pliki podlinkowane do obiektu mają jego tryb (0444), więc tryb pochodzi z cache
+                    sha256, file_mode = known[3], known[4]
+                else:
+                    sha256 = hash_file(file_path)
+                    object_path = self._store_object(file_path, sha256, info.st_size)
+                    if dedup_worktree in ("reflink", "hardlink") and info.st_size:
+                        try:
+                            place_file(object_path, file_path, mode=dedup_worktree, file_mode=file_mode)
+                            linked += 1
+                            info = os.stat(file_path)
+                        except OSError:
+                            dedup_worktree = None  # System plików nie obsługuje linków - nie próbujemy dalej
+            except OSError as e:
+                logging.warning(f"Artifact store: skipping {file_path}: {e}")
+                continue
+            manifest.append({"path": rel_path, "size": info.st_size, "sha256": sha256})
+            rows.append((rel_path, sha256, file_mode))
+            cache_rows.append((project, rel_path, info.st_size, info.st_mtime_ns, info.st_ino, sha256, file_mode))
+
+        with self._lock, self._conn:
+            snapshot_id = self._conn.execute(
+                "INSERT INTO snapshots (project, job_id, created_at, files, bytes) VALUES (?, ?, ?, ?, ?)",
+                (project, job_id, time.time(), len(manifest), sum(item["size"] for item in manifest))
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO snapshot_files (snapshot_id, path, sha256, mode) VALUES (?, ?, ?, ?)",
+                [(snapshot_id,) + row for row in rows]
+            )
+            self._conn.execute("DELETE FROM file_cache WHERE project = ?", (project,))
+            self._conn.executemany(
+                "INSERT INTO file_cache (project, path, size, mtime_ns, inode, sha256, mode) VALUES (?, ?, ?, ?, ?, ?, ?)", cache_rows
+            )
+        logging.info(f"Artifact store: snapshot {snapshot_id} of {project} ({len(manifest)} files, {linked} working files linked to objects).")
+        return snapshot_id, manifest
+
+    def latest_snapshot(self, project):
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(id) FROM snapshots WHERE project = ?", (project,)).fetchone()
+        return row[0] if row else None
+
+    def snapshot_files(self, snapshot_id):
+        """Returns [(path, sha256, mode)] of a snapshot."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, sha256, mode FROM snapshot_files WHERE snapshot_id = ? ORDER BY path", (snapshot_id,)
+            ).fetchall()
+
+    def _resolve(self, project, snapshot_id):
+        snapshot_id = snapshot_id or self.latest_snapshot(project)
+        if snapshot_id is None:
+            raise ValueError(f"BŁĄD: Brak snapshotu projektu {project} w magazynie artefaktów.")
+        with self._lock:
+            row = self._conn.execute("SELECT project, created_at FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if row is None or row[0] != project:
+            raise ValueError(f"BŁĄD: Snapshot {snapshot_id} nie należy do projektu {project}.")
+        return snapshot_id, row[1]
+
+    def materialize(self, project, dest_dir, snapshot_id=None, mode=ARTIFACT_LINK_MODE):
+        """
+        Creates a working tree of a project snapshot in dest_dir from the stored objects.
+        Returns:
+            dict: {"snapshot_id", "files", and the number of files per method}
+        """
+        snapshot_id, _ = self._resolve(project, snapshot_id)
+        counts = {"snapshot_id": snapshot_id, "files": 0, "reflink": 0, "hardlink": 0, "copy": 0}
+        for path, sha256, file_mode in self.snapshot_files(snapshot_id):
+            method = place_file(self.object_path(sha256), os.path.join(dest_dir, *path.split("/")), mode=mode, file_mode=file_mode)
+            counts[method] += 1
+            counts["files"] += 1
+        return counts
+
+    def _write_tar(self, project, snapshot_id, mtime, out):
+        with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            for path, sha256, file_mode in self.snapshot_files(snapshot_id):
+                object_path = self.object_path(sha256)
+                info = tarfile.TarInfo(f"{project}/{path}")
+                info.size = os.path.getsize(object_path)
+                info.mode = file_mode
+                info.mtime = int(mtime)
+                with open(object_path, "rb") as f:
+                    tar.addfile(info, f)
+                yield
+
+    def export_stream(self, project, snapshot_id=None, level=ARTIFACT_ZSTD_LEVEL):
+        """
+        Yields a project snapshot as a tar.zst stream, read directly from the objects (no staging copy).
+        Uses the zstandard package, or the zstd command line tool if the package is not installed.
+        Raises:
+            ValueError: If the project has no such snapshot (raised immediately, before streaming starts).
+        """
+        snapshot_id, mtime = self._resolve(project, snapshot_id)
+        return self._stream_zst(project, snapshot_id, mtime, level)
+
+    def _stream_zst(self, project, snapshot_id, mtime, level):
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+
+        if zstandard is not None:
+            sink = _ChunkSink()
+            with zstandard.ZstdCompressor(level=level).stream_writer(sink, closefd=False) as compressed:
+                for _ in self._write_tar(project, snapshot_id, mtime, compressed):
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+            return
+
+        zstd = shutil.which("zstd")
+        if not zstd:
+            raise RuntimeError("BŁĄD: Eksport tar.zst wymaga pakietu zstandard lub programu zstd.")
+        process = subprocess.Popen([zstd, "-q", "-c", f"-{level}"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def feed():
+            try:
+                for _ in self._write_tar(project, snapshot_id, mtime, process.stdin):
+                    pass
+            except (OSError, ValueError) as e:
+                logging.error(f"Artifact export of {project} failed: {e}")
+            finally:
+                process.stdin.close()
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b""):
+                yield chunk
+        finally:
+            feeder.join()
+            process.stdout.close()
+            if process.wait() != 0:
+                raise RuntimeError(f"BŁĄD: zstd zakończył się kodem {process.returncode}.")
+
+    def export(self, project, output_path, snapshot_id=None, level=ARTIFACT_ZSTD_LEVEL):
+        """Writes a project snapshot to output_path as tar.zst. Returns the number of bytes written."""
+        written = 0
+        with open(output_path, "wb") as f:
+            for chunk in self.export_stream(project, snapshot_id, level):
+                f.write(chunk)
+                written += len(chunk)
+        return written
+
+    def gc(self, keep_snapshots=ARTIFACT_KEEP_SNAPSHOTS):
+        """Keeps the newest keep_snapshots snapshots of every project and deletes unreferenced objects."""
+        with self._lock, self._conn:
+            self._conn.execute("""
+                DELETE FROM snapshots WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY project ORDER BY id DESC) AS position FROM snapshots
+                    ) WHERE position > ?
+                )
+            """, (keep_snapshots,))
+            self._conn.execute("DELETE FROM snapshot_files WHERE snapshot_id NOT IN (SELECT id FROM snapshots)")
+            orphans = [row[0] for row in self._conn.execute(
+                "SELECT sha256 FROM objects WHERE sha256 NOT IN (SELECT sha256 FROM snapshot_files) "
+                "AND sha256 NOT IN (SELECT sha256 FROM file_cache)"
+            )]
+            self._conn.executemany("DELETE FROM objects WHERE sha256 = ?", [(sha256,) for sha256 in orphans])
+        for sha256 in orphans:
+            try:
+                os.unlink(self.object_path(sha256))
+            except FileNotFoundError:
+                pass
+        return {"deleted_objects": len(orphans)}
+
+    def stats(self):
+        """Returns object count, unique bytes and the logical size of the latest snapshots."""
+        with self._lock:
+            objects, unique_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects").fetchone()
+            snapshots = self._conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            logical_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(bytes), 0) FROM snapshots WHERE id IN (SELECT MAX(id) FROM snapshots GROUP BY project)"
+            ).fetchone()[0]
+        return {"objects": objects, "unique_bytes": unique_bytes, "snapshots": snapshots, "latest_snapshots_bytes": logical_bytes}
+
+    def close(self):
+        self._conn.close()
+
+
+def extract_archive(data, dest_dir):
+    """
+    Unpacks a tar.zst export (bytes) into dest_dir; members are <project>/<path>, so dest_dir is the projects directory.
+    Returns:
+        int: Number of extracted files.
+    """
+    try:
+        import zstandard
+        tar_data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    except ImportError:
+        zstd = shutil.which("zstd")
+        if not zstd:
+            raise RuntimeError("BŁĄD: Rozpakowanie tar.zst wymaga pakietu zstandard lub programu zstd.")
+        tar_data = subprocess.run([zstd, "-q", "-d", "-c"], input=data, capture_output=True, check=True).stdout
+
+    root = os.path.abspath(dest_dir)
+    extracted = 0
+    with tarfile.open(fileobj=io.BytesIO(tar_data), mode="r:") as tar:
+        for member in tar:
+            target = os.path.abspath(os.path.join(root, member.name))
+            if not member.isfile() or os.path.commonpath([root, target]) != root:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with tar.extractfile(member) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.chmod(target, member.mode & 0o777)
+            extracted += 1
+    return extracted
+
+
+def snapshot_project(project, project_dir, job_id=None):
+    """
+    Ingests the project after a successful run. Errors are logged, never raised: the snapshot
+    is an optimisation of storage and export, not a condition of the run's success.
+    Returns:
+        list|None: The artifact manifest of the snapshot, or None if ingest failed.
+    """
+    store = None
+    try:
+        store = ArtifactStore()
+        _, manifest = store.ingest(project, project_dir, job_id=job_id)
+        return manifest
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Failed to store artifact snapshot of {project}: {e}")
+        return None
+    finally:
+        if store is not None:
+            store.close()
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Content-addressed artifact store of generated projects.")
+    parser.add_argument("--ingest", metavar="PROJECT", help="Snapshot projects/<PROJECT> into the store")
+    parser.add_argument("--export", metavar="PROJECT", help="Export the latest (or --snapshot) snapshot as tar.zst")
+    parser.add_argument("--materialize", metavar="PROJECT", help="Create a working tree of the snapshot in --output")
+    parser.add_argument("--snapshot", type=int, help="Snapshot id (default: latest)")
+    parser.add_argument("--output", "-o", help="Output file (--export, '-' for stdout) or directory (--materialize)")
+    parser.add_argument("--gc", action="store_true", help="Drop old snapshots and unreferenced objects")
+    parser.add_argument("--stats", action="store_true", help="Print store statistics")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = ArtifactStore()
+    if args.ingest:
+        snapshot_id, manifest = store.ingest(args.ingest, os.path.join("projects", args.ingest))
+        print(json.dumps({"snapshot_id": snapshot_id, "files": len(manifest)}))
+    if args.export:
+        if args.output in (None, "-"):
+            for chunk in store.export_stream(args.export, args.snapshot):
+                sys.stdout.buffer.write(chunk)
+        else:
+            print(json.dumps({"bytes": store.export(args.export, args.output, args.snapshot)}))
+    if args.materialize:
+        if not args.output:
+            parser.error("--materialize requires --output")
+        print(json.dumps(store.materialize(args.materialize, args.output, args.snapshot)))
+    if args.gc:
+        print(json.dumps(store.gc()))
+    if args.stats:
+        print(json.dumps(store.stats()))
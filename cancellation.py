@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import subprocess
+
+# Limity czasu i czas na uporządkowane zakończenie po anulowaniu pochodzą z config.get_settings() (po wczytaniu .env):
+# RUN_DEADLINE_SECONDS, STAGE_DEADLINE_SECONDS, STAGE_DEADLINES, CANCEL_GRACE_SECONDS
+CANCELLED_EXIT_CODE = 3
+HTTP_TIMEOUT = 30
+WATCHDOG_INTERVAL = 0.1
+INTERRUPT_SIGNAL = signal.SIGUSR1
+
+
+class RunCancelled(BaseException):
+    """
+    Raised in the pipeline when the run is cancelled or a deadline passes. Derives from BaseException
+    (like KeyboardInterrupt) so that the stages' `except Exception` handlers do not swallow it.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Cooperative cancellation of one run, with an overall and a per-stage deadline.
+    Registered as a JobRecorder listener: every stage(name) is a checkpoint and starts the stage deadline.
+    After install(), SIGTERM/SIGINT cancel the run, and a cancellation (signal, deadline or cancel() from
+    any thread) interrupts the main thread's blocking call (LLM or HTTP request, child process wait) with
+    RunCancelled and kills registered child processes. If the run has not exited grace_seconds later
+    (e.g. stuck joining worker threads), the process exits hard.
+    Limits left as None come from the settings (deadlines are off by default).
+    """
+
+    def __init__(self, deadline_seconds=None, stage_deadline_seconds=None, stage_deadlines=None, grace_seconds=None):
+        from config import get_settings
+
+        settings = get_settings()
+        deadline_seconds = settings.run_deadline_seconds if deadline_seconds is None else deadline_seconds
+        now = time.monotonic()
+        self.deadline = now + deadline_seconds if deadline_seconds else None
+        self.stage_deadline_seconds = settings.stage_deadline_seconds if stage_deadline_seconds is None else stage_deadline_seconds
+        self.stage_deadlines = settings.stage_deadlines if stage_deadlines is None else stage_deadlines
+        self.grace_seconds = settings.cancel_grace_seconds if grace_seconds is None else grace_seconds
+        self.stage_name = None
+        self.stage_deadline = None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.RLock() # cancel() bywa wywoływane z handlera sygnału w wątku, który trzyma blokadę
+        self._callbacks = {}
+        self._next_callback = 0
+        self._armed = False
+        self._finished = threading.Event()
+        self._cancelled_at = None
+        self._on_stuck = None
+        self._on_exit = []
+        self._exiting = False
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RunCancelled(self.reason)
+
+    def remaining(self):
+        """Seconds until the nearest deadline, or None without deadlines."""
+        deadlines = [d for d in (self.deadline, self.stage_deadline) if d is not None]
+        return max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+
+    def timeout(self, default):
+        """Timeout for a blocking call: `default`, shortened to the remaining time. Raises RunCancelled if already cancelled."""
+        self.raise_if_cancelled()
+        remaining = self.remaining()
+        return default if remaining is None else max(0.01, min(default, remaining))
+
+    def wait(self, seconds):
+        """Sleeps up to `seconds`, returning early on cancellation. Raises RunCancelled if cancelled."""
+        self._event.wait(seconds)
+        self.raise_if_cancelled()
+
+    def on_cancel(self, callback):
+        """
+        Registers a callback run on cancellation (e.g. killing a child process group); runs it at once if
+        already cancelled. Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                key = self._next_callback
+                self._next_callback += 1
+                self._callbacks[key] = callback
+                return lambda: self._callbacks.pop(key, None)
+        callback()
+        return lambda: None
+
+    def cancel(self, reason="cancelled"):
+        """Cancels the run (idempotent; callable from any thread and from signal handlers)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._cancelled_at = time.monotonic()
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        logging.warning(f"Run cancelled: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.error(f"Cancellation callback failed: {e}")
+        if self._armed and threading.current_thread() is not threading.main_thread():
+            # Przerywa blokujące wywołanie głównego wątku (EINTR), handler zgłasza RunCancelled
+            signal.pthread_kill(threading.main_thread().ident, INTERRUPT_SIGNAL)
+
+    # --- JobRecorder listener ---
+
+    def stage(self, name):
+        self.raise_if_cancelled()
+        seconds = next((s for prefix, s in self.stage_deadlines.items() if name.startswith(prefix)), self.stage_deadline_seconds)
+        self.stage_name = name
+        self.stage_deadline = time.monotonic() + seconds if seconds else None
+
+    def finish(self, status, **_):
+        self._armed = False
+        self._finished.set()
+
+    # --- process integration ---
+
+    def _handle_signal(self, signum, frame):
+        if signum != INTERRUPT_SIGNAL:
+            self.cancel(f"signal {signal.Signals(signum).name}")
+        if self._armed and self._event.is_set():
+            raise RunCancelled(self.reason)
+
+    def _watchdog(self):
+        while not self._finished.wait(WATCHDOG_INTERVAL):
+            now = time.monotonic()
+            if not self._event.is_set():
+                if self.deadline is not None and now >= self.deadline:
+                    self.cancel("run deadline exceeded")
+                elif self.stage_deadline is not None and now >= self.stage_deadline:
+                    self.cancel(f"stage deadline exceeded: {self.stage_name}")
+            elif now - self._cancelled_at >= self.grace_seconds:
+                logging.error(f"Run did not stop within {self.grace_seconds}s of cancellation, exiting.")
+                if self._on_stuck:
+                    try:
+                        self._on_stuck()
+                    except Exception as e:
+                        logging.error(f"Cancellation cleanup failed: {e}")
+                self.exit(CANCELLED_EXIT_CODE)
+
+    def install(self, on_stuck=None, on_exit=()):
+        """
+        Arms the token in the main thread: signal handlers and the deadline watchdog.
+        Args:
+            on_stuck (callable): Called before a hard exit when the run did not stop in time (e.g. mark the job cancelled).
+            on_exit (iterable): Cleanup run by exit() (e.g. flushing logs).
+        """
+        self._on_stuck = on_stuck
+        self._on_exit = list(on_exit)
+        for signum in (signal.SIGTERM, signal.SIGINT, INTERRUPT_SIGNAL):
+            signal.signal(signum, self._handle_signal)
+        self._armed = True
+        threading.Thread(target=self._watchdog, name="cancel-watchdog", daemon=True).start()
+
+    def disarm(self):
+        """Stops raising RunCancelled asynchronously (call first thing when handling the cancellation)."""
+        self._armed = False
+
+    def exit(self, code=CANCELLED_EXIT_CODE):
+        """
+        Ends the process without waiting for abandoned threads (in-flight LLM calls in worker threads would
+        otherwise keep it alive, holding rate budget, memory and a worker slot).
+        """
+        with self._lock:
+            if self._exiting:
+                return
+            self._exiting = True
+        for cleanup in self._on_exit:
+            try:
+                cleanup()
+            except Exception as e:
+                logging.error(f"Exit cleanup failed: {e}")
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def timeout_for(token, default=HTTP_TIMEOUT):
+    """Timeout for an HTTP call or child process: default, limited by the token's deadlines if there is one."""
+    return token.timeout(default) if token is not None else default
+
+
+def kill_process_group(process, sig=signal.SIGKILL):
+    """Kills a child started with start_new_session=True together with its own children."""
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def run_process(command, token=None, timeout=None, **kwargs):
+    """
+    subprocess.run() replacement for child processes of a cancellable run: the child gets its own process
+    group, which is killed on timeout or cancellation (RunCancelled is raised in the latter case).
+    Returns:
+        subprocess.CompletedProcess
+    Raises:
+        subprocess.TimeoutExpired: If the timeout passed.
+    """
+    if token is not None:
+        timeout = token.timeout(timeout if timeout is not None else float("inf"))
+        timeout = None if timeout == float("inf") else timeout
+    kwargs.setdefault("stdout", subprocess.PIPE)
+    kwargs.setdefault("stderr", subprocess.PIPE)
+    if os.name == "posix":
+        kwargs.setdefault("start_new_session", True)
+    process = subprocess.Popen(command, **kwargs)
+    unregister = token.on_cancel(lambda: kill_process_group(process)) if token is not None else (lambda: None)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        process.communicate()
+        raise
+    except BaseException:
+        kill_process_group(process)
+        raise
+    finally:
+        unregister()
+    if token is not None:
+        token.raise_if_cancelled()
+    return subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
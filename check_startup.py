@@ -0,0 +1,56 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+# Regresja czasu startu generate_project.py: import nie może ładować ciężkich zależności,
+# a --help i błędne argumenty muszą kończyć się bez ich importu.
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "0.5"))
+HEAVY_MODULES = ["crewai", "crewai_tools", "litellm", "supabase", "langchain_google_genai", "requests", "yaml", "dotenv"]
+GENERATION_ONLY_MODULES = ["scaffolding", "plan_cache", "prompt_cache", "local_lint", "project_test_runner", "continuation", "agents.core_agents"]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(args):
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True, text=True)
+    return process, time.perf_counter() - started
+
+
+def check_import():
+    code = (
+        "import sys, json, generate_project; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES + GENERATION_ONLY_MODULES!r} if m in sys.modules]))"
+    )
+    process, elapsed = run(["-c", code])
+    if process.returncode != 0:
+        return False, f"import generate_project failed: {process.stderr.strip()[-500:]}", elapsed
+    loaded = json.loads(process.stdout.strip().splitlines()[-1])
+    if loaded:
+        return False, f"import generate_project loads {loaded}", elapsed
+    return True, "no heavy or generation-only modules loaded", elapsed
+
+
+def check_cli(args, expected_code):
+    process, elapsed = run(["generate_project.py"] + args)
+    if process.returncode != expected_code:
+        return False, f"exit code {process.returncode}, expected {expected_code}: {process.stderr.strip()[-500:]}", elapsed
+    return True, f"exit code {process.returncode}", elapsed
+
+
+if __name__ == "__main__":
+    checks = [
+        ("import", check_import()),
+        ("--help", check_cli(["--help"], 0)),
+        ("edit without --changes", check_cli(["--project", "startup-check", "--edit"], 2)),
+        ("generate without --framework", check_cli(["--project", "startup-check"], 2)),
+    ]
+    failed = False
+    for name, (ok, message, elapsed) in checks:
+        if ok and elapsed > STARTUP_BUDGET_SECONDS:
+            ok, message = False, f"{message}, but took {elapsed:.3f}s (budget {STARTUP_BUDGET_SECONDS}s)"
+        failed = failed or not ok
+        print(f"{'OK' if ok else 'FAIL'}  {name}: {message} ({elapsed * 1000:.0f} ms)")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,93 @@
+import os
+import json
+import logging
+import threading
+
+_settings = None
+_supabase_client = None
+_lock = threading.Lock()
+
+
+class Settings:
+    """
+    Read-only run configuration, loaded once by get_settings().
+    Modules that read os.getenv at import time must be imported after get_settings(), so that
+    values from .env are visible to them as well.
+    Run limits are opt-in: run_deadline_seconds and stage_deadline_seconds are off (0) unless set, and
+    stage_deadlines overrides the stage limit per stage name prefix. cancel_grace_seconds is the time a
+    cancelled run (signal, panel cancel, deadline) has to finish cleanly - job store, webhook outbox, log
+    flush - before the process exits hard with CANCELLED_EXIT_CODE.
+    """
+
+    __slots__ = ("supabase_url", "supabase_service_key", "google_api_key", "gemini_api_key",
+                 "n8n_webhook_url", "litellm_model", "litellm_verbose", "log_mode",
+                 "run_deadline_seconds", "stage_deadline_seconds", "stage_deadlines", "cancel_grace_seconds", "worker_slots")
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings are read-only")
+
+    def __repr__(self):
+        # Klucze nie trafiają do logów
+        return f"Settings(supabase_url={self.supabase_url!r}, litellm_model={self.litellm_model!r}, log_mode={self.log_mode!r})"
+
+
+def get_settings():
+    """Loads .env (once) and returns the process-wide Settings."""
+    global _settings
+    with _lock:
+        if _settings is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            from utils import get_secret # utils czyta zmienne środowiskowe przy imporcie, więc dopiero po load_dotenv()
+
+            _settings = Settings(
+                supabase_url=os.getenv("SUPABASE_URL"),
+                supabase_service_key=os.getenv("SUPABASE_SERVICE_KEY"), # Używamy SUPABASE_SERVICE_KEY dla spójności
+                google_api_key=os.getenv("GOOGLE_API_KEY"),
+                gemini_api_key=get_secret('gemini_api_key'),
+                n8n_webhook_url=os.getenv("N8N_WEBHOOK_URL"),
+                litellm_model=os.getenv("LITELLM_MODEL", "gemini-1.5-flash"),
+                litellm_verbose=os.getenv("LITELLM_VERBOSE", "false").lower() in ("1", "true", "yes"),
+                log_mode=os.getenv("LOG_MODE", "production").lower(),
+                run_deadline_seconds=float(os.getenv("RUN_DEADLINE_SECONDS", "0")),
+                stage_deadline_seconds=float(os.getenv("STAGE_DEADLINE_SECONDS", "0")),
+                # Limity dla wybranych etapów, np. {"ETAP 5": 1800}; klucz jest prefiksem nazwy etapu
+                stage_deadlines=json.loads(os.getenv("STAGE_DEADLINES", "{}")),
+                cancel_grace_seconds=float(os.getenv("CANCEL_GRACE_SECONDS", "10")),
+                worker_slots=int(os.getenv("WORKER_SLOTS", "1")),
+            )
+    return _settings
+
+
+def get_supabase_client():
+    """
+    Returns the Supabase client, created on first use.
+    Raises:
+        ValueError: If SUPABASE_URL or SUPABASE_SERVICE_KEY is not set.
+    """
+    global _supabase_client
+    settings = get_settings()
+    with _lock:
+        if _supabase_client is None:
+            if not settings.supabase_url or not settings.supabase_service_key:
+                raise ValueError("Brak wymaganych zmiennych: SUPABASE_URL lub SUPABASE_SERVICE_KEY")
+            from supabase import create_client
+            _supabase_client = create_client(settings.supabase_url, settings.supabase_service_key)
+    return _supabase_client
+
+
+def configure_litellm(settings):
+    """
+    Sets the default litellm model and key (CrewAI/mem0 may call litellm internally even though
+    the agents use ChatGoogleGenerativeAI). Verbose litellm logging only with LITELLM_VERBOSE=true.
+    """
+    import litellm
+
+    litellm.set_verbose(settings.litellm_verbose)
+    litellm.model = settings.litellm_model
+    litellm.api_key = settings.google_api_key
+    logging.debug(f"litellm configured: model {settings.litellm_model}, verbose {settings.litellm_verbose}")
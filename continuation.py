@@ -0,0 +1,164 @@
+import os
+import re
+import logging
+
+from project_files import FILE_BLOCK_PATTERN, parse_file_blocks
+from sonar_fix import crew_token_usage
+from utils import LLM_MAX_OUTPUT_TOKENS, AGENT_VERBOSE
+
+# Znacznik końca kompletnej odpowiedzi; jego brak oznacza (prawdopodobnie) uciętą odpowiedź
+END_SENTINEL = "--- KONIEC ---"
+END_SENTINEL_PATTERN = re.compile(r"^\s*---\s*KONIEC\s*---\s*$", re.MULTILINE)
+CONTINUATION_MAX_ROUNDS = int(os.getenv("CONTINUATION_MAX_ROUNDS", "5"))
+# Odpowiedź, która zużyła prawie cały limit tokenów, traktujemy jako uciętą
+TOKEN_LIMIT_RATIO = 0.97
+
+END_OF_OUTPUT_INSTRUCTIONS = f"Po ostatnim pliku zakończ odpowiedź osobną linią: {END_SENTINEL}"
+
+LENGTH_FINISH_REASONS = {"length", "max_tokens", "MAX_TOKENS", "FINISH_REASON_MAX_TOKENS"}
+
+
+def finish_reason(crew_output):
+    """Returns the finish reason reported for the output, if the LLM integration exposes one."""
+    candidates = [crew_output] + list(getattr(crew_output, "tasks_output", None) or [])[-1:]
+    for candidate in candidates:
+        reason = getattr(candidate, "finish_reason", None)
+        if reason is None and isinstance(getattr(candidate, "response_metadata", None), dict):
+            reason = candidate.response_metadata.get("finish_reason")
+        if reason is not None:
+            return str(getattr(reason, "name", reason))
+    return None
+
+
+def _hit_token_limit(crew_output, output_token_limit):
+    usage = getattr(crew_output, "token_usage", None)
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    requests_made = getattr(usage, "successful_requests", 0) or 0
+    # Tylko dla pojedynczego wywołania: przy wielu wywołaniach (narzędzia) suma nic nie mówi o ostatnim
+    return requests_made == 1 and completion_tokens >= output_token_limit * TOKEN_LIMIT_RATIO
+
+
+def truncation_reasons(output_str, crew_output=None, output_token_limit=LLM_MAX_OUTPUT_TOKENS):
+    """
+    Detects an output cut off at the token limit.
+    Returns:
+        list: Reasons (empty if the output looks complete). Any reason means files may be missing:
+              CrewOutput usually carries no finish reason and "token_limit" only applies to single-call
+              tasks, so "missing_end_marker" is often the only sign of a cut-off output.
+    """
+    reasons = []
+    if crew_output is not None:
+        if finish_reason(crew_output) in LENGTH_FINISH_REASONS:
+            reasons.append("finish_reason")
+        elif _hit_token_limit(crew_output, output_token_limit):
+            reasons.append("token_limit")
+    if output_str.count("```") % 2:
+        reasons.append("unterminated_fence")
+    if len(re.findall(r"^<{5,}\s*SEARCH\s*$", output_str, re.MULTILINE)) > len(re.findall(r"^>{5,}\s*REPLACE\s*$", output_str, re.MULTILINE)):
+        reasons.append("unterminated_patch")
+    if not END_SENTINEL_PATTERN.search(output_str):
+        reasons.append("missing_end_marker")
+    return reasons
+
+
+def _block_closed(content):
+    """A file block that is non-empty and has balanced ``` fences (it was not cut inside a code fence)."""
+    return bool(content.strip()) and content.count("```") % 2 == 0
+
+
+def split_complete_files(output_str, reasons):
+    """
+    Parses an output into files, setting aside the last file if the output may have been cut inside it.
+    A missing end marker alone does not mark the last file as partial when its block is closed (balanced
+    fences): models often just omit the marker. Any other reason (length finish reason, token limit,
+    unterminated fence or patch) does.
+    Returns:
+        tuple: ({file: content} of complete files, name of the partial file or None, its content or None).
+    """
+    body = END_SENTINEL_PATTERN.split(output_str, maxsplit=1)[0]
+    files = parse_file_blocks(body)
+    partial_file = partial_content = None
+    if reasons:
+        matches = list(FILE_BLOCK_PATTERN.finditer(body))
+        if matches:
+            last_file = matches[-1].group(1).strip()
+            if reasons != ["missing_end_marker"] or not _block_closed(matches[-1].group(2)):
+                partial_file = last_file
+                partial_content = files.pop(last_file, None)
+    return files, partial_file, partial_content
+
+
+def continuation_description(description, completed_files, partial_file):
+    """Builds the follow-up task asking the model to resume after the last complete file."""
+    resume = (
+        f"Zacznij od pliku {partial_file} - wygeneruj go ponownie OD POCZĄTKU w pełnej treści, a potem kolejne brakujące pliki."
+        if partial_file else
+        "Wygeneruj pozostałe brakujące pliki. Jeśli wszystkie pliki są już gotowe, zwróć tylko znacznik końca."
+    )
+    # Oryginalne zadanie na początku: wspólny prefiks promptu (prompt_cache) pozostaje identycznym początkiem
+    return f"""{description}
+
+                Twoja poprzednia odpowiedź na powyższe zadanie została ucięta z powodu limitu długości.
+                Ukończone już pliki (NIE zwracaj ich ponownie): {', '.join(completed_files) or 'brak'}.
+                {resume}
+                Zachowaj format '--- <ścieżka_pliku> ---'. {END_OF_OUTPUT_INSTRUCTIONS}
+                """
+
+
+def run_with_continuation(agent, description, expected_output, max_rounds=CONTINUATION_MAX_ROUNDS, token=None):
+    """
+    Runs a file-generating task and keeps asking the agent to continue while its output is truncated.
+    Partial outputs are stitched per file: only complete files are kept from each round and the
+    file that was cut off is regenerated from its beginning in the next round (after max_rounds its
+    latest version is kept).
+    Args:
+        agent: CrewAI agent.
+        description (str): Task description (the end-marker instruction is appended).
+        expected_output (str): Expected output of the task.
+        max_rounds (int): Maximum number of continuation requests.
+        token (CancelToken): Checked before every round, so a cancelled run makes no further LLM calls.
+    Returns:
+        tuple: ({file: content}, info dict with "rounds", "truncated", "tokens" and the raw outputs joined in "raw").
+    """
+    from crewai import Crew, Process, Task
+
+    files = {}
+    raw_outputs = []
+    tokens = 0
+    task_description = f"{description}\n                {END_OF_OUTPUT_INSTRUCTIONS}\n"
+    rounds = 0
+    while True:
+        task = Task(description=task_description, agent=agent, expected_output=expected_output)
+        crew = Crew(agents=[agent], tasks=[task], process=Process.sequential, verbose=AGENT_VERBOSE, max_rpm=10)
+        if token is not None:
+            token.raise_if_cancelled()
+        crew_output = crew.kickoff()
+        output_str = str(crew_output)
+        raw_outputs.append(output_str)
+        tokens += crew_token_usage(crew_output, task_description)
+
+        reasons = truncation_reasons(output_str, crew_output)
+        round_files, partial_file, partial_content = split_complete_files(output_str, reasons)
+        repeated = sorted(set(round_files) & set(files))
+        new_files = set(round_files) - set(files)
+        if repeated:
+            logging.info(f"Continuation repeated already completed files, keeping the newer version: {repeated}")
+        files.update(round_files)
+
+        if not reasons:
+            break
+        if rounds >= max_rounds:
+            if partial_file and partial_content:
+                # Ostatnia wersja pliku jest lepsza niż jego brak; ostrzeżenie pozwala ją sprawdzić
+                files[partial_file] = partial_content
+            logging.warning(f"Output still truncated after {rounds} continuation rounds ({reasons}); keeping the latest, possibly incomplete version of {partial_file}")
+            break
+        if rounds and not new_files and not partial_file:
+            # Kontynuacja nie wniosła nowych plików - przerywamy, żeby nie kręcić się w kółko
+            logging.info("Continuation returned no new files; treating the output as complete.")
+            break
+        rounds += 1
+        logging.info(f"Output truncated ({', '.join(reasons)}); requesting continuation {rounds}/{max_rounds} from {partial_file or 'the next file'}.")
+        task_description = continuation_description(description, sorted(files), partial_file)
+
+    return files, {"rounds": rounds, "truncated": bool(reasons), "tokens": tokens, "raw": "\n".join(raw_outputs)}
@@ -1,31 +1,168 @@
 import sqlite3
 import os
+import threading
+from collections import OrderedDict
 
-def load_project_metadata(project_name):
+PROJECTS_DB_PATH = os.getenv("PROJECTS_DB_PATH", os.path.join("/app", "projects.db"))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
+# Maksymalna liczba parametrów w jednym zapytaniu IN (...)
+BULK_CHUNK = 500
+
+_local = threading.local()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_connection(db_path=None):
+    """
+    Zwraca trwałe połączenie SQLite bieżącego wątku (tworzone przy pierwszym użyciu).
+    Połączenie działa w trybie WAL z busy_timeout, więc równoległe zadania czytają bez blokad,
+    a zapisy czekają na siebie zamiast zgłaszać "database is locked".
+    """
+    db_path = db_path or PROJECTS_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS projects (
+                project_name TEXT PRIMARY KEY,
+                framework TEXT,
+                features TEXT
+            )
+        """)
+        connections[db_path] = conn
+        _local.data_versions = getattr(_local, "data_versions", {})
+        _local.data_versions[db_path] = conn.execute("PRAGMA data_version").fetchone()[0]
+    return conn
+
+
+def _check_external_writes(conn, db_path):
+    """Czyści cache, jeśli inne połączenie (np. inny proces) zapisało coś do bazy od ostatniego sprawdzenia."""
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if _local.data_versions.get(db_path) != version:
+        _local.data_versions[db_path] = version
+        invalidate_cache()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return True, _cache[key]
+    return False, None
+
+
+def _cache_put(key, value):
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > METADATA_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate_cache(project_name=None, db_path=None):
+    """Usuwa z cache metadane jednego projektu albo (bez argumentu) cały cache."""
+    with _cache_lock:
+        if project_name is None:
+            _cache.clear()
+        else:
+            _cache.pop((db_path or PROJECTS_DB_PATH, project_name), None)
+
+
+def _row_to_metadata(row):
+    return {
+        "framework": row[0],
+        "features": row[1]
+    }
+
+
+def load_project_metadata(project_name, db_path=None):
     """
     Ładuje metadane projektu z lokalnej bazy SQLite.
     Args:
         project_name (str): Nazwa projektu.
+        db_path (str): Ścieżka do bazy (domyślnie PROJECTS_DB_PATH).
     Returns:
         dict: Metadane projektu (framework, features) lub None, jeśli nie znaleziono.
     """
-    db_path = os.path.join("/app", "projects.db")
+    return load_many([project_name], db_path=db_path).get(project_name)
+
+
+def load_many(project_names, db_path=None):
+    """
+    Ładuje metadane wielu projektów naraz; brakujące w cache pobiera jednym zapytaniem na paczkę.
+    Args:
+        project_names (iterable): Nazwy projektów.
+        db_path (str): Ścieżka do bazy (domyślnie PROJECTS_DB_PATH).
+    Returns:
+        dict: {nazwa projektu: metadane lub None}.
+    """
+    db_path = db_path or PROJECTS_DB_PATH
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT framework, features FROM projects WHERE project_name = ?",
-            (project_name,)
-        )
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            return {
-                "framework": result[0],
-                "features": result[1]
-            }
+        conn = get_connection(db_path)
+        _check_external_writes(conn, db_path)
+    except sqlite3.Error as e:
+        print(f"BŁĄD: Nie można załadować metadanych z SQLite: {e}")
+        return {name: None for name in project_names}
+
+    result = {}
+    missing = []
+    for name in dict.fromkeys(project_names):
+        hit, value = _cache_get((db_path, name))
+        if hit:
+            result[name] = value
         else:
-            return None
+            missing.append(name)
+
+    try:
+        for i in range(0, len(missing), BULK_CHUNK):
+            chunk = missing[i:i + BULK_CHUNK]
+            rows = conn.execute(
+                f"SELECT project_name, framework, features FROM projects WHERE project_name IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+            found = {row[0]: _row_to_metadata(row[1:]) for row in rows}
+            for name in chunk:
+                # Brak projektu też trafia do cache (unieważniany przy zapisie)
+                result[name] = found.get(name)
+                _cache_put((db_path, name), result[name])
     except sqlite3.Error as e:
         print(f"BŁĄD: Nie można załadować metadanych z SQLite: {e}")
-        return None
\ No newline at end of file
+        for name in missing:
+            result.setdefault(name, None)
+    return result
+
+
+def save_project_metadata(project_name, framework, features, db_path=None):
+    """
+    Zapisuje (upsert) metadane projektu i unieważnia jego wpis w cache.
+    Args:
+        project_name (str): Nazwa projektu.
+        framework (str): Framework projektu.
+        features (str): Funkcje projektu.
+        db_path (str): Ścieżka do bazy (domyślnie PROJECTS_DB_PATH).
+    Returns:
+        bool: True, jeśli zapis się powiódł.
+    """
+    db_path = db_path or PROJECTS_DB_PATH
+    try:
+        conn = get_connection(db_path)
+        conn.execute(
+            "INSERT INTO projects (project_name, framework, features) VALUES (?, ?, ?) "
+            "ON CONFLICT(project_name) DO UPDATE SET framework = excluded.framework, features = excluded.features",
+            (project_name, framework, features)
+        )
+        # Własny zapis zmienia data_version tylko dla innych połączeń, więc unieważniamy cache jawnie
+        invalidate_cache(project_name, db_path)
+        return True
+    except sqlite3.Error as e:
+        print(f"BŁĄD: Nie można zapisać metadanych do SQLite: {e}")
+        return False
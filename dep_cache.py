@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import stat
+import shutil
+import hashlib
+import logging
+import platform
+import tempfile
+import subprocess
+
+from utils import FACTORY_CACHE_DIR
+from cancellation import run_process
+
+DEP_CACHE_DIR = os.getenv("DEP_CACHE_DIR", os.path.join(FACTORY_CACHE_DIR, "deps"))
+# auto: reflink -> copy. Drzewa w sandboxach są zapisywalne, więc hardlink (wspólne inode z magazynem) tylko na
+# wyraźne żądanie; pliki magazynu są tylko do odczytu, więc zapis w miejscu kończy się błędem zamiast psuć magazyn
+# (poza procesami roota, które ignorują prawa).
+DEP_CACHE_LINK_MODE = os.getenv("DEP_CACHE_LINK_MODE", "auto")
+DEP_CACHE_OFFLINE = os.getenv("DEP_CACHE_OFFLINE", "0") == "1"
+INSTALL_TIMEOUT = int(os.getenv("DEP_INSTALL_TIMEOUT", "900"))
+
+COMPLETE_MARKER = ".complete"
+
+
+def _sha256(data):
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _tool_version(command):
+    try:
+        return subprocess.run(command, capture_output=True, text=True, timeout=30).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def npm_cache_key(project_dir):
+    """
+    Returns the store key of a Node project: hash of package-lock.json if present,
+    otherwise of the canonicalised dependency sections of package.json, plus the Node version.
+    """
+    lock_path = os.path.join(project_dir, "package-lock.json")
+    if os.path.exists(lock_path):
+        with open(lock_path, "r", encoding="utf-8") as f:
+            lock = json.load(f)
+        # Nazwa i wersja projektu nie wpływają na zainstalowane drzewo
+        lock.pop("name", None)
+        lock.pop("version", None)
+        lock.get("packages", {}).pop("", None)
+        source = json.dumps(lock, sort_keys=True)
+    else:
+        with open(os.path.join(project_dir, "package.json"), "r", encoding="utf-8") as f:
+            package = json.load(f)
+        source = json.dumps({k: package.get(k, {}) for k in ("dependencies", "devDependencies", "overrides")}, sort_keys=True)
+    return _sha256(f"npm\0{_tool_version(['node', '--version'])}\0{source}")
+
+
+def pip_cache_key(project_dir):
+    """Returns the store key of a Python project: hash of normalised requirements.txt plus the interpreter version."""
+    with open(os.path.join(project_dir, "requirements.txt"), "r", encoding="utf-8") as f:
+        lines = sorted({line.split("#", 1)[0].strip().lower() for line in f} - {""})
+    return _sha256(f"pip\0{sys.implementation.cache_tag}\0{platform.machine()}\0" + "\n".join(lines))
+
+
+def _make_read_only(tree):
+    """Drops the write bits of every file in a store tree (execute bits, e.g. of .bin targets, are kept)."""
+    for root, dirs, files in os.walk(tree):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                os.chmod(path, stat.S_IMODE(os.lstat(path).st_mode) & ~0o222)
+
+
+def _copy_writable(source, target):
+    shutil.copy2(source, target)
+    os.chmod(target, stat.S_IMODE(os.stat(target).st_mode) | stat.S_IWUSR)
+
+
+def link_tree(src, dst, mode=DEP_CACHE_LINK_MODE):
+    """
+    Materialises the store tree src at dst as a writable tree.
+    Tries a reflink copy (copy-on-write filesystems), then a plain copy; hardlinks (shared, read-only
+    files) only in "hardlink" mode.
+    Returns the mode that was used.
+    """
+    if mode in ("auto", "reflink") and platform.system() == "Linux" and shutil.which("cp"):
+        result = subprocess.run(["cp", "-a", "--reflink=always", src, dst], capture_output=True)
+        if result.returncode == 0:
+            # Kopia zachowuje prawa tylko do odczytu z magazynu
+            subprocess.run(["chmod", "-R", "u+w", dst], capture_output=True)
+            return "reflink"
+        shutil.rmtree(dst, ignore_errors=True)
+        if mode == "reflink":
+            raise OSError(f"Reflink copy failed: {result.stderr.decode(errors='replace').strip()}")
+
+    if mode == "hardlink":
+        try:
+            _hardlink_tree(src, dst)
+            return "hardlink"
+        except OSError:
+            shutil.rmtree(dst, ignore_errors=True)
+            raise
+
+    shutil.copytree(src, dst, symlinks=True, copy_function=_copy_writable)
+    return "copy"
+
+
+def _hardlink_tree(src, dst):
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root, exist_ok=True)
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            if os.path.islink(source):
+                # Symlinki (np. node_modules/.bin) odtwarzamy 1:1, są względne
+                os.symlink(os.readlink(source), target)
+            elif name in files:
+                os.link(source, target)
+        # os.walk nie wchodzi w symlinki do katalogów, więc nie ma ryzyka podwójnego przejścia
+        dirs[:] = [d for d in dirs if not os.path.islink(os.path.join(root, d))]
+
+
+def _run(command, cwd, env=None, token=None):
+    logging.info(f"Dependency store: {' '.join(command)}")
+    # Własna grupa procesów zabijana przy anulowaniu przebiegu (npm ci, pip install potrafią trwać minuty)
+    return run_process(command, token=token, timeout=INSTALL_TIMEOUT, cwd=cwd, env=env, text=True)
+
+
+def _build_npm_tree(project_dir, build_dir, offline, token=None):
+    npm_cache = os.path.join(DEP_CACHE_DIR, "npm-cache")
+    for name in ("package.json", "package-lock.json", ".npmrc"):
+        if os.path.exists(os.path.join(project_dir, name)):
+            shutil.copy2(os.path.join(project_dir, name), build_dir)
+    has_lock = os.path.exists(os.path.join(build_dir, "package-lock.json"))
+    command = ["npm", "ci" if has_lock else "install", "--cache", npm_cache, "--no-audit", "--no-fund"]
+    command.append("--offline" if offline else "--prefer-offline")
+    result = _run(command, build_dir, token=token)
+    if result.returncode != 0:
+        raise RuntimeError(f"npm install failed: {result.stderr[-2000:]}")
+    # Projekt bez zależności: npm nie tworzy katalogu node_modules
+    os.makedirs(os.path.join(build_dir, "node_modules"), exist_ok=True)
+    return os.path.join(build_dir, "node_modules")
+
+
+def _build_pip_tree(project_dir, build_dir, offline, token=None):
+    wheelhouse = os.path.join(DEP_CACHE_DIR, "wheelhouse")
+    os.makedirs(wheelhouse, exist_ok=True)
+    requirements = os.path.join(project_dir, "requirements.txt")
+    target = os.path.join(build_dir, "site-packages")
+    install = [sys.executable, "-m", "pip", "install", "--quiet", "--no-index", "--find-links", wheelhouse, "--target", target, "-r", requirements]
+
+    # Najpierw próbujemy wyłącznie z lokalnego wheelhouse; pobieramy tylko brakujące pakiety
+    result = _run(install, build_dir, token=token)
+    if result.returncode != 0 and not offline:
+        download = _run([sys.executable, "-m", "pip", "download", "--quiet", "--dest", wheelhouse, "-r", requirements], build_dir, token=token)
+        if download.returncode != 0:
+            raise RuntimeError(f"pip download failed: {download.stderr[-2000:]}")
+        shutil.rmtree(target, ignore_errors=True)
+        result = _run(install, build_dir, token=token)
+    if result.returncode != 0:
+        raise RuntimeError(f"pip install failed: {result.stderr[-2000:]}")
+    return target
+
+
+def _dependency_spec(project_dir, framework):
+    """Returns (kind, key, builder, project target dir) for the project, or None if it has no dependency manifest."""
+    if framework == "Next.js" and os.path.exists(os.path.join(project_dir, "package.json")):
+        return "npm", npm_cache_key(project_dir), _build_npm_tree, "node_modules"
+    if framework == "Flask" and os.path.exists(os.path.join(project_dir, "requirements.txt")):
+        return "pip", pip_cache_key(project_dir), _build_pip_tree, ".deps"
+    return None
+
+
+def ensure_store_tree(project_dir, framework, offline=DEP_CACHE_OFFLINE, token=None):
+    """
+    Makes sure the installed dependency tree for the project's manifest exists in the store (read-only files).
+    Returns (kind, key, store tree path, target dir name, hit) or None if the project has no manifest.
+    Concurrent builders of the same key are safe: each builds in its own temp dir and the
+    first atomic rename wins.
+    """
+    spec = _dependency_spec(project_dir, framework)
+    if spec is None:
+        return None
+    kind, key, builder, target_name = spec
+    tree_dir = os.path.join(DEP_CACHE_DIR, "trees", kind, key)
+    if os.path.exists(os.path.join(tree_dir, COMPLETE_MARKER)):
+        return kind, key, os.path.join(tree_dir, "tree"), target_name, True
+
+    os.makedirs(os.path.dirname(tree_dir), exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix=f".build-{key[:12]}-", dir=os.path.dirname(tree_dir))
+    try:
+        built = builder(project_dir, build_dir, offline, token=token)
+        _make_read_only(built)
+        staged = os.path.join(build_dir, "staged")
+        os.makedirs(staged)
+        os.rename(built, os.path.join(staged, "tree"))
+        open(os.path.join(staged, COMPLETE_MARKER), "w").close()
+        try:
+            os.rename(staged, tree_dir)
+        except OSError:
+            # Inny proces zbudował to samo drzewo w międzyczasie
+            if not os.path.exists(os.path.join(tree_dir, COMPLETE_MARKER)):
+                raise
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return kind, key, os.path.join(tree_dir, "tree"), target_name, False
+
+
+def install_dependencies(project_dir, framework, offline=DEP_CACHE_OFFLINE, token=None):
+    """
+    Installs a project's dependencies from the host-wide store.
+    Args:
+        project_dir (str): Project directory.
+        framework (str): Framework name (Next.js, Flask).
+        offline (bool): Never touch the network (works once the store is warm).
+        token (CancelToken): Cancellation token of the run; a running npm/pip install is killed when it is cancelled.
+    Returns:
+        dict: {"kind", "key", "hit", "link_mode", "seconds", "path"} or None if the project has no manifest.
+    Raises:
+        RuntimeError: If the dependencies could not be installed.
+    """
+    started = time.monotonic()
+    store = ensure_store_tree(project_dir, framework, offline=offline, token=token)
+    if store is None:
+        return None
+    kind, key, tree_path, target_name, hit = store
+
+    target = os.path.join(project_dir, target_name)
+    if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+    elif os.path.lexists(target):
+        os.remove(target)
+    link_mode = link_tree(tree_path, target)
+
+    result = {"kind": kind, "key": key, "hit": hit, "link_mode": link_mode, "seconds": round(time.monotonic() - started, 3), "path": target}
+    logging.info(f"Dependency store {'hit' if hit else 'miss'} for {project_dir} ({kind} {key[:12]}): {link_mode} in {result['seconds']}s")
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Warm the shared dependency store for generated projects.")
+    parser.add_argument("projects", nargs="+", help="Project directories")
+    parser.add_argument("--framework", required=True, help="Framework of the projects (e.g., Next.js, Flask)")
+    parser.add_argument("--offline", action="store_true", help="Do not access the network")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    for project in args.projects:
+        store = ensure_store_tree(project, args.framework, offline=args.offline or DEP_CACHE_OFFLINE)
+        print(json.dumps({"project": project, "key": store[1] if store else None, "hit": store[4] if store else None}))
@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import fcntl
+import uuid
+import logging
+
+EDIT_QUEUE_DIR = os.path.join(".factory", "edit_queue")
+# Okno debounce: czekamy, aż przez tyle sekund nie pojawi się nowa zmiana, ale nie dłużej niż EDIT_DEBOUNCE_MAX_SECONDS
+EDIT_DEBOUNCE_SECONDS = float(os.getenv("EDIT_DEBOUNCE_SECONDS", "3"))
+EDIT_DEBOUNCE_MAX_SECONDS = float(os.getenv("EDIT_DEBOUNCE_MAX_SECONDS", "15"))
+RESULT_TTL_SECONDS = 24 * 3600
+# Zmiana, której scalone edycje zawiodły tyle razy (lub czeka dłużej niż TTL), trafia do dead_letter zamiast
+# blokować kolejne edycje projektu
+EDIT_MAX_ATTEMPTS = int(os.getenv("EDIT_MAX_ATTEMPTS", "2"))
+EDIT_PENDING_TTL_SECONDS = float(os.getenv("EDIT_PENDING_TTL_SECONDS", "3600"))
+POLL_INTERVAL = 0.2
+
+
+def merge_changes(changes_list):
+    """Merges pending change descriptions into one instruction, dropping exact duplicates."""
+    unique = list(dict.fromkeys(re.sub(r"\s+", " ", c).strip() for c in changes_list if c and c.strip()))
+    if len(unique) == 1:
+        return unique[0]
+    return "Wprowadź kolejno wszystkie poniższe zmiany (późniejsze mają pierwszeństwo w razie konfliktu):\n" + "\n".join(
+        f"{i}. {change}" for i, change in enumerate(unique, start=1)
+    )
+
+
+class EditBatch:
+    """
+    Result of EditQueue.submit(). The leader (merged_result is None) holds the project lock and must call
+    complete() or abort(); a follower's change was already applied by another run described in merged_result.
+    """
+
+    def __init__(self, queue, request_id, changes, request_ids, merged_result=None, lock_fd=None):
+        self.queue = queue
+        self.request_id = request_id
+        self.changes = changes
+        self.request_ids = request_ids
+        self.merged_result = merged_result
+        self._lock_fd = lock_fd
+
+    @property
+    def is_leader(self):
+        return self.merged_result is None
+
+    def complete(self, result):
+        """Publishes the run result to every merged request, removes them from the queue and releases the lock."""
+        result = dict(result, batch_id=self.request_id, merged_requests=len(self.request_ids))
+        for request_id in self.request_ids:
+            if request_id != self.request_id:
+                self.queue._write_json(os.path.join(self.queue.results_dir, f"{request_id}.json"), result)
+            try:
+                os.remove(os.path.join(self.queue.pending_dir, f"{request_id}.json"))
+            except FileNotFoundError:
+                pass
+        self._release()
+
+    def abort(self, error=None):
+        """
+        Releases the lock after a run that did not apply the batch.
+        Cancelled (no error): every merged request is removed and its waiting process gets a "cancelled"
+        result, so the change is not silently applied by a later, unrelated edit.
+        Failed (error): this process already reported the failure of its own request, so that request is
+        dead-lettered; the other merged requests count a failed attempt and are retried by their still
+        waiting processes, until EDIT_MAX_ATTEMPTS dead-letters them with a failure result.
+        """
+        for request_id in self.request_ids:
+            if error is None:
+                self.queue._finish_pending(request_id, {"status": "cancelled", "error": "edit run was cancelled", "batch_id": self.request_id})
+            elif request_id == self.request_id:
+                self.queue._dead_letter(request_id, self.queue._read_pending(request_id) or {"changes": self.changes}, f"edit failed: {str(error)[:2000]}", notify=False)
+            else:
+                self.queue._record_failure(request_id, error)
+        self._release()
+
+    def _release(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class EditQueue:
+    """
+    Cross-process edit queue of one project.
+    Each edit request is spooled as a file; after a debounce window the first process to take the
+    project lock runs all pending changes as one merged edit. Different projects use different locks,
+    so they still run in parallel.
+    """
+
+    def __init__(self, project_dir):
+        self.root = os.path.join(project_dir, EDIT_QUEUE_DIR)
+        self.pending_dir = os.path.join(self.root, "pending")
+        self.results_dir = os.path.join(self.root, "results")
+        self.dead_letter_dir = os.path.join(self.root, "dead_letter")
+        self.lock_path = os.path.join(self.root, ".lock")
+        os.makedirs(self.pending_dir, exist_ok=True)
+        os.makedirs(self.results_dir, exist_ok=True)
+        os.makedirs(self.dead_letter_dir, exist_ok=True)
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _pending(self):
+        """Returns pending requests as [(request_id, data)] in submission order."""
+        pending = []
+        for name in sorted(os.listdir(self.pending_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.pending_dir, name), "r", encoding="utf-8") as f:
+                    pending.append((name[:-len(".json")], json.load(f)))
+            except (OSError, ValueError):
+                continue
+        return pending
+
+    def _read_pending(self, request_id):
+        try:
+            with open(os.path.join(self.pending_dir, f"{request_id}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _finish_pending(self, request_id, result):
+        """Removes a pending request and publishes its result for the waiting process."""
+        self._write_json(os.path.join(self.results_dir, f"{request_id}.json"), result)
+        try:
+            os.remove(os.path.join(self.pending_dir, f"{request_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def _dead_letter(self, request_id, data, reason, notify=True):
+        """Moves a pending request to dead_letter and (with notify) publishes a failure result for its waiting process."""
+        self._write_json(os.path.join(self.dead_letter_dir, f"{request_id}.json"), dict(data, reason=reason))
+        if notify:
+            self._finish_pending(request_id, {"status": "failed", "error": reason, "dead_lettered": True})
+        else:
+            try:
+                os.remove(os.path.join(self.pending_dir, f"{request_id}.json"))
+            except FileNotFoundError:
+                pass
+        logging.warning(f"Edit request {request_id} moved to dead letter: {reason}")
+
+    def _record_failure(self, request_id, error):
+        data = self._read_pending(request_id)
+        if data is None:
+            return
+        data["attempts"] = data.get("attempts", 0) + 1
+        data["last_error"] = str(error)[:2000]
+        if data["attempts"] >= EDIT_MAX_ATTEMPTS:
+            self._dead_letter(request_id, data, f"edit failed {data['attempts']} times: {data['last_error']}")
+        else:
+            self._write_json(os.path.join(self.pending_dir, f"{request_id}.json"), data)
+
+    def _wait_for_quiet(self):
+        started = time.monotonic()
+        while time.monotonic() - started < EDIT_DEBOUNCE_MAX_SECONDS:
+            submitted = [data.get("submitted_at", 0) for _, data in self._pending()]
+            if not submitted or time.time() - max(submitted) >= EDIT_DEBOUNCE_SECONDS:
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def _cleanup_results(self):
+        now = time.time()
+        for name in os.listdir(self.results_dir):
+            path = os.path.join(self.results_dir, name)
+            try:
+                if now - os.path.getmtime(path) > RESULT_TTL_SECONDS:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def submit(self, changes):
+        """
+        Spools the change, waits for the debounce window and the project lock.
+        Returns:
+            EditBatch: As leader, with the merged changes of all pending requests; as follower, with
+                       the result of the run that already applied this change.
+        """
+        # Nazwa zaczyna się od czasu, więc sortowanie nazw daje kolejność zgłoszeń
+        request_id = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._write_json(os.path.join(self.pending_dir, f"{request_id}.json"), {"changes": changes, "submitted_at": time.time()})
+        logging.info(f"Edit request {request_id} queued for {self.root}.")
+
+        self._wait_for_quiet()
+        lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+
+        if not os.path.exists(os.path.join(self.pending_dir, f"{request_id}.json")):
+            # Zmiana została już wykonana przez inny proces w ramach scalonej edycji
+            fcntl.flock(lock_fd, fcntl.LOCK_UN)
+            os.close(lock_fd)
+            result_path = os.path.join(self.results_dir, f"{request_id}.json")
+            try:
+                with open(result_path, "r", encoding="utf-8") as f:
+                    merged_result = json.load(f)
+                os.remove(result_path)
+            except (OSError, ValueError):
+                merged_result = {"status": "unknown"}
+            logging.info(f"Edit request {request_id} was merged into batch {merged_result.get('batch_id')}.")
+            return EditBatch(self, request_id, changes, [request_id], merged_result=merged_result)
+
+        pending = []
+        for pending_id, data in self._pending():
+            if pending_id != request_id and time.time() - data.get("submitted_at", 0) > EDIT_PENDING_TTL_SECONDS:
+                self._dead_letter(pending_id, data, f"pending for more than {EDIT_PENDING_TTL_SECONDS:.0f}s")
+            else:
+                pending.append((pending_id, data))
+        request_ids = [pending_id for pending_id, _ in pending]
+        merged = merge_changes([data.get("changes", "") for _, data in pending])
+        self._cleanup_results()
+        logging.info(f"Edit request {request_id} leads a batch of {len(request_ids)} merged requests.")
+        return EditBatch(self, request_id, merged, request_ids, lock_fd=lock_fd)
+
+    def acquire(self, changes):
+        """
+        Takes the project lock for an edit that is not merged with others (--no-coalesce): pending
+        requests are left for the next batch, but the run is still serialised with other edits.
+        Returns:
+            EditBatch: Leader batch with no queued requests.
+        """
+        lock_fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        return EditBatch(self, f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}", changes, [], lock_fd=lock_fd)
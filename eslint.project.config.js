@@ -0,0 +1,50 @@
+import pluginJs from "@eslint/js";
+import globals from "globals";
+
+// Konfiguracja ESLint dla wygenerowanych projektów (local_lint.py): JSX, zmienne globalne przeglądarki i Node.
+// Bez eslint-plugin-react komponenty używane tylko w JSX byłyby zgłaszane jako nieużywane (no-unused-vars),
+// więc reguła jsx-uses-vars jest tu odtworzona.
+const jsxUsesVars = {
+  meta: {type: "problem", schema: []},
+  create(context) {
+    function rootName(name) {
+      while (name.type === "JSXMemberExpression") {
+        name = name.object;
+      }
+      return name.type === "JSXIdentifier" ? name.name : null;
+    }
+    return {
+      JSXOpeningElement(node) {
+        const name = rootName(node.name);
+        // <div> to element HTML, ale <motion.div> i <Head> odwołują się do zmiennych
+        if (name && (node.name.type === "JSXMemberExpression" || !/^[a-z]/.test(name))) {
+          context.sourceCode.markVariableAsUsed(name, node);
+        }
+      },
+    };
+  },
+};
+
+export default [
+  pluginJs.configs.recommended,
+  {
+    files: ["**/*.{js,jsx,mjs,cjs}"],
+    plugins: {factory: {rules: {"jsx-uses-vars": jsxUsesVars}}},
+    languageOptions: {
+      ecmaVersion: "latest",
+      sourceType: "module",
+      parserOptions: {ecmaFeatures: {jsx: true}},
+      globals: {...globals.browser, ...globals.node},
+    },
+    rules: {"factory/jsx-uses-vars": "error"},
+  },
+  {
+    files: ["**/*.cjs"],
+    languageOptions: {sourceType: "commonjs"},
+  },
+  {
+    // Testy Jest ze szablonu Next.js (describe, test, expect, jest)
+    files: ["**/__tests__/**", "**/*.{test,spec}.{js,jsx,mjs,cjs}", "jest.setup.js"],
+    languageOptions: {globals: globals.jest},
+  },
+];
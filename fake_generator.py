@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import random
+
+from generate_project import build_arg_parser, validate_args
+from job_store import JobStore, JobRecorder
+from cancellation import RunCancelled, CancelToken, CANCELLED_EXIT_CODE
+
+# Szybka atrapa generate_project.py do testów obciążeniowych (FAKE_GENERATOR=1 w panelu i workerze):
+# ta sama linia poleceń, rekord zadania i etapy w job store, bez LLM, Supabase i zapisu plików.
+FAKE_GENERATOR = os.getenv("FAKE_GENERATOR", "false").lower() in ("1", "true", "yes")
+FAKE_GENERATOR_SCRIPT = os.path.abspath(__file__)
+FAKE_STAGE_SECONDS = float(os.getenv("FAKE_STAGE_SECONDS", "0.05"))
+FAKE_STAGES = int(os.getenv("FAKE_STAGES", "4"))
+# Odsetek przebiegów kończonych błędem (do sprawdzania raportowania błędów pod obciążeniem)
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_TOKENS_PER_STAGE = 1000
+
+
+def main():
+    # Dokładnie ta sama linia poleceń i walidacja co w generate_project.py: wywołanie odrzucone przez
+    # prawdziwy skrypt musi zawieść także w teście obciążeniowym
+    args = build_arg_parser().parse_args()
+    error = validate_args(args)
+    if error:
+        print(json.dumps({"status": "failure", "message": error}))
+        return 2
+
+    job_store = JobStore()
+    job = JobRecorder(job_store, job_store.create_job(args.project, "edit" if args.edit else "generate", {"fake": True}, job_id=args.job_id))
+    token = CancelToken(deadline_seconds=0, stage_deadline_seconds=0)
+    job.add_listener(token)
+    token.install()
+    job.start()
+    try:
+        for number in range(1, FAKE_STAGES + 1):
+            job.stage(f"ETAP {number}: fake")
+            token.wait(FAKE_STAGE_SECONDS)
+            job.add_tokens(FAKE_TOKENS_PER_STAGE)
+        if random.random() < FAKE_ERROR_RATE:
+            job.finish("failed", error="fake failure")
+            print(json.dumps({"status": "failure", "message": "fake failure"}))
+            return 1
+        result = {"status": "generation_attempt_finished", "project_name": args.project, "fake": True}
+        job.finish("succeeded", result)
+        print(json.dumps(result))
+        return 0
+    except RunCancelled as e:
+        token.disarm()
+        job.finish("cancelled", error=e.reason)
+        print(json.dumps({"status": "cancelled", "message": e.reason}))
+        return CANCELLED_EXIT_CODE
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+import os
+import re
+import sys
+import json
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Lokalna atrapa REST API Supabase (PostgREST) dla generation_mirror.py: tabele z pliku JSON albo z pamięci,
+# filtry kolumna=op.wartość, or=(...)/and(...), order i limit. Wartości filtrów są rzutowane na typ kolumny
+# jak w PostgreSQL (id 10 > 9, a nie "10" < "9"), więc kursor (updated_at, id) jest sprawdzany tak jak na produkcji.
+FAKE_POSTGREST_HOST = os.getenv("FAKE_POSTGREST_HOST", "127.0.0.1")
+FAKE_POSTGREST_PORT = int(os.getenv("FAKE_POSTGREST_PORT", "0"))
+FAKE_POSTGREST_MAX_ROWS = int(os.getenv("FAKE_POSTGREST_MAX_ROWS", "1000"))
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "gte": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "lte": lambda a, b: a <= b,
+}
+RESERVED_PARAMS = ("select", "order", "limit", "offset")
+
+
+class FilterError(ValueError):
+    """A filter or order expression the stand-in cannot parse (PostgREST answers 400 PGRST100)."""
+
+    code = "PGRST100"
+
+
+class UndefinedColumn(FilterError):
+    """A filter or order on a column the table does not have (PostgreSQL error 42703)."""
+
+    code = "42703"
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _typed(value, like):
+    # Rzutowanie jak w PostgreSQL: literał filtra przyjmuje typ kolumny, z którą jest porównywany
+    if value is None or like is None:
+        return value
+    if isinstance(like, bool):
+        return str(value).lower() == "true"
+    if isinstance(like, (int, float)):
+        return type(like)(value)
+    if isinstance(like, str) and _timestamp(like) is not None:
+        timestamp = _timestamp(value)
+        if timestamp is None:
+            raise FilterError(f"invalid input syntax for type timestamp: {value!r}")
+        return timestamp
+    return str(value)
+
+
+def _split_top_level(text):
+    """Splits a PostgREST logic list on commas outside parentheses and double quotes."""
+    parts, depth, quoted, current, escaped = [], 0, False, [], False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+            continue
+        if char == "\\" and quoted:
+            current.append(char)
+            escaped = True
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if quoted or depth:
+        raise FilterError(f"unbalanced quotes or parentheses in {text!r}")
+    parts.append("".join(current))
+    return [part for part in parts if part]
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    return value
+
+
+def _condition(column, expression):
+    """Returns a row predicate for `op.value` (optionally `not.op.value`) applied to column."""
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[len("not."):]
+    operator, _, value = expression.partition(".")
+    if operator == "is":
+        literal = {"null": None, "true": True, "false": False}.get(value.lower(), FilterError)
+        if literal is FilterError:
+            raise FilterError(f"unsupported is.{value}")
+        test = lambda row: row.get(column) is literal
+    elif operator in OPERATORS:
+        value = _unquote(value)
+        compare = OPERATORS[operator]
+        # Porównanie z NULL daje NULL, więc wiersz nie przechodzi filtra (także z not.)
+        test = lambda row: row.get(column) is not None and compare(_typed(row[column], row[column]), _typed(value, row[column]))
+    else:
+        raise FilterError(f"unsupported operator {operator!r}")
+    if negate:
+        return lambda row: row.get(column) is not None and not test(row)
+    return test
+
+
+def _logic(operator, text):
+    """Parses `(a.op.v,and(b.op.v,...))` into a predicate combining the conditions with and/or."""
+    if not (text.startswith("(") and text.endswith(")")):
+        raise FilterError(f"{operator} filter must be wrapped in parentheses: {text!r}")
+    predicates = []
+    for part in _split_top_level(text[1:-1]):
+        name, _, rest = part.partition("(")
+        if name in ("and", "or") and rest:
+            predicates.append(_logic(name, "(" + rest))
+        else:
+            column, _, expression = part.partition(".")
+            predicates.append(_condition(column, expression))
+    combine = all if operator == "and" else any
+    return lambda row: combine(predicate(row) for predicate in predicates)
+
+
+def _order_key(spec):
+    column, _, direction = spec.partition(".")
+    direction = direction or "asc"
+    if direction not in ("asc", "desc"):
+        raise FilterError(f"unsupported order direction {direction!r}")
+    # Domyślnie w PostgreSQL NULL-e są na końcu przy asc i na początku przy desc
+    return column, direction == "desc"
+
+
+def _referenced_columns(params):
+    columns = set()
+    for name, values in params.items():
+        if name == "order":
+            columns.update(_order_key(spec)[0] for value in values for spec in value.split(",") if spec)
+        elif name in ("or", "and"):
+            for value in values:
+                columns.update(re.findall(r"(?:^|[(,])(\w+)\.(?:not\.)?(?:eq|neq|gt|gte|lt|lte|is)\.", value))
+        elif name not in RESERVED_PARAMS:
+            columns.add(name)
+    return columns
+
+
+def query_rows(rows, params, table="table"):
+    """
+    Applies PostgREST query parameters (filters, or/and, order, limit, offset) to a list of row dicts.
+    Args:
+        params (dict): Query parameter name -> list of values (as returned by urllib.parse.parse_qs).
+    Returns:
+        list: Matching rows.
+    Raises:
+        FilterError: If a parameter uses syntax the stand-in does not support (UndefinedColumn for an unknown column).
+    """
+    if rows:
+        # Kolumny tabeli atrapy to klucze jej wierszy (jak w PostgreSQL brakująca kolumna daje błąd, a nie NULL)
+        known = set().union(*rows)
+        missing = sorted(_referenced_columns(params) - known)
+        if missing:
+            raise UndefinedColumn(f"column {table}.{missing[0]} does not exist")
+    predicates = []
+    for name, values in params.items():
+        if name in RESERVED_PARAMS:
+            continue
+        for value in values:
+            if name in ("or", "and"):
+                predicates.append(_logic(name, value))
+            else:
+                predicates.append(_condition(name, value))
+    result = [row for row in rows if all(predicate(row) for predicate in predicates)]
+    order = params.get("order", [""])[0]
+    for column, descending in reversed([_order_key(spec) for spec in order.split(",") if spec]):
+        present = [row for row in result if row.get(column) is not None]
+        missing = [row for row in result if row.get(column) is None]
+        present.sort(key=lambda row: _typed(row[column], row[column]), reverse=descending)
+        result = missing + present if descending else present + missing
+    offset = int(params.get("offset", ["0"])[0])
+    limit = min(int(params.get("limit", [str(FAKE_POSTGREST_MAX_ROWS)])[0]), FAKE_POSTGREST_MAX_ROWS)
+    return result[offset:offset + limit]
+
+
+class FakePostgrest:
+    """
+    In-process PostgREST stand-in serving GET /<table> from in-memory rows.
+    The tables dict may be changed between requests (under `lock`) to simulate remote writes.
+    """
+
+    def __init__(self, tables=None, host=FAKE_POSTGREST_HOST, port=FAKE_POSTGREST_PORT):
+        self.tables = tables if tables is not None else {}
+        self.lock = threading.Lock()
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                table = url.path.strip("/").split("/")[-1]
+                params = parse_qs(url.query, keep_blank_values=True)
+                with stand_in.lock:
+                    stand_in.requests.append(params)
+                    rows = stand_in.tables.get(table)
+                    if rows is None:
+                        return self._reply(404, {"code": "42P01", "message": f'relation "public.{table}" does not exist'})
+                    try:
+                        result = query_rows(rows, params, table)
+                    except (ValueError, TypeError) as e:
+                        return self._reply(400, {"code": getattr(e, "code", "PGRST100"), "message": str(e)})
+                self._reply(200, result)
+
+            def _reply(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Fake PostgREST: {format % args}")
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-postgrest", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _generation(row_id, updated_at, status="completed", version=1):
+    return {"id": row_id, "project_name": f"project-{row_id}", "status": status, "updated_at": updated_at, "version": version}
+
+
+def check_mirror_sync(page_size=3):
+    """
+    Syncs a GenerationMirror against the stand-in and verifies keyset pagination on (updated_at, id):
+    ties on updated_at that straddle page boundaries, integer ids that sort differently as text,
+    rows written later with the cursor's updated_at, updates of already mirrored rows, and a clear error
+    for a table that lacks the updated_at column (not yet migrated).
+    Returns:
+        list: Error messages (empty when the mirror matches the remote table).
+    """
+    from generation_mirror import GenerationMirror, MIRROR_TABLE, MISSING_UPDATED_AT
+
+    errors = []
+    t = ["2026-01-01T10:00:00+00:00", "2026-01-01T10:00:01+00:00", "2026-01-01T10:00:02.5+00:00", "2026-01-01T10:00:03+00:00"]
+    # 4 wiersze z tym samym updated_at przechodzą przez granicę strony (3), id 8..12 z kolei porównane jako tekst
+    # dałyby "10" < "8" i kursor pominąłby wiersze
+    rows = [_generation(i, t[0]) for i in (1, 2, 3, 4)] + [_generation(5, t[1])] + [_generation(i, t[2]) for i in (6, 7)]
+    rows += [_generation(i, t[3]) for i in (8, 9, 10, 11, 12)]
+    stand_in = FakePostgrest({MIRROR_TABLE: rows}).start()
+    mirror = GenerationMirror(path=":memory:", rest_url=stand_in.url, api_key="fake", page_size=page_size)
+
+    def verify(step, result, expected_rows):
+        if not result["ok"]:
+            errors.append(f"{step}: sync failed: {result['error']}")
+            return
+        if result["rows"] != expected_rows:
+            errors.append(f"{step}: synced {result['rows']} rows, expected {expected_rows} (rows skipped or fetched twice)")
+        with stand_in.lock:
+            remote = {str(row["id"]): row for row in stand_in.tables[MIRROR_TABLE]}
+        local, _ = mirror.list_generations(limit=len(remote) + 10, max_age=float("inf"))
+        local = {str(row["id"]): row for row in local}
+        missing = sorted(set(remote) - set(local), key=int)
+        if missing:
+            errors.append(f"{step}: rows missing from the mirror: {', '.join(missing)}")
+        stale = sorted((key for key in remote if key in local and local[key] != remote[key]), key=int)
+        if stale:
+            errors.append(f"{step}: rows out of date in the mirror: {', '.join(stale)}")
+
+    try:
+        verify("initial sync", mirror.sync(), len(rows))
+        # Zapisy po synchronizacji: ten sam updated_at co kursor z większym id, nowsza wersja istniejącego wiersza
+        # (updated_at przesunięty tak jak robi to trigger z MIRROR_MIGRATION)
+        with stand_in.lock:
+            stand_in.tables[MIRROR_TABLE].append(_generation(13, t[3]))
+            stand_in.tables[MIRROR_TABLE].append(_generation(14, t[3], status="running"))
+            stand_in.tables[MIRROR_TABLE][1] = _generation(2, "2026-01-01T10:00:04+00:00", status="failed", version=2)
+        verify("incremental sync", mirror.sync(), 3)
+        verify("idle sync", mirror.sync(), 0)
+
+        # Tabela sprzed migracji (bez updated_at): synchronizacja ma zawieść z jasnym komunikatem
+        legacy = GenerationMirror(path=":memory:", rest_url=stand_in.url, api_key="fake", page_size=page_size)
+        with stand_in.lock:
+            stand_in.tables[MIRROR_TABLE] = [{k: v for k, v in row.items() if k != "updated_at"} for row in rows]
+        result = legacy.sync()
+        legacy.close()
+        if result["ok"] or result["error"] != MISSING_UPDATED_AT:
+            errors.append(f"table without updated_at: expected the missing column error, got {result}")
+    finally:
+        mirror.close()
+        stand_in.stop()
+    return errors
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local PostgREST stand-in for the project_generations mirror.")
+    parser.add_argument("--check", action="store_true", help="Verify keyset sync of generation_mirror.py against the stand-in and exit")
+    parser.add_argument("--page-size", type=int, default=3, help="Mirror page size used by --check")
+    parser.add_argument("--fixture", help="JSON file {table: [rows]} to serve (point MIRROR_REST_URL at the printed URL)")
+    parser.add_argument("--port", type=int, default=FAKE_POSTGREST_PORT, help="Port to listen on (0 = any free port)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.check:
+        problems = check_mirror_sync(page_size=args.page_size)
+        for problem in problems:
+            print(f"BŁĄD: {problem}")
+        if not problems:
+            print(f"OK: mirror keyset sync matches the remote table (page size {args.page_size}).")
+        sys.exit(1 if problems else 0)
+    tables = {}
+    if args.fixture:
+        with open(args.fixture, "r", encoding="utf-8") as f:
+            tables = json.load(f)
+    server = FakePostgrest(tables, port=args.port)
+    print(f"Fake PostgREST listening on {server.url} (tables: {', '.join(tables) or 'none'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,417 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import socketserver
+
+# Lokalna atrapa serwera Redis (protokół RESP2) dla RedisBroker z job_broker.py: tylko polecenia używane przez
+# brokera (hashe, zbiory sortowane, SET/GET z EX), dane w pamięci procesu. Pozwala uruchomić workery z
+# JOB_BROKER_URL=redis://127.0.0.1:<port> bez Redisa i sprawdzić brokera (--check).
+FAKE_REDIS_HOST = os.getenv("FAKE_REDIS_HOST", "127.0.0.1")
+FAKE_REDIS_PORT = int(os.getenv("FAKE_REDIS_PORT", "0"))
+
+
+class CommandError(Exception):
+    """Error reply sent to the client (the message starts with the Redis error code, e.g. "ERR")."""
+
+
+def _score(value, exclusive_ok=False):
+    text = value.decode("utf-8")
+    exclusive = exclusive_ok and text.startswith("(")
+    if exclusive:
+        text = text[1:]
+    try:
+        return float({"-inf": "-inf", "+inf": "inf", "inf": "inf"}.get(text, text)), exclusive
+    except ValueError:
+        raise CommandError("ERR min or max is not a float")
+
+
+def _format_score(score):
+    return repr(int(score)) if score == int(score) else repr(score)
+
+
+class FakeRedisStore:
+    """In-memory keyspace: bytes strings (with optional expiry), hashes and sorted sets."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, kind):
+        if key in self.expires and self.expires[key] <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def execute(self, args):
+        name = args[0].decode("utf-8").upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        with self.lock:
+            return handler(*args[1:])
+
+    def cmd_ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_select(self, db):
+        return "OK"
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = bytes(value)
+        self.expires.pop(key, None)
+        options = [option.decode("utf-8").upper() for option in options]
+        if "EX" in options:
+            self.expires[key] = time.time() + float(options[options.index("EX") + 1])
+        return "OK"
+
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_del(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def _hash(self, key, create=False):
+        value = self._get(key, dict)
+        if value is None and create:
+            value = self.data[key] = {}
+        return value
+
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise CommandError("ERR wrong number of arguments for 'hset' command")
+        target = self._hash(key, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in target
+            target[field] = bytes(value)
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        target = self._hash(key, create=True)
+        if field in target:
+            return 0
+        target[field] = bytes(value)
+        return 1
+
+    def cmd_hget(self, key, field):
+        return (self._hash(key) or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        target = self._hash(key) or {}
+        return [target.get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        return [item for pair in (self._hash(key) or {}).items() for item in pair]
+
+    def cmd_hincrby(self, key, field, increment):
+        target = self._hash(key, create=True)
+        try:
+            value = int(target.get(field, b"0") or 0) + int(increment)
+        except ValueError:
+            raise CommandError("ERR hash value is not an integer")
+        target[field] = str(value).encode()
+        return value
+
+    def _zset(self, key, create=False):
+        value = self._get(key, dict)
+        if value is None and create:
+            value = self.data[key] = {}
+        return value
+
+    def cmd_zadd(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise CommandError("ERR syntax error")
+        target = self._zset(key, create=True)
+        added = 0
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in target
+            target[member] = _score(score)[0]
+        return added
+
+    def cmd_zrem(self, key, *members):
+        target = self._zset(key) or {}
+        return sum(1 for member in members if target.pop(member, None) is not None)
+
+    def cmd_zcard(self, key):
+        return len(self._zset(key) or {})
+
+    def cmd_zscore(self, key, member):
+        score = (self._zset(key) or {}).get(member)
+        return None if score is None else _format_score(score).encode()
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        (low, low_open), (high, high_open) = _score(low, True), _score(high, True)
+        members = sorted((self._zset(key) or {}).items(), key=lambda item: (item[1], item[0]))
+        result = [member for member, score in members
+                  if (score > low if low_open else score >= low) and (score < high if high_open else score <= high)]
+        options = [option.decode("utf-8").upper() for option in options]
+        if options:
+            if options[0] != "LIMIT" or len(options) != 3:
+                raise CommandError("ERR syntax error")
+            offset, count = int(options[1]), int(options[2])
+            result = result[offset:] if count < 0 else result[offset:offset + count]
+        return result
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeRedis:
+    """RESP2 server over a FakeRedisStore, started in a daemon thread."""
+
+    def __init__(self, host=FAKE_REDIS_HOST, port=FAKE_REDIS_PORT, password=None):
+        self.store = FakeRedisStore(password)
+        store = self.store
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                authenticated = store.password is None
+                while True:
+                    try:
+                        args = self._read_command()
+                    except (ConnectionError, ValueError):
+                        return
+                    if args is None:
+                        return
+                    try:
+                        if args[0].upper() == b"AUTH":
+                            authenticated = args[-1].decode("utf-8") == store.password
+                            if not authenticated:
+                                raise CommandError("WRONGPASS invalid username-password pair")
+                            reply = "OK"
+                        elif not authenticated:
+                            raise CommandError("NOAUTH Authentication required.")
+                        else:
+                            reply = store.execute(args)
+                    except CommandError as e:
+                        self.wfile.write(b"-%s\r\n" % str(e).encode("utf-8"))
+                        continue
+                    except (TypeError, ValueError, IndexError):
+                        self.wfile.write(b"-ERR wrong number or type of arguments\r\n")
+                        continue
+                    self.wfile.write(_encode_reply(reply))
+
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b"*"):
+                    # Polecenie inline (np. z telnetu)
+                    return line.strip().split() or None
+                args = []
+                for _ in range(int(line[1:])):
+                    header = self.rfile.readline()
+                    if not header.startswith(b"$"):
+                        raise ValueError("expected a bulk string")
+                    length = int(header[1:])
+                    data = self.rfile.read(length + 2)
+                    if len(data) != length + 2:
+                        raise ConnectionError("client closed the connection")
+                    args.append(data[:-2])
+                return args
+
+        self._server = _Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-redis", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def _encode_reply(reply):
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return b"+%s\r\n" % reply.encode("utf-8")
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    return b"*%d\r\n" % len(reply) + b"".join(_encode_reply(item) for item in reply)
+
+
+def _check_restore(broker, errors):
+    """A worker with a stale copy of a project restores it from the broker's latest archive."""
+    from artifact_store import ArtifactStore
+    from job_worker import Worker, WORKER_SNAPSHOT_MARKER
+
+    workdir = tempfile.mkdtemp(prefix="fake-redis-check-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        os.makedirs("projects/demo/src")
+        with open("projects/demo/src/app.js", "w", encoding="utf-8") as f:
+            f.write("v2\n")
+        store = ArtifactStore(os.path.join(workdir, "store"))
+        store.ingest("demo", "projects/demo", dedup_worktree="off")
+        archive = b"".join(store.export_stream("demo"))
+        store.close()
+        broker.submit("restore-1", {"project": "demo", "mode": "edit", "params": {}})
+        claimed = broker.claim("host-a")
+        broker.complete(claimed["id"], "host-a", "succeeded", archive=archive)
+
+        # Ten host ma starszą wersję (inny znacznik) i plik, którego nie ma w archiwum
+        with open("projects/demo/src/app.js", "w", encoding="utf-8") as f:
+            f.write("v1\n")
+        with open("projects/demo/stale.js", "w", encoding="utf-8") as f:
+            f.write("old\n")
+        os.makedirs("projects/demo/.factory", exist_ok=True)
+        with open(os.path.join("projects/demo", WORKER_SNAPSHOT_MARKER), "w", encoding="utf-8") as f:
+            f.write("older-job")
+        worker = Worker(broker, worker_id="host-b")
+        worker._fetch_project("demo")
+        with open("projects/demo/src/app.js", "r", encoding="utf-8") as f:
+            if f.read() != "v2\n":
+                errors.append("stale project copy was not restored from the latest archive")
+        if os.path.exists("projects/demo/stale.js"):
+            errors.append("file missing from the archive was left in the restored project")
+        with open(os.path.join("projects/demo", WORKER_SNAPSHOT_MARKER), "r", encoding="utf-8") as f:
+            if f.read() != "restore-1":
+                errors.append("restored project is not marked with the archive's job id")
+        # Aktualna kopia (ten sam znacznik) nie jest ponownie odtwarzana
+        with open("projects/demo/src/app.js", "w", encoding="utf-8") as f:
+            f.write("local\n")
+        worker._fetch_project("demo")
+        with open("projects/demo/src/app.js", "r", encoding="utf-8") as f:
+            if f.read() != "local\n":
+                errors.append("up-to-date project copy was restored again")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_broker():
+    """
+    Runs RedisBroker against the stand-in: duplicate submits, concurrent claims (one winner), heartbeats,
+    completion with a binary archive, failed attempts with backoff, lease expiry, cancellation, the
+    status update cursor and the worker's restore of a stale project copy.
+    Returns:
+        list: Error messages (empty when the broker behaves as expected).
+    """
+    from job_broker import get_broker
+
+    errors = []
+    server = FakeRedis(password="secret").start()
+    url = server.url.replace("redis://", "redis://:secret@")
+    brokers = [get_broker(url) for _ in range(4)]
+    broker = brokers[0]
+    try:
+        broker.submit("job-1", {"project": "demo", "mode": "generate", "params": {"framework": "nextjs"}})
+        broker.submit("job-1", {"project": "other", "mode": "generate", "params": {}})
+        if broker.get("job-1")["project"] != "demo":
+            errors.append("duplicate submit overwrote the job")
+
+        claims = {}
+        threads = [threading.Thread(target=lambda b=b, i=i: claims.__setitem__(i, b.claim(f"worker-{i}"))) for i, b in enumerate(brokers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        winners = [i for i, claim in claims.items() if claim]
+        if len(winners) != 1:
+            errors.append(f"{len(winners)} workers claimed the same job")
+            return errors
+        owner, worker_id = brokers[winners[0]], f"worker-{winners[0]}"
+        if not owner.heartbeat("job-1", worker_id, {"status": "running"}):
+            errors.append("lease holder's heartbeat was rejected")
+        if broker.heartbeat("job-1", "intruder"):
+            errors.append("heartbeat of a worker without the lease was accepted")
+
+        archive = bytes(range(256)) * 4 + b"\r\n$-1\r\n"
+        if not owner.complete("job-1", worker_id, "succeeded", result={"ok": True}, archive=archive):
+            errors.append("completion by the lease holder was rejected")
+        if broker.latest_archive_job("demo") != "job-1" or broker.latest_archive("demo") != archive:
+            errors.append("latest archive of the project does not round-trip")
+        if broker.get("job-1")["result"] != {"ok": True}:
+            errors.append("job result was not stored")
+
+        broker.submit("job-2", {"project": "demo", "mode": "edit", "params": {"changes": "x"}})
+        claimed = broker.claim("worker-a")
+        if broker.fail(claimed["id"], "worker-a", "boom") != "queued" or broker.claim("worker-a") is not None:
+            errors.append("failed attempt was not queued again with a backoff")
+        if broker.get("job-2")["attempts"] != 1:
+            errors.append("failed attempt was not counted")
+
+        broker.submit("job-3", {"project": "demo", "mode": "generate", "params": {}})
+        broker.claim("worker-a", lease_seconds=0.05)
+        time.sleep(0.1)
+        reclaimed = brokers[1].claim("worker-b")
+        if not reclaimed or reclaimed["id"] != "job-3" or reclaimed["attempts"] != 2:
+            errors.append(f"expired lease was not claimed again: {reclaimed}")
+
+        broker.submit("job-4", {"project": "demo", "mode": "generate", "params": {}})
+        if not broker.cancel("job-4") or not broker.cancel_requested("job-4") or broker.claim("worker-a") is not None:
+            errors.append("cancelled job is still claimable")
+
+        updates = broker.updates(0.0)
+        if {job["id"] for job in updates} != {"job-1", "job-2", "job-3", "job-4"}:
+            errors.append(f"status updates missed jobs: {sorted(job['id'] for job in updates)}")
+        if broker.updates(max(job["updated_at"] for job in updates)):
+            errors.append("status update cursor returned already synced jobs")
+
+        if shutil.which("zstd") or _has_zstandard():
+            _check_restore(brokers[2], errors)
+        else:
+            logging.warning("zstandard/zstd not available, skipping the project restore check.")
+    finally:
+        for item in brokers:
+            item.close()
+        server.stop()
+    return errors
+
+
+def _has_zstandard():
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in for the job broker (JOB_BROKER_URL=redis://...).")
+    parser.add_argument("--check", action="store_true", help="Verify RedisBroker and the worker's project restore against the stand-in and exit")
+    parser.add_argument("--port", type=int, default=FAKE_REDIS_PORT, help="Port to listen on (0 = any free port)")
+    parser.add_argument("--password", help="Require AUTH with this password")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.check:
+        problems = check_broker()
+        for problem in problems:
+            print(f"BŁĄD: {problem}")
+        if not problems:
+            print("OK: RedisBroker works against the RESP stand-in.")
+        sys.exit(1 if problems else 0)
+    server = FakeRedis(port=args.port, password=args.password)
+    print(f"Fake Redis listening on {server.url} (set JOB_BROKER_URL to it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -1,50 +1,27 @@
+import sys
+from profiling import start_import_timing, RunProfiler
+if "--profile" in sys.argv:
+    # Pomiar czasu importów musi zacząć się przed ciężkimi importami (crewai, litellm, supabase)
+    start_import_timing()
 import argparse
 import json
 import os
 import re
 import logging
+import shutil
+import subprocess
 import time
-import requests
-import yaml
-from dotenv import load_dotenv
-from agents.core_agents import ProjectPlannerAgent, CodeGeneratorAgent, CodeReviewerAgent, TestGeneratorAgent, DeploymentAgent, DatabaseAgent, RateLimiter, SupabaseTool, QualityAssuranceAgent, MonitoringAgent, FeedbackAgent # Import necessary agents and tools, including QualityAssuranceAgent
-from agents.project_editor_agent import ProjectEditorAgent # Import ProjectEditorAgent
-from agents.self_improve_agent import SelfImproveAgent # Import SelfImproveAgent
-from crewai import Crew, Process, Agent, Task
-from supabase import create_client
-from utils import get_secret # Import get_secret from utils
-
-load_dotenv()
-
-# Konfiguracja LiteLLM (dodana w celu rozwiązania błędu "LLM Provider NOT provided")
-import litellm
-import os
-
-# Ustaw domyślny model i klucz API dla litellm, nawet jeśli agenci używają ChatGoogleGenerativeAI
-# Może to zapobiec błędom, jeśli CrewAI/mem0 próbuje użyć litellm wewnętrznie
-litellm.set_verbose(True) # Włącz szczegółowe logowanie litellm dla debugowania
-litellm.model = "gemini-1.5-flash" # Ustaw domyślny model
-litellm.api_key = os.getenv("GOOGLE_API_KEY") # Ustaw domyślny klucz API
-
-
-# Debugging zmiennych środowiskowych
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_KEY") # Używamy SUPABASE_SERVICE_KEY dla spójności
-# print(f"SUPABASE_URL: {supabase_url}") # Komentujemy, żeby nie logować kluczy
-# print(f"SUPABASE_SERVICE_KEY: {supabase_key}") # Komentujemy, żeby nie logować kluczy
+from config import get_settings, get_supabase_client, configure_litellm
+from cancellation import RunCancelled, CancelToken, timeout_for, run_process, CANCELLED_EXIT_CODE
 
-if not supabase_url or not supabase_key:
-    raise ValueError("Brak wymaganych zmiennych: SUPABASE_URL lub SUPABASE_SERVICE_KEY")
-
-supabase = create_client(supabase_url, supabase_key)
-
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Usunięto zduplikowaną funkcję get_secret, teraz importowana z utils.py
-api_key = get_secret('gemini_api_key')
+# Ciężkie zależności (crewai, litellm, supabase, langchain, requests) i moduły używane tylko przy generowaniu
+# są importowane dopiero w main() po walidacji argumentów: --help i błędne wywołania kończą się w milisekundach,
+# a tryb edycji nie ładuje kodu generowania.
 
 def load_config_from_yaml(filepath):
     """Loads configuration from a YAML file."""
+    import yaml
+
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             return yaml.safe_load(f)
@@ -55,7 +32,7 @@ def load_config_from_yaml(filepath):
         logging.error(f"Error parsing YAML file {filepath}: {e}")
         return None
 
-def create_supabase_table(table_name, schema):
+def create_supabase_table(table_name, schema, token=None):
     """
     Creates a table in Supabase with the given schema using the Management API.
     Schema is expected to be a list of column definitions as strings (e.g., ["id UUID PRIMARY KEY", "name TEXT"]).
@@ -63,6 +40,8 @@ def create_supabase_table(table_name, schema):
     NOTE: This conversion might be lossy or incomplete depending on the complexity of the schema strings.
     A more robust solution would involve a structured schema definition from the planning agent.
     """
+    import requests
+
     supabase_url = os.getenv("SUPABASE_URL")
     supabase_service_key = os.getenv("SUPABASE_SERVICE_KEY")
 
@@ -156,7 +135,7 @@ def create_supabase_table(table_name, schema):
     logging.debug(f"Payload: {json.dumps(payload)}")
 
     try:
-        response = requests.post(management_api_url, headers=headers, json=payload)
+        response = requests.post(management_api_url, headers=headers, json=payload, timeout=timeout_for(token))
         response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
 
         logging.info(f"Supabase table creation response status: {response.status_code}")
@@ -188,34 +167,50 @@ def create_supabase_table(table_name, schema):
         return {"status": "failure", "message": f"An unexpected error occurred: {str(e)}"}
 
 
-# Mapping of agent roles to agent classes for dynamic loading
+# Mapping of agent roles to agent classes (module, class) for dynamic loading; modules are imported on first use
 AGENT_CLASS_MAP = {
-    'Project Planner': ProjectPlannerAgent,
-    'Code Generator': CodeGeneratorAgent,
-    'Code Reviewer': CodeReviewerAgent,
-    'Test Generator': TestGeneratorAgent,
-    'Deployment Specialist': DeploymentAgent,
-    'Database Manager': DatabaseAgent,
-    'Monitoring Specialist': MonitoringAgent,
-    'Feedback Analyst': FeedbackAgent,
-    'Quality Assurance Specialist': QualityAssuranceAgent,
-    'Project Editor': ProjectEditorAgent,
-    'Code Improvement Specialist': SelfImproveAgent,
+    'Project Planner': ('agents.core_agents', 'ProjectPlannerAgent'),
+    'Code Generator': ('agents.core_agents', 'CodeGeneratorAgent'),
+    'Code Reviewer': ('agents.core_agents', 'CodeReviewerAgent'),
+    'Test Generator': ('agents.core_agents', 'TestGeneratorAgent'),
+    'Deployment Specialist': ('agents.core_agents', 'DeploymentAgent'),
+    'Database Manager': ('agents.core_agents', 'DatabaseAgent'),
+    'Monitoring Specialist': ('agents.core_agents', 'MonitoringAgent'),
+    'Feedback Analyst': ('agents.core_agents', 'FeedbackAgent'),
+    'Quality Assurance Specialist': ('agents.core_agents', 'QualityAssuranceAgent'),
+    'Project Editor': ('agents.project_editor_agent', 'ProjectEditorAgent'),
+    'Code Improvement Specialist': ('agents.self_improve_agent', 'SelfImproveAgent'),
 }
 
-def fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token=None):
+def get_agent_class(role):
+    """Returns the agent class for a role (importing its module), or None for an unknown role."""
+    import importlib
+
+    if role not in AGENT_CLASS_MAP:
+        return None
+    module_name, class_name = AGENT_CLASS_MAP[role]
+    return getattr(importlib.import_module(module_name), class_name)
+
+def fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token=None, file_paths=None, token=None):
     """
     Fetches SonarQube analysis results (issues) for a given project and parses them.
     Assumes SonarQube API is available at sonar_url.
+    If file_paths is given, only issues of those project-relative files are fetched.
     """
+    import requests
+
     issues_api_url = f"{sonar_url}/api/issues/search"
     headers = {}
     if sonar_token:
         # Assuming token-based authentication
         headers["Authorization"] = f"Bearer {sonar_token}"
 
+    component_keys = project_name
+    if file_paths:
+        component_keys = ",".join(f"{project_name}:{file_path}" for file_path in file_paths)
+
     params = {
-        "componentKeys": project_name,
+        "componentKeys": component_keys,
         "types": "CODE_SMELL,BUG,VULNERABILITY,SECURITY_HOTSPOT", # Fetch common issue types
         "ps": 500 # Page size, adjust if needed
     }
@@ -226,7 +221,7 @@ def fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token=None):
         params["p"] = page
         logging.info(f"Fetching SonarQube issues page {page} for project {project_name} from {issues_api_url}")
         try:
-            response = requests.get(issues_api_url, headers=headers, params=params)
+            response = requests.get(issues_api_url, headers=headers, params=params, timeout=timeout_for(token))
             response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
             data = response.json()
 
@@ -254,16 +249,213 @@ def fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token=None):
     return all_issues
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate or edit a project.")
-    parser.add_argument("--project", required=True, help="Name of the project")
+def rescan_sonar_files(project_name, project_dir, sonar_url, sonar_token, file_paths, timeout=300, token=None):
+    """
+    Re-runs sonar-scanner restricted to the given files and fetches their current issues.
+    Returns a list of issues for those files, or None if the rescan could not be completed.
+    """
+    import requests
+
+    scanner = shutil.which("sonar-scanner")
+    if not scanner:
+        logging.warning("sonar-scanner not found in PATH. Cannot rescan touched files.")
+        return None
+
+    command = [
+        scanner,
+        f"-Dsonar.projectKey={project_name}",
+        "-Dsonar.sources=.",
+        f"-Dsonar.inclusions={','.join(file_paths)}",
+        f"-Dsonar.host.url={sonar_url}",
+    ]
+    if sonar_token:
+        command.append(f"-Dsonar.token={sonar_token}")
+
+    logging.info(f"Rescanning {len(file_paths)} touched files with SonarQube...")
+    try:
+        run_process(command, token=token, timeout=timeout, cwd=project_dir).check_returncode()
+    except (subprocess.SubprocessError, OSError) as e:
+        logging.error(f"sonar-scanner failed: {e}")
+        return None
+
+    # Analysis is processed asynchronously by the SonarQube compute engine; wait for the task
+    report_path = os.path.join(project_dir, ".scannerwork", "report-task.txt")
+    try:
+        with open(report_path, "r", encoding="utf-8") as f:
+            report = dict(line.strip().split("=", 1) for line in f if "=" in line)
+    except OSError:
+        report = {}
+
+    ce_task_url = report.get("ceTaskUrl")
+    if ce_task_url:
+        headers = {"Authorization": f"Bearer {sonar_token}"} if sonar_token else {}
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                response = requests.get(ce_task_url, headers=headers, timeout=timeout_for(token, 10))
+                response.raise_for_status()
+                status = response.json().get("task", {}).get("status")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.error(f"Error polling SonarQube compute engine task: {e}")
+                return None
+            if status == "SUCCESS":
+                break
+            if status in ("FAILED", "CANCELED"):
+                logging.error(f"SonarQube analysis task ended with status {status}.")
+                return None
+            if token is not None:
+                token.wait(2)
+            else:
+                time.sleep(2)
+        else:
+            logging.error("Timed out waiting for SonarQube analysis task.")
+            return None
+
+    return fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token, file_paths=file_paths, token=token)
+
+
+def rollback_project(project_name, target):
+    """
+    Restores the project files to a stage snapshot (--rollback-to), without loading agents or calling any LLM.
+    Returns:
+        int: Process exit code.
+    """
+    from project_history import ProjectHistory
+    from artifact_store import snapshot_project
+
+    project_dir = os.path.join("projects", project_name)
+    try:
+        restored = ProjectHistory(project_dir).rollback_to(target)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(json.dumps({"status": "failure", "message": str(e)}))
+        logging.error(f"Rollback of {project_name} to {target} failed: {e}")
+        return 1
+    # Eksport z magazynu artefaktów ma odpowiadać przywróconemu drzewu
+    snapshot_project(project_name, project_dir)
+    print(json.dumps({"status": "rolled_back", "project_name": project_name, **restored}))
+    return 0
+
+
+def validate_args(args):
+    """
+    Checks the arguments before any heavy import; in generation mode fills framework/features from --config.
+    Returns:
+        str: Error message, or None if the arguments are valid.
+    """
+    if args.worker:
+        return None
+    if not args.project:
+        return "BŁĄD: --project jest wymagany (poza trybem --worker)."
+    if args.rollback_to:
+        return None
+    if args.edit:
+        if not args.changes:
+            return "BŁĄD: --changes jest wymagany w trybie edycji."
+        return None
+    if not args.framework or not args.features:
+        # Sprawdź, czy podano --config
+        if not args.config:
+            return "BŁĄD: W trybie generowania wymagane są argumenty --framework i --features lub --config."
+        config_data = load_config_from_yaml(args.config)
+        if config_data:
+            args.framework = args.framework or config_data.get('framework')
+            args.features = args.features or config_data.get('features')
+        if not args.framework or not args.features:
+            return "BŁĄD: Plik konfiguracyjny musi zawierać 'framework' i 'features'."
+    return None
+
+
+def build_arg_parser():
+    """Command line of the script (also used by fake_generator.py, so load tests exercise the same argument handling)."""
+    parser = argparse.ArgumentParser(
+        description="Generate or edit a project.",
+        epilog="Time limits are off unless set with --deadline/--stage-deadline or RUN_DEADLINE_SECONDS, "
+               "STAGE_DEADLINE_SECONDS and STAGE_DEADLINES (e.g. {\"ETAP 5\": 1800}). SIGTERM/SIGINT, a cancel from "
+               "the panel or broker, or a passed time limit stop the run at its next checkpoint; a run that has not "
+               f"exited CANCEL_GRACE_SECONDS (default 10) later exits with code {CANCELLED_EXIT_CODE}."
+    )
+    parser.add_argument("--project", help="Name of the project (required unless --worker)")
     parser.add_argument("--framework", help="Framework to use (e.g., Next.js, Flask)")
     parser.add_argument("--features", help="Comma-separated list of features (e.g., Uwierzytelnie Supabase, tabela todos)")
     parser.add_argument("--edit", action="store_true", help="Edit an existing project")
     parser.add_argument("--changes", help="Description of changes to implement")
     parser.add_argument("--config", help="Path to a JSON configuration file") # Dodajemy argument --config
-    args = parser.parse_args()
+    parser.add_argument("--job-id", help="Id of the job record in the local job store (created by the panel); a new job is created if omitted")
+    parser.add_argument("--profile", action="store_true", help="Profile the run: import times, per-stage cProfile, wall/CPU and sleep time, collapsed stacks")
+    parser.add_argument("--profile-dir", help="Directory for the profiling report (default: projects/<project>/.factory/profiles/<job id>)")
+    parser.add_argument("--debug", action="store_true", help="Debug verbosity: DEBUG logs without sampling, verbose agents and crews (same as LOG_MODE=debug)")
+    parser.add_argument("--rollback-to", metavar="STAGE", help="Restore the project files to the git snapshot of a stage (edit, codegen, review, quality, test_generation, deployment_preparation) or a commit id, without rerunning any LLM stage")
+    parser.add_argument("--worker", action="store_true", help="Run as a worker: pull generate/edit jobs from the job broker (JOB_BROKER_URL) instead of running one project")
+    parser.add_argument("--broker", help="Job broker URL for --worker, e.g. sqlite:///path/broker.db or redis://host:6379/0 (default: JOB_BROKER_URL)")
+    parser.add_argument("--worker-slots", type=int, help="Jobs run concurrently by this worker (default: WORKER_SLOTS or 1)")
+    parser.add_argument("--max-jobs", type=int, help="Stop the worker after this many jobs")
+    parser.add_argument("--deadline", type=float, help="Overall time limit of the run in seconds, after which the run is cancelled (default: RUN_DEADLINE_SECONDS or 0 = none)")
+    parser.add_argument("--stage-deadline", type=float, help="Time limit of each stage in seconds (default: STAGE_DEADLINE_SECONDS or 0 = none; per-stage overrides in STAGE_DEADLINES)")
+    parser.add_argument("--keep-alive", action="store_true", help="Keep the process alive after the run (old container behaviour); by default the process exits")
+    parser.add_argument("--no-coalesce", action="store_true", help="Run this edit immediately instead of merging it with other pending edits of the project")
+    return parser
 
+
+def main():
+    args = build_arg_parser().parse_args()
+
+    error = validate_args(args)
+    if error:
+        print(json.dumps({"status": "failure", "message": error}))
+        logging.error(error)
+        sys.exit(2)
+
+    if args.worker:
+        # Worker nie ładuje agentów: każde zadanie to osobny proces generate_project.py
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+        settings = get_settings() # .env przed importem modułów workera
+        from job_worker import run_worker
+        sys.exit(run_worker(args.broker, slots=args.worker_slots or settings.worker_slots, max_jobs=args.max_jobs))
+    if args.rollback_to:
+        sys.exit(rollback_project(args.project, args.rollback_to))
+
+    if args.debug:
+        os.environ["LOG_MODE"] = "debug"
+    # .env jest ładowany raz, zanim zostaną zaimportowane moduły czytające zmienne środowiskowe
+    settings = get_settings()
+    from utils import AGENT_VERBOSE
+    from run_logging import setup_logging
+    from job_store import JobStore, JobRecorder
+    from db_fallback import load_project_metadata, save_project_metadata
+    from generation_mirror import get_mirror
+    from notifier import notify_n8n
+    from project_files import write_project_files
+    from patching import PATCH_FORMAT_INSTRUCTIONS, parse_edit_blocks, apply_edits, request_full_files
+    from sonar_fix import crew_token_usage
+    from artifact_store import snapshot_project
+    from project_history import ProjectHistory
+    from crewai import Crew, Process, Task
+
+    edit_batch = None
+    # Lokalny rejestr uruchomień (parametry, czasy etapów, tokeny, manifest artefaktów) dla panelu
+    job_store = JobStore()
+    job = JobRecorder(job_store, job_store.create_job(
+        args.project, "edit" if args.edit else "generate",
+        {k: v for k, v in vars(args).items() if k != "job_id" and v is not None}, job_id=args.job_id
+    ))
+    # Logi: kolejka z wątkiem zapisującym, archiwum przebiegu i surowe wyniki etapów w projects/<nazwa>/.factory/logs/<id zadania>
+    run_log = setup_logging(os.path.join("projects", args.project, ".factory", "logs", job.job_id), debug=settings.log_mode == "debug")
+    configure_litellm(settings)
+    # Anulowanie (SIGTERM z panelu lub workera) i limity czasu: punkt kontrolny przy każdym etapie,
+    # przerwanie blokującego wywołania LLM/HTTP i zabicie procesów potomnych
+    token = CancelToken(deadline_seconds=args.deadline, stage_deadline_seconds=args.stage_deadline)
+    job.add_listener(token)
+    token.install(
+        on_stuck=lambda: job.finish("cancelled", error=token.reason, project_dir=os.path.join("projects", args.project)),
+        on_exit=[run_log.close]
+    )
+    job.start()
+    if args.profile:
+        profile_dir = args.profile_dir or os.path.join("projects", args.project, ".factory", "profiles", job.job_id)
+        profiler = RunProfiler(profile_dir)
+        profiler.start()
+        job.add_listener(profiler)
+        logging.info(f"Profilowanie włączone, raport zostanie zapisany w {profile_dir}")
     try:
         project_name = args.project
         project_dir = os.path.join("projects", project_name) # Zmieniamy na ścieżkę względną
@@ -272,14 +464,59 @@ def main():
         if not os.path.exists(project_dir):
             logging.warning(f"Project directory {project_dir} does not exist. Creating...")
             os.makedirs(project_dir, exist_ok=True)
+        # Migawka git po każdym etapie zapisującym pliki (tylko pliki zgłoszone przez etap jako zmienione)
+        history = ProjectHistory(project_dir, job_id=job.job_id)
 
         if args.edit:
-            if not args.changes:
-                raise ValueError("BŁĄD: --changes jest wymagany w trybie edycji.")
+            from edit_queue import EditQueue
+            from project_index import ProjectIndex
+
+            # Metadane projektu z lokalnej bazy (framework potrzebny np. w rejestrze zadań)
+            project_metadata = load_project_metadata(project_name)
+            if project_metadata and not args.framework:
+                args.framework = project_metadata["framework"]
+            logging.info(f"Metadane projektu {project_name}: {project_metadata}")
+            # Ostatnie generowanie z lokalnego mirrora project_generations (działa także bez dostępu do Supabase)
+            last_generation, mirror_freshness = get_mirror().get_latest(project_name)
+            if last_generation and not args.framework:
+                args.framework = last_generation.get("framework")
+            logging.info(f"Ostatnie generowanie projektu {project_name}: status {last_generation.get('status') if last_generation else None}, mirror {mirror_freshness}")
+
+            job.stage("queue")
+            if args.no_coalesce:
+                # Bez scalania, ale nadal po kolei z innymi edycjami projektu
+                edit_batch = EditQueue(project_dir).acquire(args.changes)
+            else:
+                # Edycje tego samego projektu są kolejkowane i scalane (debounce); różne projekty działają równolegle
+                edit_batch = EditQueue(project_dir).submit(args.changes)
+                merged_status = None if edit_batch.is_leader else edit_batch.merged_result.get("status")
+                if merged_status == "cancelled":
+                    # Scalona edycja, do której trafiła ta zmiana, została anulowana; zmiana nie jest ponawiana
+                    batch_id = edit_batch.merged_result.get("batch_id")
+                    edit_batch = None
+                    raise RunCancelled(f"merged edit {batch_id} was cancelled")
+                if merged_status == "failed":
+                    # Zmiana wielokrotnie psuła scalone edycje i została odłożona do dead_letter
+                    print(json.dumps({"status": "failure", "message": edit_batch.merged_result.get("error")}))
+                    job.finish("failed", error=edit_batch.merged_result.get("error"))
+                    return
+                if not edit_batch.is_leader:
+                    print(json.dumps({
+                        "status": "merged",
+                        "project_name": project_name,
+                        "features": args.changes,
+                        "merged_into": edit_batch.merged_result.get("batch_id"),
+                        "result": edit_batch.merged_result
+                    }))
+                    job.finish("merged", edit_batch.merged_result)
+                    return
+                args.changes = edit_batch.changes
 
             # Load agents and tasks from YAML (assuming agents.yaml and tasks.yaml exist and are correctly formatted)
-            agents_config = load_config_from_yaml('ai-web-factory/agents.yaml')
-            tasks_config = load_config_from_yaml('ai-web-factory/tasks.yaml')
+            job.stage("edit")
+            config_dir = os.path.dirname(os.path.abspath(__file__))
+            agents_config = load_config_from_yaml(os.path.join(config_dir, 'agents.yaml'))
+            tasks_config = load_config_from_yaml(os.path.join(config_dir, 'tasks.yaml'))
 
             if not agents_config or not tasks_config:
                 raise Exception("Failed to load agents or tasks configuration from YAML.")
@@ -290,12 +527,12 @@ def main():
             if 'agents' in agents_config:
                 for agent_data in agents_config['agents']:
                     agent_role = agent_data.get('role')
-                    agent_class = AGENT_CLASS_MAP.get(agent_role)
+                    agent_class = get_agent_class(agent_role)
 
                     if agent_class:
                          try:
-                             # Ensure verbose is True for all agents loaded from YAML unless explicitly set to False
-                             agent_data['verbose'] = agent_data.get('verbose', True)
+                             # Verbose agents only in debug mode unless set explicitly in YAML
+                             agent_data['verbose'] = agent_data.get('verbose', AGENT_VERBOSE)
                              # Instantiate agent class dynamically
                              agent = agent_class(**agent_data)
                              crew_agents.append(agent)
@@ -303,15 +540,27 @@ def main():
                          except Exception as e:
                              logging.error(f"Error instantiating agent {agent_role} with data {agent_data}: {e}")
                              continue
-                         else:
-                             logging.warning(f"Unknown agent role or missing class in AGENT_CLASS_MAP for agent: {agent_role}. Skipping agent.")
-                             continue
+                    else:
+                        logging.warning(f"Unknown agent role or missing class in AGENT_CLASS_MAP for agent: {agent_role}. Skipping agent.")
+                        continue
 
 
             # Create tasks from config
             crew_tasks = []
+            editor_agent = agent_map.get('Project Editor')
+            project_index = ProjectIndex(project_dir)
+            if editor_agent:
+                # Zadanie edycji z --changes; agent dostaje tylko najtrafniejsze fragmenty projektu z lokalnego indeksu
+                project_index.refresh()
+                context_chunks = project_index.context_for(args.changes, k=int(os.getenv("EDIT_CONTEXT_CHUNKS", "8")))
+                logging.info(f"Kontekst edycji: {[(c['path'], c['start_line'], c['end_line']) for c in context_chunks]}")
+                crew_tasks.append(editor_agent.create_edit_task(project_name, args.changes, context_chunks, project_index.file_list()))
+
             if 'tasks' in tasks_config:
                 for task_data in tasks_config['tasks']:
+                    if editor_agent and task_data.get('agent') == 'Project Editor':
+                        logging.debug(f"Skipping YAML task for Project Editor, the edit task is built from --changes: {task_data.get('description')}")
+                        continue
                     # Find the agent for this task by role
                     task_agent = agent_map.get(task_data.get('agent'))
                     if not task_agent:
@@ -331,7 +580,7 @@ def main():
                 agents=crew_agents,
                 tasks=crew_tasks,
                 process=Process.sequential,
-                verbose=True, # Keep crew verbose logging
+                verbose=AGENT_VERBOSE, # Crew verbose output only in debug mode
                 max_rpm=10, # Ujednolicono max_rpm na 10
                 max_iterations=50
             )
@@ -340,7 +589,7 @@ def main():
             for attempt in range(max_attempts):
                 try:
                     result = crew.kickoff()
-                    logging.debug(f"Edit task result (raw): {result}")
+                    job.add_tokens(crew_token_usage(result))
                     break
                 except Exception as e:
                     if "ResourceExhausted" in str(e):
@@ -354,22 +603,24 @@ def main():
             files_to_write = {}
             result_str = str(result)
 
-            debug_path = os.path.join(project_dir, "debug_result.txt") # Zapisujemy debug_result w katalogu projektu
-            try:
-                with open(debug_path, "w", encoding="utf-8") as f:
-                    f.write(result_str)
-                logging.info(f"Saved raw result to {debug_path} for debugging")
-            except Exception as e:
-                logging.error(f"Failed to write debug_result.txt: {str(e)}")
+            result_archive = run_log.archive_output("edit", result_str)
+            if settings.log_mode == "debug":
+                debug_path = os.path.join(project_dir, "debug_result.txt") # W trybie debug także w katalogu projektu
+                try:
+                    with open(debug_path, "w", encoding="utf-8") as f:
+                        f.write(result_str)
+                    logging.info(f"Saved raw result to {debug_path} for debugging")
+                except Exception as e:
+                    logging.error(f"Failed to write debug_result.txt: {str(e)}")
 
-            # Parsowanie formatu "--- <ścieżka_pliku> ---"
-            file_pattern = r'---\s*(\S+?)\s*---\s*(.*?)(?=(---|\Z))'
-            file_matches = re.finditer(file_pattern, result_str, re.DOTALL)
-            for match in file_matches:
-                file_name = match.group(1).strip()
-                file_content = match.group(2).strip()
-                files_to_write[file_name] = file_content
-                logging.info(f"Parsed content for {file_name}:\n{file_content[:100]}...")
+            # Parsowanie formatu "--- <ścieżka_pliku> ---" z blokami SEARCH/REPLACE (lub pełną treścią nowych plików)
+            edits = parse_edit_blocks(result_str)
+            patched_files, failed_files = apply_edits(project_dir, edits)
+            files_to_write.update(patched_files)
+            if failed_files and editor_agent:
+                # Pełna treść tylko dla plików, których łatki nie dało się nałożyć
+                logging.info(f"Requesting full content for files with failed patches: {sorted(failed_files)}")
+                files_to_write.update(request_full_files(editor_agent, project_dir, failed_files, args.changes, edits, token=token))
 
             # Parsowanie formatu "**File: /app/SupabaseToDo/<filename>**" jako fallback (dostosowane do dynamicznej nazwy projektu)
             file_pattern_fallback = r'\*\*File: /app/' + re.escape(project_name) + r'/(\S+?)\*\*\s*```(?:html|css|javascript|python)?\s*(.*?)\s*```'
@@ -382,73 +633,54 @@ def main():
 
 
             if not files_to_write:
-                logging.warning("No files parsed from agent output. Check result format and debug_result.txt.")
+                logging.warning(f"No files parsed from agent output. Check result format in {result_archive}.")
             else:
-                for file_name, content in files_to_write.items():
-                    file_path = os.path.join(project_dir, file_name)
-                    try:
-                        # Ensure parent directories exist
-                        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                        with open(file_path, "w", encoding="utf-8") as f:
-                            f.write(content) # Corrected: removed duplicate f.write
-                        logging.info(f"Manually written file: {file_path}")
-                    except Exception as e:
-                        logging.error(f"Failed to write file {file_path}: {str(e)}")
-
-
-            print(json.dumps({
+                # Zapis tylko faktycznie zmienionych plików i przyrostowa aktualizacja indeksu
+                changed_files = write_project_files(project_dir, files_to_write)
+                project_index.update_files(changed_files)
+                history.snapshot("edit", changed_files, f"Edycja: {args.changes[:72]}")
+
+
+            edit_status = {
                 "status": "success",
                 "project_name": project_name,
                 "features": args.changes, # W trybie edycji features to args.changes
                 "deployment_url": "" # URL wdrożenia nie jest jeszcze znany po edycji
-            }))
-
-            # Dodaj kod do wywołania webhooka n8n
-            n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL")
-            if n8n_webhook_url:
-                data_to_send = {"projectName": project_name, "changes": args.changes, "status": "edited"}
-
-                try:
-                    logging.info(f"Wywoływanie webhooka n8n pod adresem: {n8n_webhook_url}")
-                    response = requests.post(n8n_webhook_url, json=data_to_send)
-                    response.raise_for_status() # Zgłoś wyjątek dla błędnych statusów (4xx lub 5xx)
-                    logging.info(f"Webhook n8n wywołany pomyślnie. Status: {response.status_code}")
-                    logging.debug(f"Odpowiedź webhooka: {response.text}")
-                except requests.exceptions.RequestException as e:
-                    logging.error(f"Błąd podczas wywoływania webhooka n8n: {e}")
+            }
+            print(json.dumps(edit_status))
+            job.finish("succeeded", edit_status, project_dir=project_dir, manifest=snapshot_project(project_name, project_dir, job.job_id))
+            if edit_batch:
+                edit_batch.complete(edit_status)
+                edit_batch = None
+
+            # Powiadomienie n8n trafia do trwałego outboxa i jest wysyłane w tle (z ponawianiem)
+            if notify_n8n({"projectName": project_name, "changes": args.changes, "status": "edited"}):
+                logging.info("Powiadomienie n8n o edycji dodane do kolejki wysyłki.")
             else:
                 logging.warning("N8N_WEBHOOK_URL nie jest ustawiony w .env. Pomijam wywołanie webhooka.")
 
 
         else: # Tryb generowania projektu
-            if not args.framework or not args.features:
-                 # Sprawdź, czy podano --config
-                 if args.config:
-                     config_data = load_config_from_yaml(args.config)
-                     if config_data:
-                         args.framework = config_data.get('framework')
-                         args.features = config_data.get('features')
-                         # Możesz dodać obsługę innych pól z pliku konfiguracyjnego, np. 'project_name'
-                         if not args.project and config_data.get('project_name'):
-                             args.project = config_data.get('project_name')
-                             project_name = args.project
-                             project_dir = os.path.join("projects", project_name)
-                             if not os.path.exists(project_dir):
-                                 os.makedirs(project_dir, exist_ok=True)
-                             logging.info(f"Project name updated from config: {project_name}")
-
-                     if not args.framework or not args.features:
-                         raise ValueError("BŁĄD: Plik konfiguracyjny musi zawierać 'framework' i 'features'.")
-                 else:
-                     raise ValueError("BŁĄD: W trybie generowania wymagane są argumenty --framework i --features lub --config.")
-
+            # Moduły potrzebne tylko przy generowaniu
+            from sonar_fix import SonarFixEngine, budget_from_env
+            from local_lint import run_local_lint, files_needing_review
+            from project_test_runner import run_project_tests, save_test_results
+            from scaffolding import materialize_scaffold
+            from plan_cache import PlanCache, describe_prior_plan
+            from plan_schema import PLAN_FORMAT_INSTRUCTIONS, parse_plan, validate_plan, request_plan_fields
+            from continuation import run_with_continuation
+            from prompt_cache import PromptContext, PrefixRegistry, build_shared_prefix, get_provider
 
             logging.info(f"Rozpoczynanie generowania projektu: {project_name} ({args.framework}) z funkcjami: {args.features}")
 
             # ETAP 1: Inicjalizacja projektu (częściowo zrobione powyżej)
+            job.stage("ETAP 1: Inicjalizacja")
+            # Lokalny zapis metadanych, aby tryb edycji nie musiał odpytywać Supabase
+            if not save_project_metadata(project_name, args.framework, args.features):
+                logging.warning(f"Nie udało się zapisać metadanych projektu {project_name} w lokalnej bazie.")
             # Tutaj można dodać logikę zapisu do bazy danych o rozpoczęciu generowania
             try:
-                insert_result = supabase.table("project_generations").insert({
+                insert_result = get_supabase_client().table("project_generations").insert({
                     "project_name": project_name,
                     "framework": args.framework,
                     "features": args.features,
@@ -458,6 +690,7 @@ def main():
                 # Sprawdź, czy wstawienie się powiodło
                 if insert_result.data:
                     logging.info(f"Zapisano rozpoczęcie generowania projektu do Supabase: {insert_result.data}")
+                    get_mirror().apply_rows(insert_result.data) # Zapis przez lokalny mirror project_generations
                 else:
                      logging.warning(f"Nie udało się zapisać rozpoczęcia generowania projektu do Supabase: {insert_result.error}")
             except Exception as e:
@@ -466,137 +699,146 @@ def main():
 
             # Inicjalizacja agentów
             # Using the AGENT_CLASS_MAP for instantiation
-            planner_agent = AGENT_CLASS_MAP['Project Planner']()
-            db_agent = AGENT_CLASS_MAP['Database Manager']()
-            codegen_agent = AGENT_CLASS_MAP['Code Generator']()
-            reviewer_agent = AGENT_CLASS_MAP['Code Reviewer']()
-            test_agent = AGENT_CLASS_MAP['Test Generator']()
-            deployment_agent = AGENT_CLASS_MAP['Deployment Specialist']()
-            quality_agent = AGENT_CLASS_MAP['Quality Assurance Specialist']()
-            self_improve_agent = AGENT_CLASS_MAP['Code Improvement Specialist']() # Instantiate SelfImproveAgent
+            planner_agent = get_agent_class('Project Planner')()
+            db_agent = get_agent_class('Database Manager')()
+            codegen_agent = get_agent_class('Code Generator')()
+            reviewer_agent = get_agent_class('Code Reviewer')()
+            test_agent = get_agent_class('Test Generator')()
+            deployment_agent = get_agent_class('Deployment Specialist')()
+            quality_agent = get_agent_class('Quality Assurance Specialist')()
             # No need to instantiate RateLimiter here as it's not used for CrewAI limiting
 
 
             # ETAP 2: Generowanie kodu z Supabase
             logging.info("ETAP 2: Generowanie kodu z Supabase")
+            job.stage("ETAP 2: Generowanie kodu z Supabase")
+
+            # Cache planów: dokładne trafienie pomija planowanie, podobny plan służy jako punkt wyjścia
+            plan_cache = PlanCache()
+            plan_data = plan_cache.get(args.framework, args.features)
+            if plan_data is not None:
+                plan_data, cached_plan_errors = validate_plan(plan_data)
+                if cached_plan_errors:
+                    logging.warning(f"Plan z cache nie spełnia schematu ({cached_plan_errors}), planowanie od nowa.")
+                    plan_data = None
+
+            if plan_data is not None:
+                logging.info(f"Plan pobrany z cache (framework: {args.framework}, funkcje: {args.features}). Pomijam planowanie.")
+            else:
+                similar_plan = plan_cache.find_similar(args.framework, args.features)
+                prior_plan_hint = describe_prior_plan(*similar_plan, args.features) if similar_plan else ""
+
+                # Task planowania
+                plan_task = Task(
+                    description=f"Stwórz szczegółowy plan wdrożenia dla projektu {project_name} używając frameworku {args.framework} z funkcjami: {args.features}. Plan powinien zawierać strukturę plików, wymagane tabele Supabase (nazwy i kolumny), oraz kluczowe komponenty do zaimplementowania. {prior_plan_hint}\n{PLAN_FORMAT_INSTRUCTIONS}",
+                    agent=planner_agent,
+                    expected_output="Plan jako jeden obiekt JSON zgodny ze schematem, z kluczami: 'file_structure', 'supabase_tables' (lista obiektów z 'name' i 'schema'), 'components'."
+                )
+
+                # Uruchomienie Crew dla planowania
+                planning_crew = Crew(
+                    agents=[planner_agent],
+                    tasks=[plan_task],
+                    process=Process.sequential,
+                    verbose=AGENT_VERBOSE,
+                    max_rpm=10 # Ujednolicono max_rpm na 10
+                )
 
-            # Task planowania
-            plan_task = Task(
-                description=f"Stwórz szczegółowy plan wdrożenia dla projektu {project_name} używając frameworku {args.framework} z funkcjami: {args.features}. Plan powinien zawierać strukturę plików, wymagane tabele Supabase (nazwy i kolumny), oraz kluczowe komponenty do zaimplementowania.",
-                agent=planner_agent,
-                expected_output="Szczegółowy plan w formacie JSON, zawierający klucze: 'file_structure', 'supabase_tables' (lista obiektów z 'name' i 'schema'), 'components'."
-            )
-
-            # Uruchomienie Crew dla planowania
-            planning_crew = Crew(
-                agents=[planner_agent],
-                tasks=[plan_task],
-                process=Process.sequential,
-                verbose=True,
-                max_rpm=10 # Ujednolicono max_rpm na 10
-            )
-
-            try:
-                planning_result = planning_crew.kickoff()
-                logging.debug(f"Planning result: {planning_result}")
-
-                # Parsowanie planu
                 try:
-                    plan_data = json.loads(planning_result)
-                    supabase_tables_schema = plan_data.get('supabase_tables', [])
-                    file_structure_plan = plan_data.get('file_structure', {})
-                    components_plan = plan_data.get('components', [])
-
-                    # ETAP 2.d: Tworzenie tabel w Supabase
-                    logging.info("ETAP 2.d: Tworzenie tabel w Supabase")
-                    for table_info in supabase_tables_schema:
-                        table_name = table_info.get('name')
-                        # Schema is expected as a list of strings, e.g., ["id UUID PRIMARY KEY", "name TEXT"]
-                        table_schema = table_info.get('schema')
-                        if table_name and table_schema and isinstance(table_schema, list):
-                            db_creation_result = create_supabase_table(table_name, table_schema)
-                            logging.info(f"Rezultat tworzenia tabeli {table_name}: {db_creation_result}")
-                        else:
-                            logging.warning(f"Niekompletne lub nieprawidłowe dane dla tabeli Supabase w planie: {table_info}. Oczekiwano 'name' (string) i 'schema' (list of strings).")
-
-
-                except json.JSONDecodeError:
-                    logging.error("Nie udało się sparsować wyniku planowania jako JSON.")
-                    supabase_tables_schema = []
-                    file_structure_plan = {}
-                    components_plan = []
+                    planning_result = planning_crew.kickoff()
+                    job.add_tokens(crew_token_usage(planning_result))
+                    run_log.archive_output("planning", planning_result)
                 except Exception as e:
-                    logging.error(f"Błąd podczas przetwarzania planu: {e}")
-                    supabase_tables_schema = []
-                    file_structure_plan = {}
-                    components_plan = []
+                    logging.error(f"Błąd podczas planowania projektu: {e}")
+                    raise # Przerwij, jeśli planowanie się nie powiedzie
+
+                # Parsowanie planu: lokalna ekstrakcja i naprawa JSON, walidacja schematu, dopytanie tylko o błędne pola
+                plan_data, plan_errors = parse_plan(str(planning_result))
+                if plan_errors:
+                    logging.warning(f"Pola planu do poprawy: {plan_errors}")
+                    plan_data, plan_errors, reask_tokens = request_plan_fields(
+                        planner_agent, plan_data, plan_errors, f"{project_name} ({args.framework}, funkcje: {args.features})"
+                    )
+                    job.add_tokens(reask_tokens)
+                if plan_errors:
+                    logging.error(f"Plan niekompletny po naprawie, brakujące pola zostaną puste: {plan_errors}")
+                else:
+                    plan_cache.put(args.framework, args.features, plan_data)
 
+            logging.info(f"Statystyki cache planów: {plan_cache.stats()}")
+            plan_cache.close()
 
+            try:
+                supabase_tables_schema = plan_data.get('supabase_tables', [])
+                file_structure_plan = plan_data.get('file_structure', {})
+                components_plan = plan_data.get('components', [])
+
+                # ETAP 2.d: Tworzenie tabel w Supabase
+                logging.info("ETAP 2.d: Tworzenie tabel w Supabase")
+                for table_info in supabase_tables_schema:
+                    table_name = table_info.get('name')
+                    # Schema is expected as a list of strings, e.g., ["id UUID PRIMARY KEY", "name TEXT"]
+                    table_schema = table_info.get('schema')
+                    if table_name and table_schema and isinstance(table_schema, list):
+                        db_creation_result = create_supabase_table(table_name, table_schema, token=token)
+                        logging.info(f"Rezultat tworzenia tabeli {table_name}: {db_creation_result}")
+                    else:
+                        logging.warning(f"Niekompletne lub nieprawidłowe dane dla tabeli Supabase w planie: {table_info}. Oczekiwano 'name' (string) i 'schema' (list of strings).")
             except Exception as e:
-                logging.error(f"Błąd podczas planowania projektu: {e}")
-                raise # Przerwij, jeśli planowanie się nie powiedzie
-
-            # Task generowania kodu
-            codegen_task = Task(
-                description=f"""
-                Wygeneruj pełny kod źródłowy dla projektu {project_name} używając frameworku {args.framework} z funkcjami: {args.features}.
+                logging.error(f"Błąd podczas przetwarzania planu: {e}")
+                supabase_tables_schema = []
+                file_structure_plan = {}
+                components_plan = []
+
+            # Szablon bazowy frameworku materializowany lokalnie; LLM generuje tylko pliki specyficzne dla funkcji
+            scaffold_info = materialize_scaffold(args.framework, project_dir, project_name)
+            if scaffold_info:
+                scaffold_instructions = f"""
+                NIE generuj ponownie plików szablonu bazowego ani typowego boilerplate'u. Zwróć wyłącznie nowe pliki potrzebne do realizacji funkcji
+                oraz te pliki szablonu, które musisz zmienić (np. package.json lub requirements.txt przy nowych zależnościach) - w pełnej treści.
+                """
+            else:
+                scaffold_instructions = ""
+
+            # Wspólny prefiks promptów (projekt, plan, szablon, format plików) w pamięci podręcznej kontekstu dostawcy;
+            # kolejne etapy wysyłają tylko własną końcówkę zadania
+            prefix_registry = PrefixRegistry()
+            prompt_context = PromptContext(
+                build_shared_prefix(project_name, project_dir, args.framework, args.features, {
+                    "file_structure": file_structure_plan, "supabase_tables": supabase_tables_schema, "components": components_plan
+                }, scaffold_info),
+                provider=get_provider(api_key=settings.google_api_key, model=settings.litellm_model),
+                registry=prefix_registry
+            ).prepare([codegen_agent, reviewer_agent, quality_agent, test_agent, deployment_agent], token=token)
+
+            # Task generowania kodu (z kontynuacją, gdy odpowiedź przekroczy limit tokenów)
+            codegen_description = prompt_context.describe(codegen_agent, f"""
+                Wygeneruj pełny kod źródłowy dla projektu {project_name} zgodnie z kontekstem projektu (framework, funkcje, plan).
+                {scaffold_instructions}
                 Uwzględnij integrację z Supabase zgodnie z planem.
-                Struktura plików powinna być zgodna z planem: {file_structure_plan}.
-                Zaimplementuj następujące komponenty: {components_plan}.
-                Użyj kluczy Supabase z zmiennych środowiskowych (SUPABASE_URL, SUPABASE_SERVICE_KEY).
-                Zwróć pełną zawartość każdego wygenerowanego pliku w formacie:
-                --- <ścieżka_pliku_względem_katalogu_projektu> ---
-                <zawartość>
-                Na przykład:
-                --- src/pages/index.js ---
-                // kod JavaScript
-                --- styles/global.css ---
-                /* kod CSS */
+                Struktura plików powinna być zgodna ze strukturą plików z planu; zaimplementuj wszystkie komponenty z planu.
+                Zwróć pełną zawartość każdego wygenerowanego pliku w formacie '--- <ścieżka_pliku> ---'.
                 Upewnij się, że ścieżki plików są poprawne i znajdują się w katalogu projektu '{project_dir}'.
-                """,
-                agent=codegen_agent,
-                expected_output="Pełna zawartość wszystkich wygenerowanych plików w formacie '--- <ścieżka_pliku> --- <zawartość>'"
-            )
-
-            # Uruchomienie Crew dla generowania kodu
-            codegen_crew = Crew(
-                agents=[codegen_agent],
-                tasks=[codegen_task],
-                process=Process.sequential,
-                verbose=True,
-                max_rpm=10 # Ujednolicono max_rpm na 10
-            )
+                """)
 
             try:
-                codegen_result = codegen_crew.kickoff()
-                logging.debug(f"Codegen result: {codegen_result}")
-
-                # Parsowanie i zapisywanie wygenerowanych plików
-                files_to_write = {}
-                result_str = str(codegen_result)
-
-                # Parsowanie formatu "--- <ścieżka_pliku> ---"
-                file_pattern = r'---\s*(\S+?)\s*---\s*(.*?)(?=(---|\Z))'
-                file_matches = re.finditer(file_pattern, result_str, re.DOTALL)
-                for match in file_matches:
-                    file_name = match.group(1).strip()
-                    file_content = match.group(2).strip()
-                    files_to_write[file_name] = file_content
-                    logging.info(f"Parsed content for {file_name}:\n{file_content[:100]}...")
-
+                files_to_write, codegen_info = run_with_continuation(
+                    codegen_agent,
+                    codegen_description,
+                    "Pełna zawartość wszystkich wygenerowanych plików w formacie '--- <ścieżka_pliku> --- <zawartość>'",
+                    token=token
+                )
+                run_log.archive_output("codegen", codegen_info["raw"])
+                job.add_tokens(codegen_info["tokens"])
+                if codegen_info["truncated"]:
+                    logging.warning(f"Code generation output still truncated after {codegen_info['rounds']} continuation rounds.")
+
+                codegen_files = scaffold_info["files"] if scaffold_info else []
                 if not files_to_write:
                     logging.warning("No files parsed from code generation agent output.")
                 else:
-                    for file_name, content in files_to_write.items():
-                        file_path = os.path.join(project_dir, file_name)
-                        try:
-                            # Ensure parent directories exist
-                            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(content)
-                            logging.info(f"Manually written generated file: {file_path}")
-                        except Exception as e:
-                            logging.error(f"Failed to write generated file {file_path}: {str(e)}")
+                    codegen_files = codegen_files + write_project_files(project_dir, files_to_write)
+                history.snapshot("codegen", codegen_files, "ETAP 2: Generowanie kodu z Supabase")
 
             except Exception as e:
                 logging.error(f"Błąd podczas generowania kodu: {e}")
@@ -605,18 +847,18 @@ def main():
 
             # ETAP 3: Weryfikacja kodu (A2A)
             logging.info("ETAP 3: Weryfikacja kodu (A2A)")
+            job.stage("ETAP 3: Weryfikacja kodu (A2A)")
             # Task weryfikacji kodu
             review_task = Task(
-                description=f"""
+                description=prompt_context.describe(reviewer_agent, f"""
                 Przejrzyj kod źródłowy projektu {project_name} znajdujący się w katalogu '{project_dir}'.
                 Sprawdź kod pod kątem błędów, zgodności z najlepszymi praktykami dla frameworku {args.framework} i integracji z Supabase.
                 Zasugeruj konkretne poprawki, jeśli są potrzebne.
-                Zwróć raport z weryfikacji. Jeśli znaleziono błędy, zasugeruj jak je poprawić, podając zmienione fragmenty kodu w formacie:
-                --- <ścieżka_pliku_względem_katalogu_projektu> ---
-                <poprawiona_zawartość>
-                """,
+                Zwróć raport z weryfikacji. Jeśli znaleziono błędy, podaj poprawki wyłącznie jako zmienione fragmenty (nie przepisuj całych plików).
+                {PATCH_FORMAT_INSTRUCTIONS}
+                """, inline_prefix=False),
                 agent=reviewer_agent,
-                expected_output="Raport z weryfikacji kodu. Jeśli znaleziono błędy, poprawione fragmenty kodu w formacie '--- <ścieżka_pliku> --- <poprawiona_zawartość>'"
+                expected_output="Raport z weryfikacji kodu. Jeśli znaleziono błędy, poprawki jako bloki SEARCH/REPLACE w formacie '--- <ścieżka_pliku> ---'"
             )
 
             # Uruchomienie Crew dla weryfikacji
@@ -624,37 +866,32 @@ def main():
                 agents=[reviewer_agent],
                 tasks=[review_task],
                 process=Process.sequential,
-                verbose=True,
+                verbose=AGENT_VERBOSE,
                 max_rpm=10 # Ujednolicono max_rpm na 10
             )
 
             try:
                 review_result = review_crew.kickoff()
-                logging.debug(f"Review result: {review_result}")
+                job.add_tokens(crew_token_usage(review_result))
+                run_log.archive_output("review", review_result)
 
-                # Parsowanie i zapisywanie poprawionych plików (jeśli agent zwrócił poprawki)
-                files_to_write_after_review = {}
+                # Parsowanie i nakładanie poprawek (jeśli agent zwrócił poprawki)
                 review_result_str = str(review_result)
-
-                file_pattern_review = r'---\s*(\S+?)\s*---\s*(.*?)(?=(---|\Z))'
-                file_matches_review = re.finditer(file_pattern_review, review_result_str, re.DOTALL)
-                for match in file_matches_review:
-                    file_name = match.group(1).strip()
-                    file_content = match.group(2).strip()
-                    files_to_write_after_review[file_name] = file_content
-                    logging.info(f"Parsed corrected content for {file_name} after review:\n{file_content[:100]}...")
+                review_edits = parse_edit_blocks(review_result_str)
+                files_to_write_after_review, failed_review_files = apply_edits(project_dir, review_edits)
+                if failed_review_files:
+                    # Pełna treść tylko dla plików, których łatki nie dało się nałożyć
+                    logging.info(f"Requesting full content for files with failed review patches: {sorted(failed_review_files)}")
+                    files_to_write_after_review.update(request_full_files(
+                        reviewer_agent, project_dir, failed_review_files,
+                        "the corrections from your code review", review_edits, token=token
+                    ))
 
                 if files_to_write_after_review:
                     logging.info("Applying corrections suggested by the reviewer agent.")
-                    for file_name, content in files_to_write_after_review.items():
-                        file_path = os.path.join(project_dir, file_name)
-                        try:
-                            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(content)
-                            logging.info(f"Manually written corrected file: {file_path}")
-                        except Exception as e:
-                            logging.error(f"Failed to write corrected file {file_path}: {str(e)}")
+                    changed_files = write_project_files(project_dir, files_to_write_after_review)
+                    logging.info(f"Files corrected after review: {changed_files}")
+                    history.snapshot("review", changed_files, "ETAP 3: Weryfikacja kodu (A2A)")
                 else:
                     logging.info("Reviewer agent did not suggest any code corrections.")
 
@@ -666,22 +903,35 @@ def main():
 
             # ETAP 4: Analiza jakości (A2A) i SonarQube
             logging.info("ETAP 4: Analiza jakości (A2A) i SonarQube")
-            # Task analizy jakości
-            quality_check_task = quality_agent.create_quality_check_task(project_dir)
-
-            # Uruchomienie Crew dla analizy jakości
-            quality_crew = Crew(
-                agents=[quality_agent],
-                tasks=[quality_check_task],
-                process=Process.sequential,
-                verbose=True,
-                max_rpm=10
-            )
+            job.stage("ETAP 4: Analiza jakości (A2A) i SonarQube")
 
             try:
-                quality_result = quality_crew.kickoff()
-                logging.debug(f"Quality analysis result (from agent): {quality_result}")
-                # Process quality analysis result if needed
+                # ETAP 4.a: Szybka lokalna analiza statyczna (ESLint, linters Pythona) przed agentem QA
+                lint_report = run_local_lint(project_dir)
+                qa_files = files_needing_review(lint_report)
+
+                if not qa_files:
+                    logging.info("Lokalna analiza statyczna nie wykazała problemów. Pomijam analizę jakości przez agenta QA.")
+                else:
+                    logging.info(f"Analiza jakości przez agenta QA ograniczona do {len(qa_files)} plików: {qa_files}")
+                    # Task analizy jakości
+                    quality_check_task = quality_agent.create_quality_check_task(
+                        project_dir, files=qa_files, lint_findings=lint_report["findings"], prompt_context=prompt_context
+                    )
+
+                    # Uruchomienie Crew dla analizy jakości
+                    quality_crew = Crew(
+                        agents=[quality_agent],
+                        tasks=[quality_check_task],
+                        process=Process.sequential,
+                        verbose=AGENT_VERBOSE,
+                        max_rpm=10
+                    )
+
+                    quality_result = quality_crew.kickoff()
+                    job.add_tokens(crew_token_usage(quality_result))
+                    run_log.archive_output("quality", quality_result)
+                    # Process quality analysis result if needed
 
                 # --- SonarQube Integration ---
                 logging.info("Uruchamianie skanowania SonarQube...")
@@ -696,7 +946,7 @@ def main():
                      sonar_results_data = None
                 else:
                      # Fetch SonarQube analysis results via API
-                     sonar_results_data = fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token)
+                     sonar_results_data = fetch_and_parse_sonar_results(project_name, sonar_url, sonar_token, token=token)
 
 
                 if sonar_results_data:
@@ -711,28 +961,21 @@ def main():
 
                         logging.info("Applying automatic fixes based on SonarQube results using SelfImproveAgent...")
 
-                        # Create tasks for SelfImproveAgent for each issue or a batch of issues
-                        # Assuming SelfImproveAgent has a method like `create_improve_task` or can handle a list of issues
-                        # Let's assume SelfImproveAgent can take a list of issues and the project directory
-                        fix_task = self_improve_agent.create_improve_task(project_dir, parsed_issues) # Assuming this method exists
-
-                        fix_crew = Crew(
-                            agents=[self_improve_agent],
-                            tasks=[fix_task],
-                            process=Process.sequential,
-                            verbose=True,
-                            max_rpm=10
+                        # Issues are grouped per file and rule; each file gets its own bounded-concurrency
+                        # fix task and only touched files are rescanned until convergence or budget exhaustion
+                        fix_engine = SonarFixEngine(
+                            agent_factory=get_agent_class('Code Improvement Specialist'),
+                            project_dir=project_dir,
+                            project_key=project_name,
+                            rescan=lambda file_paths: rescan_sonar_files(project_name, project_dir, sonar_url, sonar_token, file_paths, token=token),
+                            max_workers=int(os.getenv("SONAR_FIX_WORKERS", "4")),
+                            max_rounds=int(os.getenv("SONAR_FIX_MAX_ROUNDS", "3")),
+                            budget=budget_from_env()
                         )
-
-                        logging.info("Running SelfImproveAgent to fix SonarQube issues...")
-                        fix_result = fix_crew.kickoff()
-                        logging.debug(f"SelfImproveAgent fix result: {fix_result}")
-
-                        # After attempting fixes, you might need to re-run the SonarQube scan
-                        # and repeat the parsing/fixing loop until issues are resolved or a limit is reached.
-                        # This iterative fixing loop is more complex and might require a separate function or structure.
-                        # For now, we'll do one pass of fixing.
-                        logging.info("Placeholder: Implement iterative fixing loop and re-scanning.")
+                        fix_summary = fix_engine.run(parsed_issues)
+                        job.add_tokens(fix_summary["tokens_used"])
+                        history.snapshot("quality", fix_summary["touched_files"], "ETAP 4: Poprawki SonarQube")
+                        logging.info(f"Wynik automatycznych poprawek SonarQube: {fix_summary}")
 
                     else:
                         logging.info("Analiza SonarQube nie wykazała żadnych problemów.")
@@ -748,76 +991,43 @@ def main():
 
             # ETAP 5: Testy automatyczne
             logging.info("ETAP 5: Testy automatyczne")
-            # Task generowania testów
-            test_gen_task = Task(
-                description=f"""
+            job.stage("ETAP 5: Testy automatyczne")
+            # Task generowania testów (z kontynuacją, gdy odpowiedź przekroczy limit tokenów)
+            test_gen_description = prompt_context.describe(test_agent, f"""
                 Wygeneruj automatyczne testy dla projektu {project_name} w katalogu '{project_dir}'.
-                Użyj odpowiednich narzędzi testowych dla frameworku {args.framework} (np. Playwright dla Next.js, pytest dla Flask).
+                Użyj odpowiednich narzędzi testowych dla frameworku {args.framework} (Next.js: Jest z React Testing Library w katalogu __tests__/, szablon ma już jest.config.js i skrypt `npm test`; Flask: pytest).
                 Testy powinny pokrywać kluczowe funkcje, w tym integrację z Supabase (np. CRUD, uwierzytelnianie).
                 Zwróć pełną zawartość plików testowych w formacie:
                 --- <ścieżka_pliku_testowego_względem_katalogu_projektu> ---
                 <zawartość>
-                """,
-                agent=test_agent,
-                expected_output="Pełna zawartość wygenerowanych plików testowych w formacie '--- <ścieżka_pliku> --- <zawartość>'"
-            )
-
-            # Uruchomienie Crew dla generowania testów
-            test_gen_crew = Crew(
-                agents=[test_agent],
-                tasks=[test_gen_task],
-                process=Process.sequential,
-                verbose=True,
-                max_rpm=10 # Ujednolicono max_rpm na 10
-            )
+                """, inline_prefix=False)
 
             try:
-                test_gen_result = test_gen_crew.kickoff()
-                logging.debug(f"Test generation result: {test_gen_result}")
-
-                # Parsowanie i zapisywanie wygenerowanych plików testowych
-                files_to_write_tests = {}
-                test_gen_result_str = str(test_gen_result)
-
-                file_pattern_tests = r'---\s*(\S+?)\s*---\s*(.*?)(?=(---|\Z))'
-                file_matches_tests = re.finditer(file_pattern_tests, test_gen_result_str, re.DOTALL)
-                for match in file_matches_tests:
-                    file_name = match.group(1).strip()
-                    file_content = match.group(2).strip()
-                    files_to_write_tests[file_name] = file_content
-                    logging.info(f"Parsed generated test content for {file_name}:\n{file_content[:100]}...")
+                files_to_write_tests, test_gen_info = run_with_continuation(
+                    test_agent,
+                    test_gen_description,
+                    "Pełna zawartość wygenerowanych plików testowych w formacie '--- <ścieżka_pliku> --- <zawartość>'",
+                    token=token
+                )
+                run_log.archive_output("test_generation", test_gen_info["raw"])
+                job.add_tokens(test_gen_info["tokens"])
+                if test_gen_info["truncated"]:
+                    logging.warning(f"Test generation output still truncated after {test_gen_info['rounds']} continuation rounds.")
 
                 if not files_to_write_tests:
                     logging.warning("No test files parsed from test generation agent output.")
                 else:
-                    for file_name, content in files_to_write_tests.items():
-                        file_path = os.path.join(project_dir, file_name)
-                        try:
-                            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(content)
-                            logging.info(f"Manually written generated test file: {file_path}")
-                        except Exception as e:
-                            logging.error(f"Failed to write generated test file {file_path}: {str(e)}")
-
-                # Uruchomienie testów (przykład dla Next.js z Playwright/Jest)
-                logging.info("Uruchamianie testów automatycznych...")
-                test_command = None
-                if args.framework == "Next.js":
-                    # Zakładamy, że testy są skonfigurowane do uruchomienia np. przez 'npm test' lub 'npx playwright test'
-                    test_command = f"cd {project_dir} && npm install && npm test" # Dodajemy npm install przed testami
-                elif args.framework == "Flask":
-                    # Zakładamy, że testy są skonfigurowane do uruchomienia np. przez 'pytest'
-                    test_command = f"cd {project_dir} && pip install -r requirements.txt && pytest" # Dodajemy pip install
-                # Dodaj obsługę innych frameworków
+                    test_files = write_project_files(project_dir, files_to_write_tests)
+                    history.snapshot("test_generation", test_files, "ETAP 5: Testy automatyczne")
 
-                if test_command:
-                    logging.info(f"Wykonuję komendę testową: {test_command}")
-                    # Rzeczywiste wykonanie komendy testowej
-                    # Używamy narzędzia execute_command
-                    print(f"<execute_command>\n<command>{test_command}</command>\n</execute_command>")
-                else:
-                    logging.warning(f"Brak zdefiniowanej komendy testowej dla frameworku: {args.framework}")
+                # Uruchomienie testów w izolowanym sandboxie (kopia katalogu projektu, limity czasu i zasobów)
+                logging.info("Uruchamianie testów automatycznych...")
+                test_summary = run_project_tests(project_dir, args.framework, token=token)
+                test_results_path = save_test_results(project_dir, test_summary)
+                logging.info(
+                    f"Wynik testów: {test_summary['status']} (passed: {test_summary['passed']}, failed: {test_summary['failed']}, "
+                    f"skipped: {test_summary['skipped']}). Szczegóły: {test_results_path}"
+                )
 
 
             except Exception as e:
@@ -827,16 +1037,17 @@ def main():
 
             # ETAP 6: Przygotowanie do wdrożenia
             logging.info("ETAP 6: Przygotowanie do wdrożenia")
+            job.stage("ETAP 6: Przygotowanie do wdrożenia")
             # Task przygotowania do wdrożenia (np. generowanie plików konfiguracyjnych)
             deploy_prep_task = Task(
-                description=f"""
+                description=prompt_context.describe(deployment_agent, f"""
                 Przygotuj projekt {project_name} w katalogu '{project_dir}' do wdrożenia na platformie hostingowej (np. Vercel dla Next.js, Render dla Flask).
                 Wygeneruj niezbędne pliki konfiguracyjne (np. vercel.json, render.yaml) i instrukcje wdrożenia (INSTRUCTIONS.md).
                 Upewnij się, że konfiguracja uwzględnia zmienne środowiskowe Supabase (SUPABASE_URL, SUPABASE_SERVICE_KEY).
                 Zwróć pełną zawartość wygenerowanych plików konfiguracyjnych i instrukcji w formacie:
                 --- <ścieżka_pliku_względem_katalogu_projektu> ---
                 <zawartość>
-                """,
+                """, inline_prefix=False),
                 agent=deployment_agent,
                 expected_output="Pełna zawartość wygenerowanych plików konfiguracyjnych i instrukcji w formacie '--- <ścieżka_pliku> --- <zawartość>'"
             )
@@ -846,13 +1057,14 @@ def main():
                 agents=[deployment_agent],
                 tasks=[deploy_prep_task],
                 process=Process.sequential,
-                verbose=True,
+                verbose=AGENT_VERBOSE,
                 max_rpm=10 # Ujednolicono max_rpm na 10
             )
 
             try:
                 deploy_prep_result = deploy_prep_crew.kickoff()
-                logging.debug(f"Deployment preparation result: {deploy_prep_result}")
+                job.add_tokens(crew_token_usage(deploy_prep_result))
+                run_log.archive_output("deployment_preparation", deploy_prep_result)
 
                 # Parsowanie i zapisywanie wygenerowanych plików konfiguracyjnych i instrukcji
                 files_to_write_deploy = {}
@@ -869,22 +1081,11 @@ def main():
                 if not files_to_write_deploy:
                     logging.warning("No deployment preparation files parsed from agent output.")
                 else:
-                    for file_name, content in files_to_write_deploy.items():
-                        file_path = os.path.join(project_dir, file_name)
-                        try:
-                            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                            with open(file_path, "w", encoding="utf-8") as f:
-                                f.write(content)
-                            logging.info(f"Manually written generated deployment file: {file_path}")
-                        except Exception as e:
-                            logging.error(f"Failed to write generated deployment file {file_path}: {str(e)}")
-
-                # Rzeczywiste wykonanie Git push i wdrożenia
-                logging.info("Wykonuję Git push i wdrożenie...")
-                # Używamy narzędzia execute_command
-                git_commands = f"cd {project_dir} && git init && git add . && git commit -m \"Initial commit\""
-                logging.info(f"Wykonuję komendy Git: {git_commands}")
-                print(f"<execute_command>\n<command>{git_commands}</command>\n</execute_command>")
+                    deploy_files = write_project_files(project_dir, files_to_write_deploy)
+                    history.snapshot("deployment_preparation", deploy_files, "ETAP 6: Przygotowanie do wdrożenia")
+
+                # Projekt jest już wersjonowany migawkami etapów; wdrożenie korzysta z ostatniego commita
+                logging.info("Wykonuję wdrożenie...")
 
                 deploy_command = None
                 if args.framework == "Next.js":
@@ -908,13 +1109,14 @@ def main():
 
                 # Zapisanie URL wdrożenia w bazie danych
                 try:
-                    update_result = supabase.table("project_generations").update({
+                    update_result = get_supabase_client().table("project_generations").update({
                         "deployment_url": deployment_url,
                         "status": "Deployed",
                         "end_time": "now()" # Użyj funkcji bazy danych do ustawienia czasu
                     }).eq("project_name", project_name).execute()
                     if update_result.data:
                         logging.info(f"Zaktualizowano URL wdrożenia w Supabase: {update_result.data}")
+                        get_mirror().apply_rows(update_result.data)
                     else:
                         logging.warning(f"Nie udało się zaktualizować URL wdrożenia w Supabase: {update_result.error}")
                 except Exception as db_error:
@@ -924,49 +1126,53 @@ def main():
                 logging.error(f"Błąd podczas przygotowania do wdrożenia: {e}")
                 # Nie przerywamy, błędy we wdrożeniu mogą być normalne
 
+            logging.info(f"Statystyki wspólnego prefiksu promptów: {prefix_registry.stats()}")
+            prefix_registry.close()
+
 
             # Po zakończeniu wszystkich etapów (lub próbie ich wykonania)
-            print(json.dumps({
+            generation_status = {
                 "status": "generation_attempt_finished",
                 "project_name": project_name,
                 "framework": args.framework,
                 "features": args.features,
-                "deployment_url": deployment_url if 'deployment_url' in locals() else "N/A" # Zwracamy URL jeśli dostępny
-            }))
-
-            # Dodaj kod do wywołania webhooka n8n informującego o zakończeniu generowania
-            n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL")
-            if n8n_webhook_url:
-                data_to_send = {
-                    "projectName": project_name,
-                    "framework": args.framework,
-                    "features": args.features,
-                    "status": "generation_completed",
-                    "deploymentUrl": deployment_url if 'deployment_url' in locals() else "N/A"
-                }
-                try:
-                    logging.info(f"Wywoływanie webhooka n8n (zakończenie generowania) pod adresem: {n8n_webhook_url}")
-                    response = requests.post(n8n_webhook_url, json=data_to_send)
-                    response.raise_for_status()
-                    logging.info(f"Webhook n8n (zakończenie generowania) wywołany pomyślnie. Status: {response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    logging.error(f"Błąd podczas wywoływania webhooka n8n (zakończenie generowania): {e}")
+                "deployment_url": deployment_url if 'deployment_url' in locals() else "N/A", # Zwracamy URL jeśli dostępny
+                "tests": {k: test_summary[k] for k in ("status", "passed", "failed", "skipped")} if 'test_summary' in locals() else None
+            }
+            print(json.dumps(generation_status))
+            job.finish("succeeded", generation_status, project_dir=project_dir, manifest=snapshot_project(project_name, project_dir, job.job_id))
+
+            # Powiadomienie n8n o zakończeniu generowania (trwały outbox, wysyłka w tle z ponawianiem)
+            if notify_n8n({
+                "projectName": project_name,
+                "framework": args.framework,
+                "features": args.features,
+                "status": "generation_completed",
+                "deploymentUrl": deployment_url if 'deployment_url' in locals() else "N/A"
+            }):
+                logging.info("Powiadomienie n8n o zakończeniu generowania dodane do kolejki wysyłki.")
             else:
                 logging.warning("N8N_WEBHOOK_URL nie jest ustawiony w .env. Pomijam wywołanie webhooka o zakończeniu generowania.")
 
 
     except Exception as e:
         logging.error(f"BŁĄD KRYTYCZNY: {str(e)}")
+        if edit_batch:
+            # Zwolnij blokadę projektu; własna zmiana trafia do dead_letter (błąd już zgłoszony), pozostałe scalone
+            # zmiany ponawiają czekające na nie procesy (po EDIT_MAX_ATTEMPTS porażkach trafiają do dead_letter)
+            edit_batch.abort(error=str(e))
         print(json.dumps({"status": "failure", "message": str(e)}))
+        job.finish("failed", error=str(e), project_dir=project_dir if 'project_dir' in locals() else None)
         # W przypadku błędu krytycznego, spróbuj zaktualizować status w bazie danych
         try:
-            update_result = supabase.table("project_generations").update({
+            update_result = get_supabase_client().table("project_generations").update({
                 "status": "Failed",
                 "end_time": "now()",
                 "notes": f"Critical Error: {str(e)}"
             }).eq("project_name", project_name).execute()
             if update_result.data:
                 logging.info(f"Zaktualizowano status błędu w Supabase: {update_result.data}")
+                get_mirror().apply_rows(update_result.data)
             else:
                 logging.warning(f"Nie udało się zaktualizować statusu błędu w Supabase: {update_result.error}")
         except Exception as db_error:
@@ -974,12 +1180,26 @@ def main():
 
         raise # Ponownie zgłoś wyjątek, aby proces nadrzędny mógł go obsłużyć
 
+    except RunCancelled as e:
+        token.disarm()
+        logging.error(f"Uruchomienie przerwane: {e.reason}")
+        if edit_batch:
+            # Anulowane zmiany (także scalone z innych zgłoszeń) są usuwane z kolejki, a nie ponawiane
+            edit_batch.abort()
+        print(json.dumps({"status": "cancelled", "message": e.reason}))
+        job.finish("cancelled", error=e.reason, project_dir=project_dir if 'project_dir' in locals() else None)
+        # Bez czekania na porzucone wątki (np. poprawki SonarQube w toku): zwalnia limit zapytań, pamięć i slot workera
+        token.exit(CANCELLED_EXIT_CODE)
+
+    return args
+
 
 if __name__ == "__main__":
-    main()
+    args = main()
     # Usunięto test połączenia z Supabase, ponieważ nie jest potrzebny w tym miejscu.
 
-    # Dodaj pętlę, aby utrzymać kontener przy życiu
-    print("Skrypt zakończył główne zadanie. Utrzymywanie procesu przy życiu...")
-    while True:
-        time.sleep(3600) # Czekaj godzinę, aby nie obciążać CPU
\ No newline at end of file
+    if args is not None and args.keep_alive:
+        # Pętla utrzymująca kontener przy życiu tylko na żądanie; domyślnie proces kończy się po zadaniu
+        print("Skrypt zakończył główne zadanie. Utrzymywanie procesu przy życiu...")
+        while True:
+            time.sleep(3600) # Czekaj godzinę, aby nie obciążać CPU
\ No newline at end of file
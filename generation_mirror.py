@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+import requests
+
+from utils import FACTORY_CACHE_DIR
+
+MIRROR_DB_PATH = os.getenv("MIRROR_DB_PATH", os.path.join(FACTORY_CACHE_DIR, "mirror.db"))
+MIRROR_TABLE = "project_generations"
+# Kolumna klucza wiersza w Supabase (drugi element kursora synchronizacji obok updated_at)
+MIRROR_KEY_COLUMN = os.getenv("MIRROR_KEY_COLUMN", "id")
+MIRROR_PAGE_SIZE = int(os.getenv("MIRROR_PAGE_SIZE", "500"))
+# Dane lokalne starsze niż tyle sekund są odświeżane przy odczycie (o ile Supabase jest osiągalne)
+MIRROR_MAX_AGE_SECONDS = float(os.getenv("MIRROR_MAX_AGE_SECONDS", "30"))
+MIRROR_HTTP_TIMEOUT = float(os.getenv("MIRROR_HTTP_TIMEOUT", "5"))
+# Po nieudanej synchronizacji nie próbujemy ponownie przez tyle sekund (odczyty zostają lokalne)
+MIRROR_RETRY_AFTER_SECONDS = float(os.getenv("MIRROR_RETRY_AFTER_SECONDS", "30"))
+# Kursor wymaga kolumny updated_at przesuwanej przy każdej zmianie wiersza (kolumna, trigger i indeks w migracji)
+MIRROR_MIGRATION = "supabase/migrations/20261019120000_project_generations_updated_at.sql"
+MISSING_UPDATED_AT = f"BŁĄD: Tabela {MIRROR_TABLE} nie ma kolumny updated_at wymaganej przez mirror; zastosuj migrację {MIRROR_MIGRATION}."
+
+
+def _rest_url():
+    """PostgREST base URL: MIRROR_REST_URL (e.g. a local stand-in) or the Supabase REST endpoint."""
+    rest_url = os.getenv("MIRROR_REST_URL")
+    if rest_url:
+        return rest_url.rstrip("/")
+    supabase_url = os.getenv("SUPABASE_URL")
+    return f"{supabase_url.rstrip('/')}/rest/v1" if supabase_url else None
+
+
+def _quote(value):
+    # Wartości z ':', ',', '.' lub '(' muszą być w cudzysłowie w filtrach or=(...) PostgREST
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class GenerationMirror:
+    """
+    Local read-through mirror of the Supabase project_generations table.
+    sync() pulls rows changed since the last cursor (updated_at, key) in keyset-paginated pages;
+    reads are served from the local SQLite copy and trigger a sync only when the data is older than
+    the freshness bound. When Supabase is unreachable reads keep working and are marked stale.
+    Deleted remote rows are not detected. The table needs an updated_at column bumped by a trigger on every
+    update (MIRROR_MIGRATION); without it sync() fails with MISSING_UPDATED_AT instead of missing changes.
+    """
+
+    def __init__(self, path=MIRROR_DB_PATH, rest_url=None, api_key=None, key_column=MIRROR_KEY_COLUMN, page_size=MIRROR_PAGE_SIZE):
+        self.path = path
+        self.rest_url = rest_url or _rest_url()
+        self.api_key = api_key or os.getenv("SUPABASE_SERVICE_KEY")
+        self.key_column = key_column
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._session = requests.Session()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=30000")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    row_key TEXT PRIMARY KEY,
+                    project_name TEXT,
+                    status TEXT,
+                    updated_at TEXT,
+                    data TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_project ON generations (project_name, updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_generations_status ON generations (status, updated_at)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    table_name TEXT PRIMARY KEY,
+                    cursor_updated_at TEXT,
+                    cursor_key TEXT,
+                    last_sync_at REAL,
+                    last_attempt_at REAL,
+                    last_error TEXT
+                )
+            """)
+
+    def _headers(self):
+        headers = {"Accept": "application/json"}
+        if self.api_key:
+            headers["apikey"] = self.api_key
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _state(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cursor_updated_at, cursor_key, last_sync_at, last_attempt_at, last_error FROM sync_state WHERE table_name = ?",
+                (MIRROR_TABLE,)
+            ).fetchone()
+        return dict(zip(("cursor_updated_at", "cursor_key", "last_sync_at", "last_attempt_at", "last_error"), row or (None,) * 5))
+
+    def _save_state(self, **values):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO sync_state (table_name) VALUES (?)", (MIRROR_TABLE,))
+            for column, value in values.items():
+                self._conn.execute(f"UPDATE sync_state SET {column} = ? WHERE table_name = ?", (value, MIRROR_TABLE))
+
+    def _row_key(self, row):
+        key = row.get(self.key_column)
+        return str(key if key is not None else row.get("project_name"))
+
+    def apply_rows(self, rows):
+        """Upserts rows (e.g., a sync page or the data returned by a Supabase insert/update) into the mirror."""
+        rows = [row for row in rows or [] if isinstance(row, dict)]
+        with self._lock, self._conn:
+            for row in rows:
+                self._conn.execute(
+                    "INSERT INTO generations (row_key, project_name, status, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(row_key) DO UPDATE SET project_name = excluded.project_name, status = excluded.status, "
+                    "updated_at = excluded.updated_at, data = excluded.data "
+                    "WHERE excluded.updated_at IS NULL OR generations.updated_at IS NULL OR excluded.updated_at >= generations.updated_at",
+                    (self._row_key(row), row.get("project_name"), row.get("status"), row.get("updated_at"), json.dumps(row, ensure_ascii=False, default=str))
+                )
+        return len(rows)
+
+    def _fetch_page(self, cursor_updated_at, cursor_key):
+        params = {
+            "select": "*",
+            "order": f"updated_at.asc,{self.key_column}.asc",
+            "limit": str(self.page_size),
+        }
+        if cursor_updated_at is not None:
+            params["or"] = (
+                f"(updated_at.gt.{_quote(cursor_updated_at)},"
+                f"and(updated_at.eq.{_quote(cursor_updated_at)},{self.key_column}.gt.{_quote(cursor_key)}))"
+            )
+        response = self._session.get(f"{self.rest_url}/{MIRROR_TABLE}", headers=self._headers(), params=params, timeout=MIRROR_HTTP_TIMEOUT)
+        if response.status_code == 400:
+            try:
+                error = response.json()
+            except ValueError:
+                error = {}
+            # 42703 = undefined_column (PostgreSQL)
+            if error.get("code") == "42703" and "updated_at" in str(error.get("message")):
+                raise ValueError(MISSING_UPDATED_AT)
+        response.raise_for_status()
+        return response.json()
+
+    def sync(self):
+        """
+        Pulls all rows changed since the stored cursor.
+        Returns:
+            dict: {"ok": bool, "rows": number of synced rows, "error": message or None}
+        """
+        if not self.rest_url:
+            return {"ok": False, "rows": 0, "error": "SUPABASE_URL / MIRROR_REST_URL not set"}
+        with self._sync_lock:
+            state = self._state()
+            cursor_updated_at, cursor_key = state["cursor_updated_at"], state["cursor_key"]
+            synced = 0
+            self._save_state(last_attempt_at=time.time())
+            try:
+                while True:
+                    page = self._fetch_page(cursor_updated_at, cursor_key)
+                    if not page:
+                        break
+                    synced += self.apply_rows(page)
+                    last = page[-1]
+                    if last.get("updated_at") is None:
+                        # Bez updated_at nie da się przesuwać kursora; tabela wymaga tej kolumny
+                        raise ValueError(MISSING_UPDATED_AT)
+                    cursor_updated_at, cursor_key = last["updated_at"], self._row_key(last)
+                    self._save_state(cursor_updated_at=cursor_updated_at, cursor_key=cursor_key)
+                    if len(page) < self.page_size:
+                        break
+            except (requests.exceptions.RequestException, ValueError) as e:
+                self._save_state(last_error=str(e)[:500])
+                logging.warning(f"Mirror sync of {MIRROR_TABLE} failed after {synced} rows, serving local data: {e}")
+                return {"ok": False, "rows": synced, "error": str(e)}
+            self._save_state(last_sync_at=time.time(), last_error=None)
+        if synced:
+            logging.info(f"Mirror sync of {MIRROR_TABLE}: {synced} rows updated.")
+        return {"ok": True, "rows": synced, "error": None}
+
+    def freshness(self):
+        """Returns {"synced_at", "age", "last_error"} of the local copy (age is None if never synced)."""
+        state = self._state()
+        age = time.time() - state["last_sync_at"] if state["last_sync_at"] else None
+        return {"synced_at": state["last_sync_at"], "age": round(age, 3) if age is not None else None, "last_error": state["last_error"]}
+
+    def ensure_fresh(self, max_age=MIRROR_MAX_AGE_SECONDS):
+        """Syncs if the local copy is older than max_age (and the last failed attempt is not too recent)."""
+        state = self._state()
+        now = time.time()
+        if state["last_sync_at"] and now - state["last_sync_at"] <= max_age:
+            return True
+        if state["last_error"] and state["last_attempt_at"] and now - state["last_attempt_at"] < MIRROR_RETRY_AFTER_SECONDS:
+            return False
+        return self.sync()["ok"]
+
+    def _meta(self, max_age):
+        meta = self.freshness()
+        meta["stale"] = meta["age"] is None or meta["age"] > max_age
+        return meta
+
+    def get_latest(self, project_name, max_age=MIRROR_MAX_AGE_SECONDS):
+        """
+        Returns the most recent generation row of a project from the local mirror.
+        Returns:
+            tuple: (row dict or None, {"synced_at", "age", "stale", "last_error"})
+        """
+        self.ensure_fresh(max_age)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM generations WHERE project_name = ? ORDER BY updated_at DESC LIMIT 1", (project_name,)
+            ).fetchone()
+        return (json.loads(row[0]) if row else None), self._meta(max_age)
+
+    def list_generations(self, status=None, limit=50, offset=0, max_age=MIRROR_MAX_AGE_SECONDS):
+        """Returns (rows newest first, freshness meta), optionally filtered by status."""
+        self.ensure_fresh(max_age)
+        query = "SELECT data FROM generations"
+        params = []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY updated_at DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(query, params + [int(limit), int(offset)]).fetchall()
+        return [json.loads(row[0]) for row in rows], self._meta(max_age)
+
+    def start_background_sync(self, interval=MIRROR_MAX_AGE_SECONDS):
+        """Keeps the mirror fresh from a daemon thread so that reads never wait for the network."""
+        def run():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    logging.error(f"Mirror background sync error: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=run, name="generation-mirror-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        self._conn.close()
+
+
+_mirror = None
+
+
+def get_mirror():
+    """Returns the process-wide mirror instance."""
+    global _mirror
+    if _mirror is None:
+        _mirror = GenerationMirror()
+    return _mirror
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sync or query the local project_generations mirror.")
+    parser.add_argument("--sync", action="store_true", help="Pull changes from Supabase")
+    parser.add_argument("--project", help="Print the latest generation of this project")
+    parser.add_argument("--max-age", type=float, default=MIRROR_MAX_AGE_SECONDS, help="Freshness bound in seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    mirror = GenerationMirror()
+    if args.sync:
+        print(json.dumps(mirror.sync()))
+    if args.project:
+        row, meta = mirror.get_latest(args.project, max_age=args.max_age)
+        print(json.dumps({"generation": row, "freshness": meta}, default=str))
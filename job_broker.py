@@ -0,0 +1,532 @@
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlparse, unquote
+
+from utils import FACTORY_CACHE_DIR
+
+# sqlite:///ścieżka (jeden host, domyślnie) albo redis://[:hasło@]host:port/db (wiele hostów)
+JOB_BROKER_URL = os.getenv("JOB_BROKER_URL", "")
+BROKER_LEASE_SECONDS = float(os.getenv("BROKER_LEASE_SECONDS", "90"))
+BROKER_MAX_ATTEMPTS = int(os.getenv("BROKER_MAX_ATTEMPTS", "3"))
+BROKER_RETRY_BASE_SECONDS = float(os.getenv("BROKER_RETRY_BASE_SECONDS", "30"))
+BROKER_RETRY_MAX_SECONDS = float(os.getenv("BROKER_RETRY_MAX_SECONDS", "600"))
+BROKER_ARCHIVE_TTL_SECONDS = int(os.getenv("BROKER_ARCHIVE_TTL_SECONDS", str(7 * 24 * 3600)))
+BROKER_SOCKET_TIMEOUT = 10
+# Stany zadań w brokerze; "leased" = wykonywane przez workera, który odnawia dzierżawę
+BROKER_STATUSES = ("queued", "leased", "succeeded", "failed", "cancelled")
+FINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class BrokerError(RuntimeError):
+    pass
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter before the next attempt of a failed job."""
+    return min(BROKER_RETRY_MAX_SECONDS, BROKER_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+class SqliteBroker:
+    """
+    Job broker for a single host (or a shared filesystem): a SQLite table of jobs with leases.
+    A worker claims a due job in an IMMEDIATE transaction, renews the lease with heartbeats and
+    reports the result; a job whose lease expired is claimed again by the next worker, until
+    max_attempts is reached. Delivery is at-least-once.
+    """
+
+    remote = False
+
+    def __init__(self, path=os.path.join(FACTORY_CACHE_DIR, "broker.db"), max_attempts=BROKER_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS broker_jobs (
+                id TEXT PRIMARY KEY,
+                project TEXT NOT NULL,
+                job TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_expires_at REAL,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                manifest TEXT,
+                archive BLOB
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_broker_due ON broker_jobs (status, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_broker_updated ON broker_jobs (updated_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_broker_project ON broker_jobs (project, status, updated_at)")
+
+    def submit(self, job_id, job):
+        """Queues a job ({"project", "mode", "params"}). Submitting an existing id is a no-op."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO broker_jobs (id, project, job, status, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, job["project"], json.dumps(job, ensure_ascii=False), now, now, now)
+            )
+        return job_id
+
+    def claim(self, worker_id, lease_seconds=BROKER_LEASE_SECONDS):
+        """
+        Leases the oldest due job to worker_id.
+        Returns:
+            dict|None: {"id", "job", "attempts"}, or None if no job is due.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Dzierżawy, które wygasły po ostatniej próbie, kończą zadanie błędem
+                self._conn.execute(
+                    "UPDATE broker_jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                    "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                row = self._conn.execute(
+                    "SELECT id, job, attempts FROM broker_jobs "
+                    "WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'leased' AND lease_expires_at < ?) "
+                    "ORDER BY next_attempt_at LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE broker_jobs SET status = 'leased', attempts = attempts + 1, worker = ?, lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                        (worker_id, now + lease_seconds, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return {"id": row["id"], "job": json.loads(row["job"]), "attempts": row["attempts"] + 1}
+
+    def heartbeat(self, job_id, worker_id, progress=None, lease_seconds=BROKER_LEASE_SECONDS):
+        """Renews the lease and stores progress. Returns False if the worker no longer holds the lease."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE broker_jobs SET lease_expires_at = ?, updated_at = ?, progress = COALESCE(?, progress) "
+                "WHERE id = ? AND status = 'leased' AND worker = ?",
+                (now + lease_seconds, now, json.dumps(progress, ensure_ascii=False) if progress is not None else None, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, status, result=None, error=None, manifest=None, progress=None, archive=None):
+        """Stores the final status of a job. Returns False if the lease was lost to another worker."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE broker_jobs SET status = ?, result = ?, error = ?, manifest = ?, progress = COALESCE(?, progress), archive = ?, "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ? AND status = 'leased' AND worker = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 json.dumps(manifest) if manifest is not None else None,
+                 json.dumps(progress, ensure_ascii=False) if progress is not None else None,
+                 archive, now, job_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error):
+        """
+        Reports a failed attempt: the job is queued again with backoff, or marked failed after max_attempts.
+        Returns:
+            str|None: The new status, or None if the lease was lost.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT attempts FROM broker_jobs WHERE id = ? AND status = 'leased' AND worker = ?", (job_id, worker_id)
+                ).fetchone()
+                status = None
+                if row is not None:
+                    status = "failed" if row["attempts"] >= self.max_attempts else "queued"
+                    self._conn.execute(
+                        "UPDATE broker_jobs SET status = ?, error = ?, lease_expires_at = NULL, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                        (status, error, now + retry_delay(row["attempts"]), now, job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return status
+
+    def cancel(self, job_id, reason="cancelled"):
+        """Cancels a queued or running job. The worker running it sees the lost lease and stops the run. Returns False if already final."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE broker_jobs SET status = 'cancelled', error = ?, lease_expires_at = NULL, updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'leased')",
+                (reason, now, job_id)
+            )
+        return cursor.rowcount == 1
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM broker_jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row[0] == "cancelled"
+
+    @staticmethod
+    def _job_dict(row):
+        job = {key: row[key] for key in ("id", "project", "status", "attempts", "worker", "lease_expires_at", "created_at", "updated_at", "error")}
+        job["job"] = json.loads(row["job"])
+        for key in ("progress", "result", "manifest"):
+            job[key] = json.loads(row[key]) if row[key] else None
+        return job
+
+    def get(self, job_id):
+        """Returns the broker record of a job (without the archive), or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM broker_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job_dict(row) if row else None
+
+    def updates(self, since, limit=100):
+        """Returns jobs updated after `since` (oldest first), for syncing status into a central job store."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM broker_jobs WHERE updated_at > ? ORDER BY updated_at LIMIT ?", (since, limit)
+            ).fetchall()
+        return [self._job_dict(row) for row in rows]
+
+    def get_archive(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT archive FROM broker_jobs WHERE id = ?", (job_id,)).fetchone()
+        return bytes(row[0]) if row and row[0] is not None else None
+
+    def latest_archive_job(self, project):
+        """Returns the id of the project's latest succeeded job that has an archive, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM broker_jobs WHERE project = ? AND status = 'succeeded' AND archive IS NOT NULL "
+                "ORDER BY updated_at DESC LIMIT 1", (project,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def latest_archive(self, project):
+        """Returns the tar.zst archive of the project's latest succeeded job that has one, or None."""
+        job_id = self.latest_archive_job(project)
+        return self.get_archive(job_id) if job_id else None
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM broker_jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        self._conn.close()
+
+
+class RespClient:
+    """
+    Minimal Redis protocol (RESP2) client: one connection, commands serialised by a lock,
+    one reconnect on a broken connection. Enough for the broker; no pipelining or pub/sub.
+    """
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=BROKER_SOCKET_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def _disconnect(self):
+        for resource in (self._file, self._sock):
+            if resource is not None:
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+        self._sock = self._file = None
+
+    @staticmethod
+    def _encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, float):
+                data = repr(arg).encode()
+            else:
+                data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by the broker")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise BrokerError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("Connection closed by the broker")
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise BrokerError(f"Unexpected reply from broker: {line[:50]!r}")
+
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def execute(self, *args):
+        """Sends one command. Returns str (status), int, bytes, list or None; raises BrokerError on an error reply."""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError) as e:
+                    self._disconnect()
+                    if attempt == 2:
+                        raise BrokerError(f"Broker {self.host}:{self.port} unavailable: {e}") from e
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class RedisBroker:
+    """
+    Job broker over the Redis protocol, for workers on several hosts. Uses only basic commands
+    (hashes and sorted sets, no Lua or transactions), so any Redis-compatible server works:
+      <prefix>job:<id>   hash with the job record
+      <prefix>ready      zset of queued job ids, score = next attempt time
+      <prefix>leases     zset of leased job ids, score = lease expiry
+      <prefix>updated    zset of job ids, score = last update (for status sync)
+      <prefix>archive:<id>, <prefix>latest:<project>   tar.zst of a succeeded job (with TTL)
+    A claim is won by the worker whose ZREM removes the id from the ready (or leases) set.
+    """
+
+    remote = True
+
+    def __init__(self, client, prefix="factory:", max_attempts=BROKER_MAX_ATTEMPTS):
+        self.client = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def _touch(self, job_id, now, **fields):
+        fields["updated_at"] = now
+        args = []
+        for name, value in fields.items():
+            args.extend([name, "" if value is None else value])
+        self.client.execute("HSET", self._key("job", job_id), *args)
+        self.client.execute("ZADD", self._key("updated"), now, job_id)
+
+    def _field(self, job_id, name):
+        return _text(self.client.execute("HGET", self._key("job", job_id), name))
+
+    def submit(self, job_id, job):
+        now = time.time()
+        if self.client.execute("HSETNX", self._key("job", job_id), "job", json.dumps(job, ensure_ascii=False)) == 0:
+            return job_id
+        self._touch(job_id, now, project=job["project"], status="queued", attempts=0, created_at=now)
+        self.client.execute("ZADD", self._key("ready"), now, job_id)
+        return job_id
+
+    def _reap_expired(self, now):
+        for job_id in self.client.execute("ZRANGEBYSCORE", self._key("leases"), "-inf", now, "LIMIT", 0, 10) or []:
+            job_id = _text(job_id)
+            if self.client.execute("ZREM", self._key("leases"), job_id) != 1:
+                continue
+            attempts = int(self._field(job_id, "attempts") or 0)
+            if attempts >= self.max_attempts:
+                self._touch(job_id, now, status="failed", error="lease expired", lease_expires_at=None)
+            else:
+                logging.warning(f"Lease of job {job_id} expired, queueing it again.")
+                self._touch(job_id, now, status="queued", lease_expires_at=None)
+                self.client.execute("ZADD", self._key("ready"), now, job_id)
+
+    def claim(self, worker_id, lease_seconds=BROKER_LEASE_SECONDS):
+        now = time.time()
+        self._reap_expired(now)
+        for job_id in self.client.execute("ZRANGEBYSCORE", self._key("ready"), "-inf", now, "LIMIT", 0, 5) or []:
+            job_id = _text(job_id)
+            if self.client.execute("ZREM", self._key("ready"), job_id) != 1:
+                continue # zadanie przejął inny worker
+            self.client.execute("ZADD", self._key("leases"), now + lease_seconds, job_id)
+            attempts = self.client.execute("HINCRBY", self._key("job", job_id), "attempts", 1)
+            self._touch(job_id, now, status="leased", worker=worker_id, lease_expires_at=now + lease_seconds)
+            return {"id": job_id, "job": json.loads(self._field(job_id, "job")), "attempts": attempts}
+        return None
+
+    def _holds_lease(self, job_id, worker_id):
+        status, worker = self.client.execute("HMGET", self._key("job", job_id), "status", "worker")
+        return _text(status) == "leased" and _text(worker) == worker_id
+
+    def heartbeat(self, job_id, worker_id, progress=None, lease_seconds=BROKER_LEASE_SECONDS):
+        if not self._holds_lease(job_id, worker_id):
+            return False
+        now = time.time()
+        self.client.execute("ZADD", self._key("leases"), now + lease_seconds, job_id)
+        fields = {"lease_expires_at": now + lease_seconds}
+        if progress is not None:
+            fields["progress"] = json.dumps(progress, ensure_ascii=False)
+        self._touch(job_id, now, **fields)
+        return True
+
+    def complete(self, job_id, worker_id, status, result=None, error=None, manifest=None, progress=None, archive=None):
+        if not self._holds_lease(job_id, worker_id):
+            return False
+        now = time.time()
+        self.client.execute("ZREM", self._key("leases"), job_id)
+        if archive is not None:
+            self.client.execute("SET", self._key("archive", job_id), archive, "EX", BROKER_ARCHIVE_TTL_SECONDS)
+            self.client.execute("SET", self._key("latest", self._field(job_id, "project")), job_id, "EX", BROKER_ARCHIVE_TTL_SECONDS)
+        fields = {
+            "status": status,
+            "error": error,
+            "lease_expires_at": None,
+            "result": json.dumps(result, ensure_ascii=False) if result is not None else None,
+            "manifest": json.dumps(manifest) if manifest is not None else None,
+        }
+        if progress is not None:
+            fields["progress"] = json.dumps(progress, ensure_ascii=False)
+        self._touch(job_id, now, **fields)
+        return True
+
+    def fail(self, job_id, worker_id, error):
+        if not self._holds_lease(job_id, worker_id):
+            return None
+        now = time.time()
+        self.client.execute("ZREM", self._key("leases"), job_id)
+        attempts = int(self._field(job_id, "attempts") or 0)
+        if attempts >= self.max_attempts:
+            self._touch(job_id, now, status="failed", error=error, lease_expires_at=None)
+            return "failed"
+        self._touch(job_id, now, status="queued", error=error, lease_expires_at=None)
+        self.client.execute("ZADD", self._key("ready"), now + retry_delay(attempts), job_id)
+        return "queued"
+
+    def cancel(self, job_id, reason="cancelled"):
+        if self._field(job_id, "status") not in ("queued", "leased"):
+            return False
+        self.client.execute("ZREM", self._key("ready"), job_id)
+        self.client.execute("ZREM", self._key("leases"), job_id)
+        self._touch(job_id, time.time(), status="cancelled", error=reason, lease_expires_at=None)
+        return True
+
+    def cancel_requested(self, job_id):
+        return self._field(job_id, "status") == "cancelled"
+
+    def get(self, job_id):
+        values = self.client.execute("HGETALL", self._key("job", job_id))
+        if not values:
+            return None
+        record = {_text(values[i]): _text(values[i + 1]) for i in range(0, len(values), 2)}
+        job = {"id": job_id, "job": json.loads(record["job"])}
+        job["project"] = record.get("project") or job["job"].get("project")
+        job["status"] = record.get("status")
+        job["worker"] = record.get("worker") or None
+        job["error"] = record.get("error") or None
+        job["attempts"] = int(record.get("attempts") or 0)
+        for key in ("lease_expires_at", "created_at", "updated_at"):
+            job[key] = float(record[key]) if record.get(key) else None
+        for key in ("progress", "result", "manifest"):
+            job[key] = json.loads(record[key]) if record.get(key) else None
+        return job
+
+    def updates(self, since, limit=100):
+        job_ids = self.client.execute("ZRANGEBYSCORE", self._key("updated"), f"({since!r}", "+inf", "LIMIT", 0, limit) or []
+        jobs = [self.get(_text(job_id)) for job_id in job_ids]
+        return [job for job in jobs if job is not None]
+
+    def get_archive(self, job_id):
+        return self.client.execute("GET", self._key("archive", job_id))
+
+    def latest_archive_job(self, project):
+        return _text(self.client.execute("GET", self._key("latest", project)))
+
+    def latest_archive(self, project):
+        job_id = self.latest_archive_job(project)
+        return self.get_archive(job_id) if job_id else None
+
+    def stats(self):
+        stats = {"queued": self.client.execute("ZCARD", self._key("ready")), "leased": self.client.execute("ZCARD", self._key("leases"))}
+        return {status: count for status, count in stats.items() if count}
+
+    def close(self):
+        self.client.close()
+
+
+def get_broker(url=None):
+    """
+    Creates the broker for a URL (default JOB_BROKER_URL):
+    sqlite:///path/to/broker.db, sqlite:// (default path in the factory cache) or redis://[:password@]host[:port][/db].
+    """
+    url = url or JOB_BROKER_URL or "sqlite://"
+    parsed = urlparse(url)
+    if parsed.scheme == "sqlite":
+        path = unquote(parsed.path)
+        return SqliteBroker(path) if path else SqliteBroker()
+    if parsed.scheme in ("redis", "resp"):
+        db = int(parsed.path.lstrip("/") or 0)
+        client = RespClient(parsed.hostname or "localhost", parsed.port or 6379, db=db, password=unquote(parsed.password) if parsed.password else None)
+        return RedisBroker(client, prefix=os.getenv("BROKER_REDIS_PREFIX", "factory:"))
+    raise ValueError(f"BŁĄD: Nieobsługiwany adres brokera zadań: {url}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inspect the job broker used by generate_project.py --worker.")
+    parser.add_argument("--broker", help="Broker URL (default: JOB_BROKER_URL or the local SQLite broker)")
+    parser.add_argument("--status", metavar="JOB_ID", help="Show the broker record of a job")
+    parser.add_argument("--stats", action="store_true", help="Show job counts per status")
+    cli_args = parser.parse_args()
+
+    broker = get_broker(cli_args.broker)
+    if cli_args.status:
+        print(json.dumps(broker.get(cli_args.status), indent=2, ensure_ascii=False))
+    if cli_args.stats or not cli_args.status:
+        print(json.dumps(broker.stats(), indent=2))
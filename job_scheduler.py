@@ -0,0 +1,207 @@
+import os
+import math
+import json
+import time
+import logging
+import threading
+import itertools
+
+# Harmonogram zadań panelu: kolejki per użytkownik/klucz API, sprawiedliwy podział ważony (start-time fair
+# queuing), limit współbieżności (wspólny limit zapytań Gemini) i kontrola przyjęć (pozycja w kolejce lub 429).
+SCHEDULER_MAX_RUNNING = int(os.getenv("SCHEDULER_MAX_RUNNING", "4"))
+# Miejsca zarezerwowane dla zadań interaktywnych (edycje): generowanie zbiorcze nigdy ich nie zajmuje
+SCHEDULER_INTERACTIVE_RESERVED = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVED", "1"))
+# Limit zadań uruchomionych jednocześnie przez jednego użytkownika (0 = bez limitu)
+SCHEDULER_TENANT_MAX_RUNNING = int(os.getenv("SCHEDULER_TENANT_MAX_RUNNING", "0"))
+SCHEDULER_MAX_QUEUED = int(os.getenv("SCHEDULER_MAX_QUEUED", "100"))
+SCHEDULER_MAX_QUEUED_PER_TENANT = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_TENANT", "10"))
+# Wagi użytkowników (klucz API jako "key-<skrót sha256>" albo adres klienta), np. {"key-3f2a9c1b7d4e": 3, "10.0.0.5": 2}; domyślnie 1
+SCHEDULER_TENANT_WEIGHTS = json.loads(os.getenv("SCHEDULER_TENANT_WEIGHTS", "{}"))
+# Początkowe szacunki czasu zadania (s) dla podpowiedzi Retry-After; potem średnia krocząca z ukończonych zadań
+SCHEDULER_JOB_SECONDS = {
+    "interactive": float(os.getenv("SCHEDULER_EDIT_SECONDS", "60")),
+    "bulk": float(os.getenv("SCHEDULER_GENERATE_SECONDS", "600")),
+}
+# Klasy opóźnień w kolejności obsługi
+LATENCY_CLASSES = ("interactive", "bulk")
+DURATION_EWMA_ALPHA = 0.2
+MAX_RETRY_AFTER_SECONDS = 3600
+
+
+class QueueFull(Exception):
+    """Raised when a submission is not admitted; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ScheduledJob:
+    def __init__(self, job_id, tenant, latency_class, payload, start_tag, finish_tag, seq):
+        self.job_id = job_id
+        self.tenant = tenant
+        self.latency_class = latency_class
+        self.payload = payload
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+    def order(self):
+        return (LATENCY_CLASSES.index(self.latency_class), self.start_tag, self.seq)
+
+
+class FairScheduler:
+    """
+    Admission control and fair dispatch of panel jobs.
+    Jobs are served per latency class (interactive edits before bulk generation, with reserved slots so
+    small jobs never wait behind long generations); within a class, tenants share the slots in proportion
+    to their weights (start-time fair queuing: each job gets a virtual start tag, so a tenant that queues
+    many jobs does not delay the others' next job). At most max_running jobs run at once; when a job
+    cannot start, it is queued (with its position) or rejected with a retry hint if the queues are full.
+    """
+
+    def __init__(self, dispatch, max_running=SCHEDULER_MAX_RUNNING, interactive_reserved=SCHEDULER_INTERACTIVE_RESERVED,
+                 tenant_max_running=SCHEDULER_TENANT_MAX_RUNNING, max_queued=SCHEDULER_MAX_QUEUED,
+                 max_queued_per_tenant=SCHEDULER_MAX_QUEUED_PER_TENANT, weights=None):
+        """
+        Args:
+            dispatch (callable): dispatch(job) starts a ScheduledJob without blocking; finished(job_id) must follow.
+        """
+        self.dispatch = dispatch
+        self.max_running = max(1, max_running)
+        self.interactive_reserved = min(max(0, interactive_reserved), self.max_running - 1)
+        self.tenant_max_running = tenant_max_running
+        self.max_queued = max_queued
+        self.max_queued_per_tenant = max_queued_per_tenant
+        self.weights = SCHEDULER_TENANT_WEIGHTS if weights is None else weights
+        self.durations = dict(SCHEDULER_JOB_SECONDS)
+        self._queued = {}
+        self._running = {}
+        self._virtual_time = {name: 0.0 for name in LATENCY_CLASSES}
+        self._last_finish = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _slots(self, latency_class):
+        return self.max_running if latency_class == "interactive" else self.max_running - self.interactive_reserved
+
+    def _can_start(self, job):
+        running = list(self._running.values())
+        if len(running) >= self.max_running:
+            return False
+        if job.latency_class == "bulk" and sum(1 for r in running if r.latency_class == "bulk") >= self._slots("bulk"):
+            return False
+        if self.tenant_max_running and sum(1 for r in running if r.tenant == job.tenant) >= self.tenant_max_running:
+            return False
+        return True
+
+    def _ordered(self):
+        return sorted(self._queued.values(), key=ScheduledJob.order)
+
+    def _next_ready(self):
+        # Pierwsze zadanie w kolejności sprawiedliwej, które może ruszyć (zadania użytkownika z wyczerpanym limitem są pomijane)
+        for job in self._ordered():
+            if self._can_start(job):
+                return job
+        return None
+
+    def _retry_after(self, latency_class, ahead):
+        seconds = self.durations[latency_class] * math.ceil((ahead + 1) / self._slots(latency_class))
+        return int(min(MAX_RETRY_AFTER_SECONDS, max(1, seconds)))
+
+    def _ahead(self, job):
+        order = job.order()
+        return sum(1 for other in self._queued.values() if other.order() < order)
+
+    def submit(self, job_id, tenant, latency_class="bulk", payload=None):
+        """
+        Admits a job: starts it if a slot is free, otherwise queues it.
+        Returns:
+            dict: {"status": "running" | "queued", "position" (1-based, queued only), "retry_after" (estimated wait, queued only)}
+        Raises:
+            QueueFull: If the job cannot start and the tenant's or the global queue is full.
+        """
+        if latency_class not in LATENCY_CLASSES:
+            raise ValueError(f"BŁĄD: Nieznana klasa opóźnień {latency_class} (dostępne: {', '.join(LATENCY_CLASSES)}).")
+        with self._lock:
+            key = (latency_class, tenant)
+            start_tag = max(self._virtual_time[latency_class], self._last_finish.get(key, 0.0))
+            job = ScheduledJob(job_id, tenant, latency_class, payload, start_tag,
+                               start_tag + 1.0 / float(self.weights.get(tenant, 1)), next(self._seq))
+            if not (self._can_start(job) and self._ahead(job) == 0):
+                tenant_queued = sum(1 for q in self._queued.values() if q.tenant == tenant)
+                if tenant_queued >= self.max_queued_per_tenant:
+                    raise QueueFull(f"too many queued jobs for {tenant} ({tenant_queued})", self._retry_after(latency_class, tenant_queued))
+                if len(self._queued) >= self.max_queued:
+                    raise QueueFull(f"job queue is full ({len(self._queued)})", self._retry_after(latency_class, self._ahead(job)))
+            self._last_finish[key] = job.finish_tag
+            self._queued[job_id] = job
+        self._dispatch_ready()
+        with self._lock:
+            if job_id not in self._queued:
+                return {"status": "running"}
+            ahead = self._ahead(job)
+            return {"status": "queued", "position": ahead + 1, "retry_after": self._retry_after(latency_class, ahead)}
+
+    def _dispatch_ready(self):
+        while True:
+            with self._lock:
+                job = self._next_ready()
+                if job is None:
+                    return
+                del self._queued[job.job_id]
+                self._virtual_time[job.latency_class] = max(self._virtual_time[job.latency_class], job.start_tag)
+                job.started_at = time.monotonic()
+                self._running[job.job_id] = job
+            logging.info(f"Scheduler: starting job {job.job_id} ({job.latency_class}, {job.tenant}), waited {job.started_at - job.enqueued_at:.1f}s.")
+            try:
+                self.dispatch(job)
+            except Exception as e:
+                logging.error(f"Scheduler: dispatch of job {job.job_id} failed: {e}")
+                with self._lock:
+                    self._running.pop(job.job_id, None)
+
+    def finished(self, job_id):
+        """Frees the slot of a finished job and starts the next queued jobs."""
+        with self._lock:
+            job = self._running.pop(job_id, None)
+            if job is not None:
+                seconds = time.monotonic() - job.started_at
+                previous = self.durations[job.latency_class]
+                self.durations[job.latency_class] = previous + DURATION_EWMA_ALPHA * (seconds - previous)
+        self._dispatch_ready()
+
+    def cancel(self, job_id):
+        """Removes a queued job. Returns True if it was still queued."""
+        with self._lock:
+            return self._queued.pop(job_id, None) is not None
+
+    def position(self, job_id):
+        """1-based position of a queued job in the dispatch order, or None if it is not queued."""
+        with self._lock:
+            job = self._queued.get(job_id)
+            return self._ahead(job) + 1 if job is not None else None
+
+    def stats(self):
+        with self._lock:
+            tenants = {}
+            for state, jobs in (("running", self._running), ("queued", self._queued)):
+                for job in jobs.values():
+                    counts = tenants.setdefault(job.tenant, {"running": 0, "queued": 0})
+                    counts[state] += 1
+            return {
+                "max_running": self.max_running,
+                "interactive_reserved": self.interactive_reserved,
+                "running": len(self._running),
+                "queued": len(self._queued),
+                "by_class": {
+                    name: {
+                        "running": sum(1 for job in self._running.values() if job.latency_class == name),
+                        "queued": sum(1 for job in self._queued.values() if job.latency_class == name),
+                        "estimated_job_seconds": round(self.durations[name], 1),
+                    } for name in LATENCY_CLASSES
+                },
+                "tenants": tenants,
+            }
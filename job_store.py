@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from utils import FACTORY_CACHE_DIR
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", os.path.join(FACTORY_CACHE_DIR, "jobs.db"))
+MAX_PAGE_SIZE = 100
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "merged", "cancelled")
+# Katalogi pomijane w manifeście artefaktów
+ARTIFACT_SKIP_DIRS = {"node_modules", ".git", ".next", "__pycache__", ".venv", "venv", ".deps", ".scannerwork", ".factory"}
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def build_artifact_manifest(project_dir):
+    """Returns [{"path", "size", "sha256"}] for the project's files, skipping dependency and metadata directories."""
+    manifest = []
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = sorted(d for d in dirs if d not in ARTIFACT_SKIP_DIRS)
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest = hashlib.sha256()
+            try:
+                with open(file_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(65536), b""):
+                        digest.update(chunk)
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            manifest.append({
+                "path": os.path.relpath(file_path, project_dir).replace(os.sep, "/"),
+                "size": size,
+                "sha256": digest.hexdigest(),
+            })
+    return manifest
+
+
+class JobStore:
+    """
+    Local SQLite store of generation/edit runs: parameters, status, stage timings, token counts
+    and the artifact manifest. Indexed by project, status and creation time so that the panel's
+    status and history lookups are local index reads.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    project TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    tokens INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_project ON jobs (project, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_stages (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    seconds REAL,
+                    tokens INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (job_id, position)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_artifacts (
+                    job_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    PRIMARY KEY (job_id, path)
+                )
+            """)
+
+    def create_job(self, project, mode, params, job_id=None, status="queued"):
+        """Creates a job record. Returns the job id."""
+        job_id = job_id or new_job_id()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO jobs (id, project, mode, status, params, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, project, mode, status, json.dumps(params, ensure_ascii=False), time.time())
+            )
+        return job_id
+
+    def start_job(self, job_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?) WHERE id = ?", (time.time(), job_id))
+
+    def finish_job(self, job_id, status, result=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps(result, ensure_ascii=False) if result is not None else None, error, job_id)
+            )
+
+    def cancel_queued_jobs(self, error, keep=None):
+        """
+        Marks every job still 'queued' as cancelled (queues lost with their process), except the jobs for
+        which keep(job_id) is true (e.g. jobs already handed to a broker). Returns the number of jobs.
+        """
+        with self._lock:
+            job_ids = [row[0] for row in self._conn.execute("SELECT id FROM jobs WHERE status = 'queued'")]
+        job_ids = [job_id for job_id in job_ids if keep is None or not keep(job_id)]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, error = ? WHERE id = ? AND status = 'queued'",
+                [(time.time(), error, job_id) for job_id in job_ids]
+            )
+        return len(job_ids)
+
+    def record_stage(self, job_id, stage, started_at, seconds=None, tokens=0):
+        """Inserts or updates a stage row (identified by its start time within the job)."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT position FROM job_stages WHERE job_id = ? AND stage = ? AND started_at = ?", (job_id, stage, started_at)
+            ).fetchone()
+            if row is None:
+                position = self._conn.execute("SELECT COUNT(*) FROM job_stages WHERE job_id = ?", (job_id,)).fetchone()[0]
+                self._conn.execute(
+                    "INSERT INTO job_stages (job_id, position, stage, started_at, seconds, tokens) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, position, stage, started_at, seconds, tokens)
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE job_stages SET seconds = ?, tokens = ? WHERE job_id = ? AND position = ?", (seconds, tokens, job_id, row[0])
+                )
+            self._conn.execute(
+                "UPDATE jobs SET tokens = (SELECT COALESCE(SUM(tokens), 0) FROM job_stages WHERE job_id = ?) WHERE id = ?", (job_id, job_id)
+            )
+
+    def set_artifacts(self, job_id, manifest):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM job_artifacts WHERE job_id = ?", (job_id,))
+            self._conn.executemany(
+                "INSERT INTO job_artifacts (job_id, path, size, sha256) VALUES (?, ?, ?, ?)",
+                [(job_id, item["path"], item["size"], item["sha256"]) for item in manifest]
+            )
+
+    @staticmethod
+    def _job_dict(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["seconds"] = round(job["finished_at"] - job["started_at"], 3) if job["finished_at"] and job["started_at"] else None
+        return job
+
+    def get_job(self, job_id):
+        """Returns the job with its stages and artifact manifest, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            stages = self._conn.execute(
+                "SELECT stage, started_at, seconds, tokens FROM job_stages WHERE job_id = ? ORDER BY position", (job_id,)
+            ).fetchall()
+            artifacts = self._conn.execute(
+                "SELECT path, size, sha256 FROM job_artifacts WHERE job_id = ? ORDER BY path", (job_id,)
+            ).fetchall()
+        job = self._job_dict(row)
+        job["stages"] = [dict(stage) for stage in stages]
+        job["artifacts"] = [dict(artifact) for artifact in artifacts]
+        return job
+
+    def list_jobs(self, project=None, status=None, limit=20, offset=0):
+        """
+        Returns a page of jobs, newest first, without stages and artifacts.
+        Returns:
+            dict: {"jobs": [...], "total": int, "limit": int, "offset": int}
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        conditions, params = [], []
+        if project:
+            conditions.append("project = ?")
+            params.append(project)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM jobs {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return {"jobs": [self._job_dict(row) for row in rows], "total": total, "limit": limit, "offset": offset}
+
+    def close(self):
+        self._conn.close()
+
+
+class JobRecorder:
+    """
+    Records one run into the job store. Stages are marked sequentially with stage(name): marking a
+    stage closes the previous one, so the inline pipeline stages need no restructuring.
+    Store errors are logged and never interrupt the pipeline. Listeners (e.g., a profiler) receive
+    the same stage(name) and finish(status, ...) calls.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self._stage = None
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _safe(self, fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.Error as e:
+            logging.error(f"Job store error for job {self.job_id}: {e}")
+
+    def start(self):
+        self._safe(self.store.start_job, self.job_id)
+
+    def stage(self, name):
+        for listener in self.listeners:
+            listener.stage(name)
+        self._close_stage()
+        self._stage = {"name": name, "started_at": time.time(), "tokens": 0}
+        self._safe(self.store.record_stage, self.job_id, name, self._stage["started_at"])
+
+    def add_tokens(self, tokens):
+        if self._stage is not None:
+            self._stage["tokens"] += int(tokens or 0)
+
+    def _close_stage(self):
+        if self._stage is not None:
+            stage = self._stage
+            self._safe(self.store.record_stage, self.job_id, stage["name"], stage["started_at"], round(time.time() - stage["started_at"], 3), stage["tokens"])
+            self._stage = None
+
+    def finish(self, status, result=None, error=None, project_dir=None, manifest=None):
+        self._close_stage()
+        if manifest is not None:
+            # Manifest z magazynu artefaktów (hashe już policzone przy ingest)
+            self._safe(self.store.set_artifacts, self.job_id, manifest)
+        elif project_dir and os.path.isdir(project_dir):
+            self._safe(self.store.set_artifacts, self.job_id, build_artifact_manifest(project_dir))
+        self._safe(self.store.finish_job, self.job_id, status, result, error)
+        for listener in self.listeners:
+            try:
+                listener.finish(status, result=result, error=error)
+            except Exception as e:
+                logging.error(f"Job listener error for job {self.job_id}: {e}")
@@ -0,0 +1,331 @@
+import os
+import sys
+import time
+import random
+import shutil
+import signal
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+
+from job_broker import BROKER_LEASE_SECONDS, FINAL_STATUSES, BrokerError, get_broker
+from job_store import JobStore, ARTIFACT_SKIP_DIRS
+from cancellation import CANCELLED_EXIT_CODE
+from config import get_settings
+from fake_generator import FAKE_GENERATOR, FAKE_GENERATOR_SCRIPT
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", str(BROKER_LEASE_SECONDS / 3)))
+# Jak często worker sprawdza, czy zadanie anulowano (anulowanie ma zatrzymać przebieg w ciągu sekundy)
+WORKER_CANCEL_POLL_SECONDS = float(os.getenv("WORKER_CANCEL_POLL_SECONDS", "0.5"))
+# Archiwum tar.zst projektu trafia do brokera tylko przy brokerze zdalnym (inne hosty nie widzą katalogu projects/)
+WORKER_ARCHIVE_MAX_BYTES = int(os.getenv("WORKER_ARCHIVE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Kod wyjścia generate_project.py przy błędnych argumentach: ponowienie nic nie zmieni
+INVALID_ARGS_EXIT_CODE = 2
+GENERATE_SCRIPT = FAKE_GENERATOR_SCRIPT if FAKE_GENERATOR else os.path.join(os.path.dirname(os.path.abspath(__file__)), "generate_project.py")
+PROJECTS_DIR = "projects"
+# Id zadania, którego archiwum odpowiada lokalnej kopii projektu (odtworzone lub wysłane przez ten host)
+WORKER_SNAPSHOT_MARKER = os.path.join(".factory", "broker_archive_job")
+
+
+def build_command(job, job_id):
+    """Returns the generate_project.py command line of a broker job ({"project", "mode", "params"})."""
+    params = job.get("params") or {}
+    command = [sys.executable, GENERATE_SCRIPT, "--project", job["project"]]
+    if job.get("mode") == "edit":
+        command.extend(["--edit", "--changes", params.get("changes", "")])
+    else:
+        for name in ("framework", "features", "config"):
+            if params.get(name):
+                command.extend([f"--{name}", params[name]])
+    command.extend(["--job-id", job_id])
+    return command
+
+
+def _read_marker(project_dir):
+    try:
+        with open(os.path.join(project_dir, WORKER_SNAPSHOT_MARKER), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write_marker(project_dir, job_id):
+    marker = os.path.join(project_dir, WORKER_SNAPSHOT_MARKER)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(job_id)
+
+
+def _restore_project(archive, project):
+    """
+    Replaces the files of projects/<project> with the content of a broker archive: archived files are
+    written, files missing from the archive are removed. Directories not archived (ARTIFACT_SKIP_DIRS:
+    .factory, .git, node_modules, ...) are kept. Returns the number of restored files.
+    """
+    from artifact_store import extract_archive
+
+    os.makedirs(PROJECTS_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=PROJECTS_DIR, prefix=".restore-")
+    try:
+        files = extract_archive(archive, staging)
+        source_dir = os.path.join(staging, project)
+        project_dir = os.path.join(PROJECTS_DIR, project)
+        restored = set()
+        for root, _, names in os.walk(source_dir):
+            for name in names:
+                rel_path = os.path.relpath(os.path.join(root, name), source_dir)
+                target = os.path.join(project_dir, rel_path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(os.path.join(root, name), target)
+                restored.add(rel_path)
+        for root, dirs, names in os.walk(project_dir):
+            dirs[:] = [d for d in dirs if d not in ARTIFACT_SKIP_DIRS]
+            for name in names:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, project_dir) not in restored:
+                    os.remove(path)
+        return files
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def job_progress(job_record):
+    """Progress reported with heartbeats: status, token count and stage timings from the local job store."""
+    if job_record is None:
+        return None
+    return {"status": job_record["status"], "tokens": job_record["tokens"], "stages": job_record["stages"]}
+
+
+class Worker:
+    """
+    Runs broker jobs on this host: claims a job, runs generate_project.py for it in a subprocess,
+    renews the lease while it runs and reports status, result and artifact manifest back to the broker.
+    Workers share nothing but the broker, so throughput grows with the number of worker processes/hosts
+    (bounded by the LLM provider's rate limits).
+    """
+
+    def __init__(self, broker, slots=1, worker_id=None):
+        self.broker = broker
+        self.slots = max(1, slots)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.job_store = JobStore()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self.completed = 0
+
+    def stop(self, *_):
+        """Stops claiming new jobs; running jobs are finished."""
+        if not self._stopping.is_set():
+            logging.info(f"Worker {self.worker_id}: stopping after the running jobs finish.")
+        self._stopping.set()
+
+    def _fetch_project(self, project):
+        """
+        Edit jobs need the current project tree. On a remote broker the local copy is compared with the
+        project's latest archived job (recorded in WORKER_SNAPSHOT_MARKER when this host restored or
+        uploaded it) and replaced by that archive when it is missing or stale, so that an edit never
+        starts from, and uploads over, an older version of the project.
+        """
+        if not self.broker.remote:
+            return
+        project_dir = os.path.join(PROJECTS_DIR, project)
+        latest_job = self.broker.latest_archive_job(project)
+        if latest_job is None:
+            if not os.path.isdir(project_dir):
+                logging.warning(f"Worker {self.worker_id}: no archive of project {project} in the broker.")
+            return
+        if os.path.isdir(project_dir) and _read_marker(project_dir) == latest_job:
+            return
+        archive = self.broker.get_archive(latest_job)
+        if archive is None:
+            logging.warning(f"Worker {self.worker_id}: archive of job {latest_job} ({project}) expired in the broker.")
+            return
+        files = _restore_project(archive, project)
+        _write_marker(project_dir, latest_job)
+        logging.info(f"Worker {self.worker_id}: restored project {project} from the archive of job {latest_job} ({files} files).")
+
+    def _archive(self, project):
+        if not self.broker.remote:
+            return None
+        from artifact_store import ArtifactStore
+
+        store = ArtifactStore()
+        try:
+            data = b"".join(store.export_stream(project))
+        except (ValueError, RuntimeError, OSError) as e:
+            logging.warning(f"Worker {self.worker_id}: no archive of project {project}: {e}")
+            return None
+        finally:
+            store.close()
+        if len(data) > WORKER_ARCHIVE_MAX_BYTES:
+            logging.warning(f"Worker {self.worker_id}: archive of {project} ({len(data)} bytes) exceeds WORKER_ARCHIVE_MAX_BYTES, not uploaded.")
+            return None
+        return data
+
+    def run_job(self, claimed):
+        """Runs one claimed job to completion and reports the outcome. Returns the final broker status."""
+        job_id, job = claimed["id"], claimed["job"]
+        logging.info(f"Worker {self.worker_id}: job {job_id} ({job.get('mode')} {job['project']}), attempt {claimed['attempts']}.")
+        self.job_store.create_job(job["project"], job.get("mode", "generate"), job.get("params") or {}, job_id=job_id)
+        if job.get("mode") == "edit":
+            self._fetch_project(job["project"])
+
+        process = subprocess.Popen(build_command(job, job_id), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        output = {}
+        reader = threading.Thread(target=lambda: output.update(zip(("stdout", "stderr"), process.communicate())), daemon=True)
+        reader.start()
+        lease_lost = False
+        next_heartbeat = time.monotonic() + WORKER_HEARTBEAT_SECONDS
+        terminated_at = None
+        while reader.is_alive():
+            reader.join(WORKER_CANCEL_POLL_SECONDS)
+            if not reader.is_alive():
+                break
+            if terminated_at is not None:
+                if time.monotonic() - terminated_at > get_settings().cancel_grace_seconds + 1:
+                    process.kill()
+                continue
+            try:
+                if self.broker.cancel_requested(job_id):
+                    # SIGTERM: przebieg kończy się sam (status cancelled, zabite procesy potomne) w ciągu CANCEL_GRACE_SECONDS (Settings.cancel_grace_seconds)
+                    logging.warning(f"Worker {self.worker_id}: job {job_id} cancelled, stopping the run.")
+                    lease_lost = True
+                elif time.monotonic() >= next_heartbeat:
+                    next_heartbeat = time.monotonic() + WORKER_HEARTBEAT_SECONDS
+                    if not self.broker.heartbeat(job_id, self.worker_id, job_progress(self.job_store.get_job(job_id))):
+                        # Dzierżawa wygasła i zadanie przejął inny worker: przerywamy duplikat
+                        logging.error(f"Worker {self.worker_id}: lease of job {job_id} lost, terminating the run.")
+                        lease_lost = True
+            except BrokerError as e:
+                logging.warning(f"Worker {self.worker_id}: broker call for job {job_id} failed: {e}")
+            if lease_lost:
+                process.terminate()
+                terminated_at = time.monotonic()
+        if lease_lost:
+            record = self.job_store.get_job(job_id)
+            if record and record["status"] in ("queued", "running"):
+                self.job_store.finish_job(job_id, "cancelled", error="stopped by the worker")
+            return None
+
+        record = self.job_store.get_job(job_id)
+        status = record["status"] if record else None
+        if process.returncode == 0 and status in ("succeeded", "merged"):
+            archive = self._archive(job["project"])
+            reported = self.broker.complete(
+                job_id, self.worker_id, "succeeded", result=record["result"], manifest=record["artifacts"],
+                progress=job_progress(record), archive=archive
+            )
+            if reported and archive is not None:
+                # Lokalna kopia odpowiada teraz najnowszemu archiwum projektu w brokerze
+                _write_marker(os.path.join(PROJECTS_DIR, job["project"]), job_id)
+            final = "succeeded"
+        else:
+            error = (record or {}).get("error") or (output.get("stderr") or "")[-2000:] or f"exit code {process.returncode}"
+            if status in ("queued", "running"):
+                self.job_store.finish_job(job_id, "failed", error=error)
+            if process.returncode in (INVALID_ARGS_EXIT_CODE, CANCELLED_EXIT_CODE):
+                # Błędne argumenty lub przekroczony limit czasu: ponowienie nie pomoże
+                final = "cancelled" if process.returncode == CANCELLED_EXIT_CODE else "failed"
+                reported = self.broker.complete(job_id, self.worker_id, final, error=error, progress=job_progress(record))
+            else:
+                final = self.broker.fail(job_id, self.worker_id, error)
+                reported = final is not None
+        if not reported:
+            logging.warning(f"Worker {self.worker_id}: result of job {job_id} not accepted (lease lost).")
+        logging.info(f"Worker {self.worker_id}: job {job_id} finished, broker status {final}.")
+        return final
+
+    def _slot(self, max_jobs):
+        while not self._stopping.is_set():
+            if max_jobs is not None and self.completed >= max_jobs:
+                return
+            try:
+                claimed = self.broker.claim(self.worker_id)
+            except BrokerError as e:
+                logging.error(f"Worker {self.worker_id}: broker unavailable: {e}")
+                claimed = None
+            if claimed is None:
+                # Losowe przesunięcie, aby workery nie odpytywały brokera jednocześnie
+                self._stopping.wait(WORKER_POLL_SECONDS * random.uniform(0.5, 1.5))
+                continue
+            try:
+                self.run_job(claimed)
+            except Exception as e:
+                logging.error(f"Worker {self.worker_id}: job {claimed['id']} crashed the worker slot: {e}")
+                try:
+                    self.broker.fail(claimed["id"], self.worker_id, str(e))
+                except BrokerError:
+                    pass
+            finally:
+                with self._lock:
+                    self.completed += 1
+
+    def run(self, max_jobs=None):
+        """Runs `slots` job loops until stop() (SIGTERM/SIGINT) or until max_jobs jobs have finished."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+        logging.info(f"Worker {self.worker_id} started with {self.slots} slots.")
+        threads = [threading.Thread(target=self._slot, args=(max_jobs,), name=f"worker-slot-{i}") for i in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+        logging.info(f"Worker {self.worker_id} stopped after {self.completed} jobs.")
+        return self.completed
+
+
+def sync_job_store(broker, job_store, since=0.0, on_finished=None):
+    """
+    Copies job status, stage timings, results and artifact manifests reported by workers from the
+    broker into the central job store (the panel's history); on_finished(job_id) is called for every
+    job seen in a final status (the panel frees its scheduler slot). Returns the new `since` cursor.
+    """
+    for job in broker.updates(since):
+        since = max(since, job["updated_at"] or since)
+        spec = job["job"]
+        job_store.create_job(job["project"], spec.get("mode", "generate"), spec.get("params") or {}, job_id=job["id"])
+        progress = job["progress"] or {}
+        for stage in progress.get("stages") or []:
+            job_store.record_stage(job["id"], stage["stage"], stage["started_at"], stage.get("seconds"), stage.get("tokens") or 0)
+        if job["status"] == "leased":
+            job_store.start_job(job["id"])
+        elif job["status"] in FINAL_STATUSES:
+            current = job_store.get_job(job["id"])
+            if current and current["status"] not in ("succeeded", "failed", "merged"):
+                if job["manifest"]:
+                    job_store.set_artifacts(job["id"], job["manifest"])
+                job_store.finish_job(job["id"], job["status"], job["result"], job["error"])
+            if on_finished is not None:
+                on_finished(job["id"])
+    return since
+
+
+def start_status_sync(broker, job_store, interval=WORKER_POLL_SECONDS, on_finished=None):
+    """Runs sync_job_store() in a daemon thread (used by the panel)."""
+    def run():
+        since = 0.0
+        while True:
+            try:
+                since = sync_job_store(broker, job_store, since, on_finished)
+            except Exception as e:
+                logging.error(f"Broker status sync error: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="broker-status-sync", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_worker(broker_url=None, slots=1, max_jobs=None):
+    """Entry point of generate_project.py --worker. Returns the process exit code."""
+    broker = get_broker(broker_url)
+    try:
+        Worker(broker, slots=slots).run(max_jobs=max_jobs)
+    finally:
+        broker.close()
+    return 0
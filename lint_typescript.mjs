@@ -0,0 +1,28 @@
+import fs from "node:fs";
+import ts from "typescript";
+
+// Kontrola składni plików .ts/.tsx wygenerowanych projektów (local_lint.py) kompilatorem TypeScript,
+// bez informacji o typach (projekt nie ma jeszcze zależności). Wynik w formacie `eslint --format json`.
+const results = process.argv.slice(2).map((filePath) => {
+  const source = fs.readFileSync(filePath, "utf8");
+  const output = ts.transpileModule(source, {
+    fileName: filePath,
+    reportDiagnostics: true,
+    compilerOptions: {jsx: ts.JsxEmit.Preserve, target: ts.ScriptTarget.Latest},
+  });
+  const messages = (output.diagnostics || []).map((diagnostic) => {
+    const position = diagnostic.file && diagnostic.start !== undefined
+      ? diagnostic.file.getLineAndCharacterOfPosition(diagnostic.start)
+      : {line: 0, character: 0};
+    return {
+      ruleId: `ts${diagnostic.code}`,
+      severity: diagnostic.category === ts.DiagnosticCategory.Error ? 2 : 1,
+      message: ts.flattenDiagnosticMessageText(diagnostic.messageText, "\n"),
+      line: position.line + 1,
+      column: position.character + 1,
+    };
+  });
+  return {filePath, messages};
+});
+
+process.stdout.write(JSON.stringify(results));
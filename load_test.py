@@ -0,0 +1,515 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import threading
+import tempfile
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Test obciążeniowy panelu (prompt_panel/app.py) i potoku zadań: generator ruchu HTTP ze stałą współbieżnością
+# (pętla zamknięta) lub z zadanym tempem napływu (pętla otwarta, rozkład Poissona), zwykle przeciw atrapie
+# generatora (FAKE_GENERATOR=1). Wyniki w JSON do porównywania wydań (--compare).
+LOAD_RESULTS_DIR = os.getenv("LOAD_RESULTS_DIR", "load_results")
+LOAD_HTTP_TIMEOUT = float(os.getenv("LOAD_HTTP_TIMEOUT", "120"))
+DEFAULT_MIX = "generate=1,jobs=2,job=1"
+SCENARIOS = ("generate", "edit", "jobs", "job")
+SAMPLE_INTERVAL = 0.5
+JOB_POLL_INTERVAL = 0.2
+FINAL_JOB_STATUSES = ("succeeded", "failed", "merged", "cancelled")
+PANEL_START_TIMEOUT = 20
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# Metryki porównywane przez --compare: (ścieżka w wyniku, czy wyższa wartość jest lepsza)
+COMPARED_METRICS = {
+    "throughput_rps": (("summary", "throughput_rps"), True),
+    "error_rate": (("summary", "error_rate"), False),
+    "p50_ms": (("summary", "latency", "p50_ms"), False),
+    "p95_ms": (("summary", "latency", "p95_ms"), False),
+    "p99_ms": (("summary", "latency", "p99_ms"), False),
+    "rejected": (("summary", "rejected"), False),
+    "peak_rss_bytes": (("resources", "peak_rss_bytes"), False),
+    "peak_processes": (("resources", "peak_processes"), False),
+}
+
+
+def parse_mix(mix):
+    """Parses "generate=1,jobs=2" into {scenario: weight}."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"BŁĄD: Nieznany scenariusz {name!r} (dostępne: {', '.join(SCENARIOS)}).")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("BŁĄD: Wszystkie wagi scenariuszy są zerowe.")
+    return weights
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0, "mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 2),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def process_tree(root_pid):
+    """PIDs of a process and all its descendants, from /proc (empty list without /proc)."""
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat_file:
+                # Nazwa procesu w nawiasach może zawierać spacje: pola liczymy od ostatniego ')'
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        if pid == root_pid and not os.path.exists(f"/proc/{pid}"):
+            return []
+        tree.append(pid)
+        pending.extend(children.get(pid, ()))
+    return tree
+
+
+def rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as statm_file:
+            return int(statm_file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class ResourceSampler:
+    """Samples the process count and total RSS of a process tree (the panel and its generator processes) over time."""
+
+    def __init__(self, pid, interval=SAMPLE_INTERVAL, progress=None):
+        self.pid = pid
+        self.interval = interval
+        self.progress = progress or (lambda: {})
+        self.samples = []
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        pids = process_tree(self.pid)
+        self.samples.append({
+            "t": round(time.monotonic() - self._started, 3),
+            "processes": len(pids),
+            "rss_bytes": sum(rss_bytes(pid) for pid in pids),
+            **self.progress(),
+        })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._started = time.monotonic()
+        self._sample()
+        self._thread = threading.Thread(target=self._run, name="load-resource-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._sample()
+        return {
+            "pid": self.pid,
+            "peak_rss_bytes": max(sample["rss_bytes"] for sample in self.samples),
+            "peak_processes": max(sample["processes"] for sample in self.samples),
+            "samples": self.samples,
+        }
+
+
+class LoadGenerator:
+    """
+    Drives the panel's HTTP endpoints. With rate > 0 requests arrive open-loop at `rate` per second
+    (exponential gaps) and at most `concurrency` are in flight; latency is measured from the scheduled
+    arrival, so time spent waiting for a free slot counts (no coordinated omission). With rate 0,
+    `concurrency` clients send requests back to back. Submissions are spread over `tenants` users
+    (X-API-Key header with load_api_key(); the panel must accept these keys in PANEL_API_KEYS); with wait_jobs a client follows each accepted job until it finishes, which gives
+    the end-to-end job latency including time in the panel's scheduler queue.
+    """
+
+    def __init__(self, base_url, concurrency=4, rate=0.0, duration=30.0, total_requests=None, mix=DEFAULT_MIX,
+                 timeout=LOAD_HTTP_TIMEOUT, tenants=1, wait_jobs=False):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = max(1, concurrency)
+        self.rate = rate
+        self.duration = duration
+        self.total_requests = total_requests
+        self.weights = parse_mix(mix)
+        self.timeout = timeout
+        self.tenants = max(1, tenants)
+        self.wait_jobs = wait_jobs
+        self.run_id = f"{int(time.time())}-{os.getpid()}"
+        self.results = []
+        self.in_flight = 0
+        self._issued = 0
+        self._job_ids = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    def progress(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "completed": len(self.results)}
+
+    def _next_request(self):
+        """Returns the next request number, or None when the request budget or the duration is used up."""
+        with self._lock:
+            if self.total_requests is not None and self._issued >= self.total_requests:
+                return None
+            if self.total_requests is None and time.monotonic() - self._started >= self.duration:
+                return None
+            self._issued += 1
+            return self._issued
+
+    def _http(self, method, path, form=None, headers=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def _wait_for_job(self, body, submitted_at):
+        """Polls an accepted job until it finishes. Returns (final status, seconds since submission) or (None, None)."""
+        try:
+            job_id = json.loads(body)["id"]
+        except (ValueError, KeyError, TypeError):
+            return None, None # Panel bez harmonogramu odpowiada dopiero po zakończeniu zadania
+        deadline = submitted_at + self.timeout
+        while time.monotonic() < deadline:
+            status, job_body = self._http("GET", f"/api/jobs/{urllib.parse.quote(job_id)}")
+            if status == 200 and json.loads(job_body)["status"] in FINAL_JOB_STATUSES:
+                return json.loads(job_body)["status"], time.monotonic() - submitted_at
+            time.sleep(JOB_POLL_INTERVAL)
+        return "timeout", None
+
+    def _submit(self, number, form):
+        submitted_at = time.monotonic()
+        status, body = self._http("POST", "/run_script", form, {"X-API-Key": load_api_key(number % self.tenants)})
+        ok = status < 400 and not body.startswith(b"Error")
+        if not (ok and self.wait_jobs):
+            return status, ok, None
+        job_status, job_latency = self._wait_for_job(body, submitted_at)
+        return status, job_status in (None, "succeeded", "merged"), job_latency
+
+    def _send(self, scenario, number):
+        """Sends one request of a scenario. Returns (HTTP status, ok, end-to-end job latency or None)."""
+        project = f"load-{self.run_id}-{number}"
+        if scenario == "generate":
+            return self._submit(number, {"project": project, "framework": "Next.js", "features": "load test"})
+        if scenario == "edit":
+            return self._submit(number, {"project": project, "edit": "1", "changes": "load test change"})
+        with self._lock:
+            job_id = random.choice(self._job_ids) if self._job_ids else None
+        if scenario == "job" and job_id:
+            status, _ = self._http("GET", f"/api/jobs/{urllib.parse.quote(job_id)}")
+            return status, status < 400, None
+        status, body = self._http("GET", "/api/jobs?limit=20")
+        if status == 200:
+            ids = [job["id"] for job in json.loads(body).get("jobs", [])]
+            if ids:
+                with self._lock:
+                    self._job_ids = ids
+        return status, status < 400, None
+
+    def _run_one(self, number, scheduled_at):
+        scenario = random.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        with self._lock:
+            self.in_flight += 1
+        error = job_latency = None
+        try:
+            status, ok, job_latency = self._send(scenario, number)
+        except (OSError, ValueError) as e:
+            status, ok, error = None, False, f"{type(e).__name__}: {e}"
+        finished = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            self.results.append({
+                "scenario": scenario,
+                "status": status,
+                "ok": ok,
+                "error": error,
+                "latency": finished - scheduled_at,
+                "job_latency": job_latency,
+                "finished_at": finished - self._started,
+            })
+
+    def _closed_loop(self):
+        def client():
+            while True:
+                number = self._next_request()
+                if number is None:
+                    return
+                self._run_one(number, time.monotonic())
+
+        threads = [threading.Thread(target=client, name=f"load-client-{i}") for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _open_loop(self):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load-client") as executor:
+            next_at = time.monotonic()
+            while True:
+                next_at += random.expovariate(self.rate)
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                number = self._next_request()
+                if number is None:
+                    break
+                executor.submit(self._run_one, number, next_at)
+
+    def run(self):
+        """Runs the load and returns the elapsed wall time in seconds."""
+        self._started = time.monotonic()
+        if self.rate > 0:
+            self._open_loop()
+        else:
+            self._closed_loop()
+        return time.monotonic() - self._started
+
+    def summary(self, elapsed):
+        results = self.results
+        errors = [r for r in results if not r["ok"]]
+        status_codes = {}
+        for r in results:
+            key = str(r["status"]) if r["status"] is not None else "connection_error"
+            status_codes[key] = status_codes.get(key, 0) + 1
+        by_scenario = {}
+        for scenario in self.weights:
+            scenario_results = [r for r in results if r["scenario"] == scenario]
+            if scenario_results:
+                by_scenario[scenario] = {
+                    "requests": len(scenario_results),
+                    "errors": sum(1 for r in scenario_results if not r["ok"]),
+                    "latency": latency_summary([r["latency"] for r in scenario_results if r["ok"]]),
+                }
+                job_latencies = [r["job_latency"] for r in scenario_results if r["ok"] and r["job_latency"] is not None]
+                if job_latencies:
+                    by_scenario[scenario]["job_latency"] = latency_summary(job_latencies)
+        throughput = {}
+        for r in results:
+            second = int(r["finished_at"])
+            throughput[second] = throughput.get(second, 0) + 1
+        return {
+            "summary": {
+                "requests": len(results),
+                "ok": len(results) - len(errors),
+                "errors": len(errors),
+                "rejected": status_codes.get("429", 0),
+                "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+                "elapsed_seconds": round(elapsed, 3),
+                "throughput_rps": round((len(results) - len(errors)) / elapsed, 3) if elapsed else 0.0,
+                "latency": latency_summary([r["latency"] for r in results if r["ok"]]),
+            },
+            "by_scenario": by_scenario,
+            "status_codes": status_codes,
+            "throughput_per_second": [{"t": second, "completed": throughput[second]} for second in sorted(throughput)],
+            "sample_errors": sorted({r["error"] for r in errors if r["error"]})[:10],
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def load_api_key(tenant):
+    return f"load-test-key-{tenant}"
+
+
+def start_panel(port, state_dir, fake=True, tenants=1):
+    """
+    Starts prompt_panel/app.py for the test (fake generator by default, job store etc. in `state_dir`
+    so test jobs do not end up in the real history) and waits until it answers.
+    The API keys of the `tenants` simulated users are added to PANEL_API_KEYS.
+    Returns:
+        subprocess.Popen
+    """
+    api_keys = [key for key in os.getenv("PANEL_API_KEYS", "").split(",") if key] + [load_api_key(t) for t in range(tenants)]
+    env = dict(os.environ, PANEL_PORT=str(port), FACTORY_CACHE_DIR=state_dir, PANEL_API_KEYS=",".join(api_keys))
+    if fake:
+        env["FAKE_GENERATOR"] = "1"
+    # Log panelu do pliku: nieodczytywany potok zablokowałby panel po zapełnieniu bufora
+    log_path = os.path.join(state_dir, "panel.log")
+    os.makedirs(state_dir, exist_ok=True)
+    with open(log_path, "wb") as log_file:
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "prompt_panel", "app.py")], cwd=ROOT, env=env,
+            stdout=log_file, stderr=subprocess.STDOUT
+        )
+    deadline = time.monotonic() + PANEL_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as log_file:
+                raise RuntimeError(f"BŁĄD: Panel zakończył się przy starcie: {log_file.read()[-1000:]}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"BŁĄD: Panel nie odpowiada na porcie {port} po {PANEL_START_TIMEOUT}s.")
+
+
+def compare(result, baseline):
+    """Per-metric change against a baseline result: {metric: {"baseline", "current", "change_pct", "better"}}."""
+    def lookup(data, path):
+        for key in path:
+            data = (data or {}).get(key)
+        return data
+
+    comparison = {}
+    for metric, (path, higher_is_better) in COMPARED_METRICS.items():
+        current, previous = lookup(result, path), lookup(baseline, path)
+        if current is None or previous is None:
+            continue
+        change = round((current - previous) / previous * 100, 1) if previous else None
+        comparison[metric] = {
+            "baseline": previous,
+            "current": current,
+            "change_pct": change,
+            "better": (current > previous) == higher_is_better if current != previous else None,
+        }
+    return comparison
+
+
+def run_load_test(args):
+    panel = None
+    pid = args.pid
+    state_dir = None
+    if args.start_panel:
+        state_dir = args.state_dir or tempfile.mkdtemp(prefix="factory-load-")
+        panel = start_panel(args.port, os.path.abspath(state_dir), fake=not args.real_backend, tenants=args.tenants)
+        pid = panel.pid
+        url = f"http://127.0.0.1:{args.port}"
+    else:
+        url = args.url
+    generator = LoadGenerator(url, args.concurrency, args.rate, args.duration, args.requests, args.mix, tenants=args.tenants, wait_jobs=args.wait_jobs)
+    sampler = ResourceSampler(pid, args.sample_interval, generator.progress) if pid else None
+    if sampler is None:
+        logging.warning("Brak --pid ani --start-panel: zużycie pamięci i liczba procesów nie będą mierzone.")
+    started_at = time.time()
+    try:
+        if sampler:
+            sampler.start()
+        logging.info(f"Load test against {url}: concurrency {args.concurrency}, rate {args.rate or 'closed loop'}, mix {args.mix}")
+        elapsed = generator.run()
+        resources = sampler.stop() if sampler else None
+    finally:
+        if panel is not None:
+            panel.terminate()
+            try:
+                panel.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                panel.kill()
+        if state_dir and not args.state_dir:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    result = {
+        "label": args.label,
+        "started_at": started_at,
+        "target": url,
+        "config": {
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "requests": args.requests,
+            "mix": generator.weights,
+            "tenants": args.tenants,
+            "wait_jobs": args.wait_jobs,
+            "backend": "real" if args.real_backend else "fake",
+        },
+        "environment": {"git_revision": git_revision(), "python": sys.version.split()[0], "cpu_count": os.cpu_count(), "host": socket.gethostname()},
+        **generator.summary(elapsed),
+        "resources": resources,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            result["comparison"] = compare(result, json.load(baseline_file))
+    output = args.output or os.path.join(LOAD_RESULTS_DIR, f"{args.label or 'load'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(result, output_file, indent=2)
+    return result, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the prompt panel and the job pipeline")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Panel URL (ignored with --start-panel)")
+    parser.add_argument("--start-panel", action="store_true", help="Start prompt_panel/app.py for the test (with the fake generator unless --real-backend)")
+    parser.add_argument("--port", type=int, default=5055, help="Port of the panel started with --start-panel")
+    parser.add_argument("--state-dir", help="FACTORY_CACHE_DIR of the started panel (default: a temporary directory, removed afterwards)")
+    parser.add_argument("--real-backend", action="store_true", help="Run the real generate_project.py instead of the fake generator")
+    parser.add_argument("--pid", type=int, help="PID of an already running panel, for RSS and process count sampling")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight")
+    parser.add_argument("--rate", type=float, default=0.0, help="Arrival rate in requests/s (open loop); 0 = closed loop")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds (unless --requests)")
+    parser.add_argument("--requests", type=int, help="Total number of requests instead of a duration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights, e.g. {DEFAULT_MIX} (scenarios: {', '.join(SCENARIOS)})")
+    parser.add_argument("--tenants", type=int, default=1, help="Number of simulated users (API keys, see load_api_key()) the submissions are spread over")
+    parser.add_argument("--wait-jobs", action="store_true", help="Follow each accepted job to completion and report end-to-end job latency")
+    parser.add_argument("--sample-interval", type=float, default=SAMPLE_INTERVAL, help="Resource sampling interval in seconds")
+    parser.add_argument("--label", help="Label of the run (e.g. a release), stored in the result and its file name")
+    parser.add_argument("--output", help=f"Result JSON path (default: {LOAD_RESULTS_DIR}/<label>-<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Earlier result JSON to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    result, output = run_load_test(args)
+    summary = result["summary"]
+    print(json.dumps({"summary": summary, "resources": {k: v for k, v in (result["resources"] or {}).items() if k != "samples"},
+                      "comparison": result.get("comparison")}, indent=2))
+    logging.info(f"Wynik zapisany w {output}")
+    return 0 if summary["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import FACTORY_CACHE_DIR
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+ESLINT_JS = os.path.join(REPO_ROOT, "node_modules", "eslint", "bin", "eslint.js")
+# Konfiguracja dla wygenerowanych projektów (JSX, zmienne globalne Node), nie eslint.config.js repozytorium
+ESLINT_CONFIG = os.path.join(REPO_ROOT, "eslint.project.config.js")
+TYPESCRIPT_JS = os.path.join(REPO_ROOT, "node_modules", "typescript", "lib", "typescript.js")
+TS_CHECK_SCRIPT = os.path.join(REPO_ROOT, "lint_typescript.mjs")
+LINT_CACHE_DIR = os.getenv("LINT_CACHE_DIR", os.path.join(FACTORY_CACHE_DIR, "lint"))
+LINT_TIMEOUT = 60
+
+# Pliki źródłowe, które powinny zostać sprawdzone (lokalnie lub przez agenta QA)
+SOURCE_EXTENSIONS = {".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".py", ".html", ".css"}
+# Pliki bez lokalnego lintera, które same nie wymagają przeglądu przez agenta QA
+ASSET_EXTENSIONS = {".html", ".css"}
+SKIP_DIRS = {"node_modules", ".git", ".next", "__pycache__", ".venv", "venv", "dist", "build", ".scannerwork", ".factory"}
+# ESLint zgłasza pominięte pliki (ignorowane lub poza katalogiem bazowym) jako ostrzeżenie, a nie wynik analizy
+ESLINT_IGNORED_PREFIX = "File ignored"
+
+
+def _file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _eslint_command(file_path):
+    return ["node", ESLINT_JS, "--config", ESLINT_CONFIG, "--format", "json", file_path]
+
+
+def _ts_check_command(file_path):
+    return ["node", TS_CHECK_SCRIPT, file_path]
+
+
+def _parse_eslint(stdout, file_path):
+    findings = []
+    for result in json.loads(stdout or "[]"):
+        for message in result.get("messages", []):
+            if message.get("ruleId") is None and message.get("message", "").startswith(ESLINT_IGNORED_PREFIX):
+                # Plik nie został sprawdzony: to nie jest "czysty" wynik, więc nie trafia do cache
+                raise RuntimeError(message["message"])
+            findings.append({
+                "file": file_path,
+                "line": message.get("line"),
+                "rule": message.get("ruleId") or "eslint",
+                "message": message.get("message", ""),
+                "severity": "error" if message.get("severity") == 2 else "warning",
+            })
+    return findings
+
+
+def _ruff_command(file_path):
+    return [shutil.which("ruff"), "check", "--output-format", "json", "--no-cache", file_path]
+
+
+def _parse_ruff(stdout, file_path):
+    return [{
+        "file": file_path,
+        "line": (item.get("location") or {}).get("row"),
+        "rule": item.get("code") or "ruff",
+        "message": item.get("message", ""),
+        "severity": "error",
+    } for item in json.loads(stdout or "[]")]
+
+
+def _pyflakes_command(file_path):
+    return [sys.executable, "-m", "pyflakes", file_path]
+
+
+# Kompilacja w pamięci zamiast `python -m py_compile`, który zapisuje __pycache__/*.pyc w projekcie
+# (trafiałyby do migawek git, magazynu artefaktów i eksportów)
+PY_SYNTAX_CHECK = """
+import sys
+path = sys.argv[1]
+try:
+    with open(path, "rb") as f:
+        compile(f.read(), path, "exec", dont_inherit=True)
+except (SyntaxError, ValueError) as e:
+    print(f"{path}:{getattr(e, 'lineno', None) or 0}:{getattr(e, 'offset', None) or 0}: {getattr(e, 'msg', None) or e}")
+"""
+
+
+def _py_compile_command(file_path):
+    return [sys.executable, "-c", PY_SYNTAX_CHECK, file_path]
+
+
+def _parse_text(stdout, file_path):
+    # Format "<plik>:<linia>:<kolumna>: <wiadomość>" (pyflakes i kompilacja w pamięci)
+    findings = []
+    for line in stdout.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        parts = line.split(":", 3)
+        line_no = int(parts[1]) if len(parts) > 2 and parts[1].isdigit() else None
+        findings.append({
+            "file": file_path,
+            "line": line_no,
+            "rule": "python",
+            "message": parts[-1].strip() if line_no else line,
+            "severity": "error",
+        })
+    return findings
+
+
+def _module_available(module_name):
+    import importlib.util
+    return importlib.util.find_spec(module_name) is not None
+
+
+def available_linters():
+    """
+    Returns the linters usable in this environment as {extension: (linter_id, command_fn, parse_fn)}.
+    Linter ids include a config fingerprint so that cached results are invalidated when the config changes.
+    """
+    linters = {}
+    if shutil.which("node") and os.path.exists(ESLINT_JS) and os.path.exists(ESLINT_CONFIG):
+        eslint_id = f"eslint:{_file_hash(ESLINT_CONFIG)[:12]}"
+        for ext in (".js", ".jsx", ".mjs", ".cjs"):
+            linters[ext] = (eslint_id, _eslint_command, _parse_eslint)
+    if shutil.which("node") and os.path.exists(TYPESCRIPT_JS) and os.path.exists(TS_CHECK_SCRIPT):
+        ts_id = f"tsc-syntax:{_file_hash(TS_CHECK_SCRIPT)[:12]}"
+        for ext in (".ts", ".tsx"):
+            linters[ext] = (ts_id, _ts_check_command, _parse_eslint)
+
+    if shutil.which("ruff"):
+        linters[".py"] = ("ruff", _ruff_command, _parse_ruff)
+    elif _module_available("pyflakes"):
+        linters[".py"] = ("pyflakes", _pyflakes_command, _parse_text)
+    else:
+        linters[".py"] = ("py-compile-memory", _py_compile_command, _parse_text)
+    return linters
+
+
+def _run_linter(args):
+    """Process pool worker: runs one linter on one file and returns its findings."""
+    command_fn, parse_fn, project_dir, rel_path = args
+    try:
+        # Katalog projektu jako cwd: ESLint traktuje go jako katalog bazowy i nie pomija plików spoza repozytorium
+        completed = subprocess.run(command_fn(rel_path), capture_output=True, text=True, cwd=project_dir, timeout=LINT_TIMEOUT)
+        output = completed.stdout or completed.stderr
+        return parse_fn(output, rel_path), None
+    except Exception as e:
+        return [], str(e)
+
+
+class LintCache:
+    """File-hash keyed cache of lint findings stored as small JSON files."""
+
+    def __init__(self, cache_dir=LINT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, findings):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(findings, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.debug(f"Could not write lint cache entry {path}: {e}")
+
+
+def iter_source_files(project_dir):
+    """Yields project-relative paths of source files, skipping dependency and build directories."""
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            if os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, name), project_dir).replace(os.sep, "/")
+
+
+def run_local_lint(project_dir, max_workers=None, cache=None):
+    """
+    Runs the locally available linters on every source file of the project.
+    Files are linted in a process pool; results are cached by file content hash.
+    Args:
+        project_dir (str): Project directory.
+        max_workers (int): Process pool size (defaults to the number of CPUs).
+        cache (LintCache): Cache instance (defaults to LINT_CACHE_DIR).
+    Returns:
+        dict: {
+            "findings": {file: [finding, ...]} for files with findings,
+            "flagged_files": files with findings,
+            "unlinted_files": source files no local linter covers (including assets, see ASSET_EXTENSIONS),
+            "linted_files": number of linted files,
+            "cache_hits": number of files served from cache,
+            "errors": {file: error message}
+        }
+    """
+    cache = cache or LintCache()
+    linters = available_linters()
+    report = {"findings": {}, "flagged_files": [], "unlinted_files": [], "linted_files": 0, "cache_hits": 0, "errors": {}}
+
+    jobs = []
+    for rel_path in iter_source_files(project_dir):
+        linter = linters.get(os.path.splitext(rel_path)[1].lower())
+        if not linter:
+            report["unlinted_files"].append(rel_path)
+            continue
+        linter_id, command_fn, parse_fn = linter
+        file_path = os.path.abspath(os.path.join(project_dir, rel_path))
+        key = hashlib.sha256(f"{linter_id}\0{_file_hash(file_path)}".encode()).hexdigest()
+        report["linted_files"] += 1
+
+        cached = cache.get(key)
+        if cached is not None:
+            report["cache_hits"] += 1
+            if cached:
+                # Ta sama treść może występować pod inną ścieżką
+                report["findings"][rel_path] = [dict(finding, file=rel_path) for finding in cached]
+            continue
+        jobs.append((key, rel_path, (command_fn, parse_fn, os.path.abspath(project_dir), rel_path)))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(_run_linter, [job[2] for job in jobs])
+            for (key, rel_path, _), (findings, error) in zip(jobs, results):
+                if error:
+                    # Nie cache'ujemy błędów uruchomienia lintera
+                    report["errors"][rel_path] = error
+                    continue
+                cache.put(key, findings)
+                if findings:
+                    report["findings"][rel_path] = findings
+
+    report["flagged_files"] = sorted(report["findings"])
+    logging.info(
+        f"Local lint: {report['linted_files']} files linted ({report['cache_hits']} from cache), "
+        f"{len(report['flagged_files'])} flagged, {len(report['unlinted_files'])} without a local linter."
+    )
+    return report
+
+
+def files_needing_review(report):
+    """
+    Returns the files the LLM QA stage still has to look at after the local scan.
+    Unlinted assets (CSS, HTML) alone do not require the QA pass.
+    """
+    unlinted_code = {path for path in report["unlinted_files"] if os.path.splitext(path)[1].lower() not in ASSET_EXTENSIONS}
+    return sorted(set(report["flagged_files"]) | unlinted_code | set(report["errors"]))
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import atexit
+import random
+import sqlite3
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import FACTORY_CACHE_DIR
+
+NOTIFY_OUTBOX_PATH = os.getenv("NOTIFY_OUTBOX_PATH", os.path.join(FACTORY_CACHE_DIR, "outbox.db"))
+NOTIFY_CONNECT_TIMEOUT = float(os.getenv("NOTIFY_CONNECT_TIMEOUT", "3"))
+NOTIFY_READ_TIMEOUT = float(os.getenv("NOTIFY_READ_TIMEOUT", "10"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_RETRY_BASE_SECONDS = float(os.getenv("NOTIFY_RETRY_BASE_SECONDS", "2"))
+NOTIFY_RETRY_MAX_SECONDS = float(os.getenv("NOTIFY_RETRY_MAX_SECONDS", "300"))
+# 1 = każde zdarzenie osobno (obiekt JSON); >1 = zaległe zdarzenia do tego samego URL wysyłane jako tablica JSON
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "1"))
+NOTIFY_FLUSH_TIMEOUT = float(os.getenv("NOTIFY_FLUSH_TIMEOUT", "10"))
+# Czas, na jaki proces rezerwuje zdarzenia do wysłania (inne procesy ich w tym czasie nie ruszają)
+CLAIM_LEASE_SECONDS = NOTIFY_CONNECT_TIMEOUT + NOTIFY_READ_TIMEOUT + 30
+
+
+class Notifier:
+    """
+    Durable webhook dispatcher.
+    Events are first stored in a local SQLite outbox and then delivered by a background thread
+    over a pooled HTTP session, with bounded timeouts and exponential retry. Undelivered events
+    survive the process and are picked up by the next one; several processes can share the outbox.
+    """
+
+    def __init__(self, path=NOTIFY_OUTBOX_PATH, batch_size=NOTIFY_BATCH_SIZE, max_attempts=NOTIFY_MAX_ATTEMPTS):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max_attempts
+        self.timeout = (NOTIFY_CONNECT_TIMEOUT, NOTIFY_READ_TIMEOUT)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._session = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                delivered_at REAL,
+                dead INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_events_due ON events (delivered_at, dead, next_attempt_at)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+
+    @property
+    def session(self):
+        if self._session is None:
+            session = requests.Session()
+            # Ponawianie obsługujemy sami (outbox), adapter służy tylko do puli połączeń
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def _add_stat(self, name, value):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, value)
+        )
+
+    def _max_stat(self, name, value):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = MAX(value, excluded.value)",
+            (name, value)
+        )
+
+    def enqueue(self, url, payload):
+        """Stores the event in the outbox and wakes the delivery thread. Returns the event id."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO events (url, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(payload, ensure_ascii=False), time.time(), 0)
+            )
+        self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim_batch(self):
+        """Reserves due events of one URL (at most batch_size). Returns (url, [(id, payload, created_at, attempts)])."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = self._conn.execute(
+                    "SELECT url FROM events WHERE delivered_at IS NULL AND dead = 0 AND next_attempt_at <= ? ORDER BY id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if first is None:
+                    self._conn.execute("COMMIT")
+                    return None, []
+                rows = self._conn.execute(
+                    "SELECT id, payload, created_at, attempts FROM events "
+                    "WHERE url = ? AND delivered_at IS NULL AND dead = 0 AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                    (first[0], now, self.batch_size)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE events SET next_attempt_at = ? WHERE id = ?",
+                    [(now + CLAIM_LEASE_SECONDS, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return first[0], rows
+
+    def _deliver(self, url, rows):
+        payloads = [json.loads(row[1]) for row in rows]
+        body = payloads[0] if len(payloads) == 1 else payloads
+        error = None
+        try:
+            response = self.session.post(url, json=body, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if error is None:
+                self._conn.executemany("UPDATE events SET delivered_at = ?, attempts = attempts + 1 WHERE id = ?", [(now, row[0]) for row in rows])
+                latencies = [now - row[2] for row in rows]
+                self._add_stat("delivered", len(rows))
+                self._add_stat("latency_total", sum(latencies))
+                self._max_stat("latency_max", max(latencies))
+                self._add_stat("requests", 1)
+            else:
+                for event_id, _, _, attempts in rows:
+                    attempts += 1
+                    delay = min(NOTIFY_RETRY_MAX_SECONDS, NOTIFY_RETRY_BASE_SECONDS * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                    dead = attempts >= self.max_attempts
+                    self._conn.execute(
+                        "UPDATE events SET attempts = ?, next_attempt_at = ?, last_error = ?, dead = ? WHERE id = ?",
+                        (attempts, now + delay, error[:500], int(dead), event_id)
+                    )
+                    if dead:
+                        self._add_stat("dead", 1)
+                self._add_stat("failed_attempts", len(rows))
+            self._conn.execute("COMMIT")
+
+        if error is None:
+            logging.info(f"Webhook delivered to {url} ({len(rows)} events).")
+        else:
+            logging.warning(f"Webhook delivery to {url} failed ({len(rows)} events), will retry: {error}")
+        return error is None
+
+    def deliver_due(self):
+        """Delivers all currently due events. Returns the number of delivered events."""
+        delivered = 0
+        while not self._stopping.is_set():
+            url, rows = self._claim_batch()
+            if not rows:
+                break
+            if self._deliver(url, rows):
+                delivered += len(rows)
+        return delivered
+
+    def _next_due_in(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM events WHERE delivered_at IS NULL AND dead = 0"
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.deliver_due()
+                wait = self._next_due_in()
+            except Exception as e:
+                logging.error(f"Webhook dispatcher error: {e}")
+                wait = NOTIFY_RETRY_BASE_SECONDS
+            self._wakeup.wait(timeout=60 if wait is None else min(wait, 60))
+            self._wakeup.clear()
+
+    def start(self):
+        """Starts the background delivery thread (idempotent)."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+            self._thread.start()
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events WHERE delivered_at IS NULL AND dead = 0").fetchone()[0]
+
+    def flush(self, timeout=NOTIFY_FLUSH_TIMEOUT):
+        """
+        Waits up to timeout seconds for events that are due now to be delivered, then stops the thread.
+        Events still pending (e.g., waiting for a retry) stay in the outbox for the next process.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            wait = self._next_due_in()
+            if wait is None or wait > 0:
+                break
+            self._wakeup.set()
+            time.sleep(0.05)
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        pending = self.pending()
+        if pending:
+            logging.info(f"{pending} webhook events left in the outbox for a later retry.")
+
+    def stats(self):
+        """Returns delivery counters and latencies (seconds from enqueue to successful delivery)."""
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+        pending = self.pending()
+        delivered = int(counters.get("delivered", 0))
+        return {
+            "pending": pending,
+            "delivered": delivered,
+            "requests": int(counters.get("requests", 0)),
+            "failed_attempts": int(counters.get("failed_attempts", 0)),
+            "dead": int(counters.get("dead", 0)),
+            "latency_avg": round(counters.get("latency_total", 0) / delivered, 3) if delivered else None,
+            "latency_max": round(counters.get("latency_max", 0), 3) if delivered else None,
+        }
+
+
+_notifier = None
+
+
+def get_notifier():
+    """Returns the process-wide notifier; pending events are flushed (bounded) at interpreter exit."""
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier()
+        atexit.register(_notifier.flush)
+    return _notifier
+
+
+def notify_n8n(payload):
+    """Queues a notification for N8N_WEBHOOK_URL. Returns False if the webhook is not configured."""
+    n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL")
+    if not n8n_webhook_url:
+        return False
+    get_notifier().enqueue(n8n_webhook_url, payload)
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or drain the webhook outbox.")
+    parser.add_argument("--drain", action="store_true", help="Deliver all due events now")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    notifier = Notifier()
+    if args.drain:
+        notifier.deliver_due()
+    print(json.dumps(notifier.stats()))
@@ -0,0 +1,286 @@
+import re
+import logging
+import difflib
+
+from project_files import parse_file_blocks, read_project_file
+from utils import AGENT_VERBOSE
+
+FILE_HEADER = re.compile(r"^---\s*([^\s-]\S*?)\s*---\s*$")
+# Każda linia "--- ... ---" (także opisowa, np. "--- Summary ---") zamyka bieżącą sekcję pliku
+SECTION_SEPARATOR = re.compile(r"^---\s*[^\s-].*?---\s*$")
+# Pliki bez rozszerzenia i katalogu, które mogą wystąpić w nagłówku; inne nagłówki muszą wyglądać jak ścieżka
+EXTENSIONLESS_FILES = {"Dockerfile", "Makefile", "Procfile", "LICENSE", "Gemfile", "Rakefile", "Containerfile"}
+SEARCH_MARKER = re.compile(r"^<{5,}\s*SEARCH\s*$")
+DIVIDER_MARKER = re.compile(r"^={5,}\s*$")
+REPLACE_MARKER = re.compile(r"^>{5,}\s*REPLACE\s*$")
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+FUZZY_THRESHOLD = 0.85
+# Dopasowanie rozmyte tylko dla SEARCH z co najmniej tylu linii i gdy najlepsze okno wyraźnie wygrywa z kolejnym
+FUZZY_MIN_LINES = 2
+FUZZY_MARGIN = 0.05
+
+# Instrukcja formatu dla agentów zwracających poprawki
+PATCH_FORMAT_INSTRUCTIONS = """
+Return changes as SEARCH/REPLACE blocks grouped under file headers:
+--- <file path relative to the project directory> ---
+<<<<<<< SEARCH
+<exact lines copied from the current file>
+=======
+<new lines>
+>>>>>>> REPLACE
+Use several blocks per file for several changes. Keep each SEARCH part short but unique (a few lines of context).
+For a NEW file, write its full content under the file header without any SEARCH/REPLACE markers.
+"""
+
+
+def _strip_fences(lines):
+    # Agenci często opakowują sekcje w ```; usuwamy ogrodzenia na brzegach
+    while lines and not lines[0].strip():
+        lines = lines[1:]
+    while lines and not lines[-1].strip():
+        lines = lines[:-1]
+    if lines and lines[0].strip().startswith("```") and lines[-1].strip() == "```":
+        lines = lines[1:-1]
+    return lines
+
+
+def _parse_search_replace(lines):
+    blocks = []
+    state, search, replace = None, [], []
+    for line in lines:
+        if SEARCH_MARKER.match(line):
+            state, search, replace = "search", [], []
+        elif state == "search" and DIVIDER_MARKER.match(line):
+            state = "replace"
+        elif state == "replace" and REPLACE_MARKER.match(line):
+            blocks.append(("\n".join(search), "\n".join(replace)))
+            state = None
+        elif state == "search":
+            search.append(line)
+        elif state == "replace":
+            replace.append(line)
+    return blocks
+
+
+def _parse_unified_hunks(lines):
+    """Turns unified diff hunks into (search, replace) pairs; line numbers are ignored on purpose."""
+    blocks = []
+    search, replace, in_hunk = [], [], False
+    for line in lines:
+        if HUNK_HEADER.match(line):
+            if in_hunk:
+                blocks.append(("\n".join(search), "\n".join(replace)))
+            search, replace, in_hunk = [], [], True
+        elif in_hunk:
+            if line.startswith("-"):
+                search.append(line[1:])
+            elif line.startswith("+"):
+                replace.append(line[1:])
+            elif line.startswith("\\"):
+                continue
+            else:
+                text = line[1:] if line.startswith(" ") else line
+                search.append(text)
+                replace.append(text)
+    if in_hunk:
+        blocks.append(("\n".join(search), "\n".join(replace)))
+    return blocks
+
+
+def _file_header(line):
+    """Returns the path of a "--- <file> ---" header, or None (also for prose separators like "--- Summary ---")."""
+    match = FILE_HEADER.match(line)
+    if not match:
+        return None
+    name = match.group(1).strip()
+    return name if "/" in name or "." in name or name in EXTENSIONLESS_FILES else None
+
+
+def parse_edit_blocks(result_str):
+    """
+    Parses agent output into per-file edits.
+    Each "--- <file> ---" section is either SEARCH/REPLACE blocks, unified diff hunks, or a full file;
+    a "--- ... ---" line that is not a path (e.g. "--- Summary ---") ends the current section.
+    Returns:
+        dict: {file: {"patches": [(search, replace), ...]}} or {file: {"content": full_content}}.
+    """
+    sections = {}
+    current = None
+    for line in result_str.splitlines():
+        header = _file_header(line)
+        if header:
+            current = header
+            sections.setdefault(current, [])
+        elif SECTION_SEPARATOR.match(line):
+            # Separator prozy po plikach: jego treść nie należy do poprzedniego pliku
+            current = None
+        elif current is not None:
+            sections[current].append(line)
+
+    edits = {}
+    for file_name, lines in sections.items():
+        lines = _strip_fences(lines)
+        if any(SEARCH_MARKER.match(line) for line in lines):
+            edits[file_name] = {"patches": _parse_search_replace(lines)}
+        elif any(HUNK_HEADER.match(line) for line in lines):
+            edits[file_name] = {"patches": _parse_unified_hunks(lines)}
+        else:
+            edits[file_name] = {"content": "\n".join(lines).strip()}
+    if not edits:
+        # Starszy format z nagłówkiem i treścią w tej samej linii
+        edits = {file_name: {"content": content} for file_name, content in parse_file_blocks(result_str).items()}
+    return edits
+
+
+def _reindent(replace_lines, file_indent, search_indent):
+    """Shifts replacement lines by the indentation difference between the file and the SEARCH text."""
+    if file_indent == search_indent:
+        return replace_lines
+    result = []
+    for line in replace_lines:
+        if line.startswith(search_indent):
+            result.append(file_indent + line[len(search_indent):])
+        else:
+            result.append(line)
+    return result
+
+
+def _leading_ws(line):
+    return line[:len(line) - len(line.lstrip())]
+
+
+def apply_patch(content, search, replace):
+    """
+    Applies one SEARCH/REPLACE edit.
+    Tries an exact match, then a whitespace-insensitive line match, then a fuzzy line-window match.
+    The fuzzy match is only used for multi-line SEARCH text whose best window is unambiguous (the best
+    non-overlapping alternative scores at least FUZZY_MARGIN lower); a near-miss on a short or repeated
+    snippet would otherwise patch the wrong line.
+    Returns:
+        str: New content, or None if the SEARCH text could not be located.
+    """
+    if not search.strip():
+        # Pusty SEARCH: dopisanie na końcu pliku
+        return content.rstrip("\n") + "\n" + replace + "\n" if content.strip() else replace + "\n"
+
+    if search in content:
+        return content.replace(search, replace, 1)
+
+    file_lines = content.split("\n")
+    search_lines = search.strip("\n").split("\n")
+    replace_lines = replace.strip("\n").split("\n") if replace.strip("\n") else []
+    n = len(search_lines)
+    stripped_search = [line.strip() for line in search_lines]
+
+    # Dopasowanie ignorujące białe znaki
+    for i in range(len(file_lines) - n + 1):
+        if [line.strip() for line in file_lines[i:i + n]] == stripped_search:
+            new_lines = _reindent(replace_lines, _leading_ws(file_lines[i]), _leading_ws(search_lines[0]))
+            return "\n".join(file_lines[:i] + new_lines + file_lines[i + n:])
+
+    # Dopasowanie rozmyte: najbardziej podobne okno o tej samej liczbie linii
+    if n < FUZZY_MIN_LINES:
+        return None
+    floor = FUZZY_THRESHOLD - FUZZY_MARGIN
+    candidates = []
+    joined_search = "\n".join(stripped_search)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(joined_search)
+    for i in range(len(file_lines) - n + 1):
+        matcher.set_seq1("\n".join(line.strip() for line in file_lines[i:i + n]))
+        if matcher.real_quick_ratio() < floor or matcher.quick_ratio() < floor:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= floor:
+            candidates.append((ratio, i))
+    if not candidates:
+        return None
+    best_ratio, best_index = max(candidates)
+    # Okna nachodzące na najlepsze dzielą z nim linie, więc konkurencją są tylko okna rozłączne
+    runner_up = max((ratio for ratio, i in candidates if abs(i - best_index) >= n), default=0.0)
+    if best_ratio < FUZZY_THRESHOLD or best_ratio - runner_up < FUZZY_MARGIN:
+        logging.debug(f"Fuzzy patch match rejected: best {best_ratio:.2f} at line {best_index + 1}, runner-up {runner_up:.2f}.")
+        return None
+    logging.debug(f"Fuzzy patch match at line {best_index + 1} (ratio {best_ratio:.2f}, runner-up {runner_up:.2f}).")
+    new_lines = _reindent(replace_lines, _leading_ws(file_lines[best_index]), _leading_ws(search_lines[0]))
+    return "\n".join(file_lines[:best_index] + new_lines + file_lines[best_index + n:])
+
+
+def apply_edits(project_dir, edits):
+    """
+    Applies parsed edits to the project's current files.
+    Args:
+        project_dir (str): Project directory.
+        edits (dict): Result of parse_edit_blocks().
+    Returns:
+        tuple: (files_to_write {file: new content}, failed {file: reason}). A file with any failed
+               hunk is reported as failed and left out of files_to_write.
+    """
+    files_to_write, failed = {}, {}
+    for file_name, edit in edits.items():
+        if "content" in edit:
+            if edit["content"]:
+                files_to_write[file_name] = edit["content"]
+            continue
+
+        content = read_project_file(project_dir, file_name)
+        if content is None:
+            failed[file_name] = "file does not exist"
+            continue
+        for index, (search, replace) in enumerate(edit["patches"], start=1):
+            patched = apply_patch(content, search, replace)
+            if patched is None:
+                failed[file_name] = f"hunk {index} did not match the current file"
+                break
+            content = patched
+        else:
+            files_to_write[file_name] = content
+    if failed:
+        logging.warning(f"Patches failed for {len(failed)} files: {failed}")
+    return files_to_write, failed
+
+
+def _describe_patches(patches):
+    return "\n".join(f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE" for search, replace in patches)
+
+
+def request_full_files(agent, project_dir, failed, instructions, edits=None, token=None):
+    """
+    Fallback for files whose patches did not apply: asks the agent for the full content of only those files.
+    Args:
+        agent: CrewAI agent that produced the patches.
+        project_dir (str): Project directory.
+        failed (dict): {file: reason} from apply_edits().
+        instructions (str): Description of the change the patches were meant to implement.
+        edits (dict): Parsed edits; the intended patches of the failed files are shown to the agent.
+        token (CancelToken): Checked before the LLM call.
+    Returns:
+        dict: {file: full content} for the failed files the agent returned.
+    """
+    from crewai import Crew, Process, Task
+
+    file_sections = []
+    for file_name, reason in failed.items():
+        section = f"[{file_name} - {reason}]\n{read_project_file(project_dir, file_name) or '(file does not exist)'}"
+        patches = (edits or {}).get(file_name, {}).get("patches")
+        if patches:
+            section += f"\nIntended patches:\n{_describe_patches(patches)}"
+        file_sections.append(section)
+    file_sections = "\n\n".join(file_sections)
+    rewrite_task = Task(
+        description=(
+            f"Your previous patches could not be applied to these files:\n{file_sections}\n\n"
+            f"Apply the intended change to them: {instructions}\n"
+            "Return the FULL new content of each of these files (and only these files) in the format:\n"
+            "--- <filename> ---\n<content>"
+        ),
+        agent=agent,
+        expected_output="Full content of the listed files in --- <filename> --- format"
+    )
+    rewrite_crew = Crew(agents=[agent], tasks=[rewrite_task], process=Process.sequential, verbose=AGENT_VERBOSE, max_rpm=10)
+    if token is not None:
+        token.raise_if_cancelled()
+    rewrite_result = rewrite_crew.kickoff()
+    logging.debug(f"Full-file fallback result: {rewrite_result}")
+    rewritten = parse_file_blocks(str(rewrite_result))
+    return {file_name: content for file_name, content in rewritten.items() if file_name in failed}
@@ -0,0 +1,183 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+
+from utils import FACTORY_CACHE_DIR
+
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", os.path.join(FACTORY_CACHE_DIR, "plan_cache.db"))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "500"))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+PLAN_CACHE_MIN_SIMILARITY = float(os.getenv("PLAN_CACHE_MIN_SIMILARITY", "0.5"))
+
+# Klucze planu przechowywane w cache
+PLAN_KEYS = ("file_structure", "supabase_tables", "components")
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def canonical_features(features):
+    """
+    Canonicalises a feature list: accent/case/whitespace-insensitive, deduplicated and sorted.
+    Args:
+        features (str | list): Comma-separated string (as in --features) or a list of features.
+    Returns:
+        tuple: Sorted, unique, normalised feature names.
+    """
+    if isinstance(features, str):
+        features = features.split(",")
+    return tuple(sorted({_normalize(f) for f in features or [] if f and f.strip()}))
+
+
+def canonical_framework(framework):
+    return _normalize(framework or "").replace(" ", "")
+
+
+def plan_key(framework, features):
+    """Returns the cache key for a framework and an order-insensitive feature set."""
+    source = canonical_framework(framework) + "\0" + "\n".join(canonical_features(features))
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def feature_similarity(a, b):
+    """Jaccard similarity of two canonical feature sets."""
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PlanCache:
+    """
+    Persistent plan cache keyed on framework plus canonical feature set.
+    Entries expire after ttl seconds; the least recently used entries are evicted
+    beyond max_entries. Hit/miss counters are persisted with the cache.
+    """
+
+    def __init__(self, path=PLAN_CACHE_PATH, max_entries=PLAN_CACHE_MAX_ENTRIES, ttl=PLAN_CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS plans (
+                    key TEXT PRIMARY KEY,
+                    framework TEXT NOT NULL,
+                    features TEXT NOT NULL,
+                    plan TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_plans_framework ON plans (framework)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_plans_last_used ON plans (last_used_at)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def _expire(self, now):
+        self._conn.execute("DELETE FROM plans WHERE created_at < ?", (now - self.ttl,))
+
+    def get(self, framework, features):
+        """Returns the cached plan for exactly this framework and feature set, or None."""
+        now = time.time()
+        key = plan_key(framework, features)
+        with self._lock, self._conn:
+            self._expire(now)
+            row = self._conn.execute("SELECT plan FROM plans WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE plans SET last_used_at = ? WHERE key = ?", (now, key))
+            self._count("hits")
+        return json.loads(row[0])
+
+    def find_similar(self, framework, features, min_similarity=PLAN_CACHE_MIN_SIMILARITY):
+        """
+        Finds the closest cached plan for the same framework by feature-set similarity.
+        Returns:
+            tuple: (plan, similarity, cached features) or None if nothing is similar enough.
+        """
+        now = time.time()
+        wanted = canonical_features(features)
+        best = None
+        with self._lock, self._conn:
+            self._expire(now)
+            rows = self._conn.execute(
+                "SELECT key, features, plan FROM plans WHERE framework = ? ORDER BY last_used_at DESC",
+                (canonical_framework(framework),)
+            ).fetchall()
+            for key, cached_features, plan in rows:
+                cached_features = tuple(json.loads(cached_features))
+                similarity = feature_similarity(wanted, cached_features)
+                if similarity >= min_similarity and (best is None or similarity > best[1]):
+                    best = (key, similarity, cached_features, plan)
+            if best is None:
+                self._count("misses")
+                return None
+            self._conn.execute("UPDATE plans SET last_used_at = ? WHERE key = ?", (now, best[0]))
+            self._count("near_hits")
+        return json.loads(best[3]), best[1], best[2]
+
+    def put(self, framework, features, plan):
+        """Stores the plan keys (file_structure, supabase_tables, components) and evicts LRU entries over capacity."""
+        now = time.time()
+        stored = {k: plan.get(k) for k in PLAN_KEYS if k in plan}
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO plans (key, framework, features, plan, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (plan_key(framework, features), canonical_framework(framework), json.dumps(canonical_features(features)),
+                 json.dumps(stored, ensure_ascii=False), now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM plans WHERE key NOT IN (SELECT key FROM plans ORDER BY last_used_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        """Returns hit/near-hit/miss counters, hit rate and current entry count."""
+        with self._lock:
+            counters = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        hits, near_hits, misses = (counters.get(k, 0) for k in ("hits", "near_hits", "misses"))
+        lookups = hits + near_hits + misses
+        return {
+            "hits": hits,
+            "near_hits": near_hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def describe_prior_plan(plan, similarity, cached_features, features):
+    """Builds the planner prompt fragment that seeds planning with a close prior plan."""
+    wanted = set(canonical_features(features))
+    added = sorted(wanted - set(cached_features))
+    removed = sorted(set(cached_features) - wanted)
+    logging.info(f"Plan cache near-match (similarity {similarity:.2f}); added features: {added}, removed features: {removed}")
+    return (
+        f"Jako punkt wyjścia użyj poniższego planu podobnego projektu (podobieństwo funkcji {similarity:.0%}) "
+        f"i dostosuj go: dodaj obsługę funkcji {added or 'brak'}, usuń elementy dotyczące funkcji {removed or 'brak'}.\n"
+        f"Poprzedni plan: {json.dumps(plan, ensure_ascii=False)}"
+    )
@@ -0,0 +1,343 @@
+import os
+import re
+import ast
+import json
+import logging
+
+from utils import AGENT_VERBOSE
+
+# Ile razy planista jest dopytywany o pola, których nie dało się naprawić lokalnie
+PLAN_REASK_ROUNDS = int(os.getenv("PLAN_REASK_ROUNDS", "1"))
+
+PLAN_FIELDS = ("file_structure", "supabase_tables", "components")
+
+# Deklarowany schemat planu (JSON Schema) - wysyłany planiście i sprawdzany lokalnie w validate_plan()
+PLAN_SCHEMA = {
+    "type": "object",
+    "required": list(PLAN_FIELDS),
+    "properties": {
+        "file_structure": {
+            "type": "object",
+            "description": "Map of project-relative file path to a one-line description of the file",
+            "additionalProperties": {"type": "string"},
+        },
+        "supabase_tables": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["name", "schema"],
+                "properties": {
+                    "name": {"type": "string", "pattern": "^[A-Za-z_][A-Za-z0-9_]*$"},
+                    "schema": {
+                        "type": "array",
+                        "description": "SQL column definitions, e.g. \"id UUID PRIMARY KEY\"",
+                        "items": {"type": "string"},
+                        "minItems": 1,
+                    },
+                },
+            },
+        },
+        "components": {
+            "type": "array",
+            "description": "Key components to implement, each as \"Name - responsibility\"",
+            "items": {"type": "string"},
+        },
+    },
+}
+
+PLAN_FORMAT_INSTRUCTIONS = f"""
+Return ONLY one JSON object (no markdown fences, no comments, no text before or after it) that conforms to this JSON Schema:
+{json.dumps(PLAN_SCHEMA, indent=2)}
+Use double quotes for all keys and strings and no trailing commas."""
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+FENCE = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)```", re.DOTALL)
+STRING_TOKEN = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'')
+SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"', "‘": "'", "’": "'"})
+
+
+def _balanced_objects(text):
+    """Yields the top-level {...} spans of text (string-aware); an unterminated last span is yielded as-is."""
+    depth, start, in_string, escape, quote = 0, None, False, False, None
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                in_string = False
+        elif char in "\"'" and depth:
+            in_string, quote = True, char
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:i + 1]
+                start = None
+    if start is not None:
+        yield text[start:]
+
+
+def _close_brackets(text):
+    """Appends the closers of a truncated JSON text (open strings, arrays and objects)."""
+    stack, in_string, escape = [], False, False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append("]" if char == "[" else "}")
+        elif char in "]}" and stack:
+            stack.pop()
+    text = text + '"' if in_string else text
+    text = re.sub(r"[,:]\s*$", "", text.rstrip())
+    return text + "".join(reversed(stack))
+
+
+def _repair_code(segment):
+    segment = re.sub(r"//[^\n]*|/\*.*?\*/|#[^\n]*", "", segment, flags=re.DOTALL)
+    segment = re.sub(r"([{,]\s*)([A-Za-z_][\w-]*)(\s*:)", r'\1"\2"\3', segment)
+    segment = re.sub(r"\bTrue\b", "true", re.sub(r"\bFalse\b", "false", re.sub(r"\bNone\b", "null", segment)))
+    return re.sub(r",(\s*[}\]])", r"\1", segment)
+
+
+def repair_json(text):
+    """
+    Fixes the common defects of LLM-produced JSON without another model call: smart quotes, comments,
+    trailing commas, single-quoted strings, unquoted keys, Python literals and truncated closers.
+    String contents are never rewritten.
+    Returns:
+        The parsed value, or None if the text could not be repaired.
+    """
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    # Cudzysłowy typograficzne zamieniamy dopiero w drugiej próbie („...” bywa treścią polskich opisów)
+    for source in (text, text.translate(SMART_QUOTES)):
+        parts, position = [], 0
+        for match in STRING_TOKEN.finditer(source):
+            parts.append(_repair_code(source[position:match.start()]))
+            token = match.group(0)
+            if token[0] == "'":
+                token = json.dumps(token[1:-1].replace("\\'", "'"), ensure_ascii=False)
+            parts.append(token)
+            position = match.end()
+        parts.append(_repair_code(source[position:]))
+        try:
+            return json.loads(_close_brackets("".join(parts)))
+        except json.JSONDecodeError:
+            continue
+    try:
+        # Słownik w składni Pythona
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def extract_json_object(text):
+    """
+    Finds the plan object in a model response: fenced blocks first, then every {...} span in the text.
+    Returns:
+        tuple: (dict or None, repaired) - repaired is True if the JSON had to be fixed locally.
+    """
+    candidates = FENCE.findall(text) + list(_balanced_objects(text))
+    for candidate in candidates:
+        candidate = candidate.strip()
+        try:
+            value = json.loads(candidate)
+            repaired = False
+        except json.JSONDecodeError:
+            value = repair_json(candidate)
+            repaired = True
+        if isinstance(value, dict):
+            return value, repaired
+    return None, False
+
+
+def _flatten_file_structure(value, prefix=""):
+    files = {}
+    for key, item in value.items():
+        path = f"{prefix}{key}"
+        if isinstance(item, dict):
+            files.update(_flatten_file_structure(item, path.rstrip("/") + "/"))
+        elif isinstance(item, list) and all(isinstance(child, str) for child in item):
+            for child in item:
+                files[f"{path.rstrip('/')}/{child}"] = ""
+        else:
+            files[path] = "" if item is None else str(item)
+    return files
+
+
+def _normalize_file_structure(value):
+    if isinstance(value, list):
+        files = {}
+        for item in value:
+            if isinstance(item, str):
+                files[item] = ""
+            elif isinstance(item, dict) and (item.get("path") or item.get("file")):
+                files[item.get("path") or item.get("file")] = str(item.get("description", ""))
+            else:
+                raise ValueError(f"unrecognised file entry {item!r}")
+        value = files
+    if not isinstance(value, dict):
+        raise ValueError("must be an object mapping file paths to descriptions")
+    return _flatten_file_structure(value)
+
+
+def _normalize_columns(schema):
+    if isinstance(schema, str):
+        schema = [column for column in re.split(r",\s*(?![^()]*\))|\n", schema)]
+    elif isinstance(schema, dict):
+        schema = [f"{column} {definition}" for column, definition in schema.items()]
+    elif isinstance(schema, list):
+        schema = [
+            f"{column['name']} {column.get('type', 'TEXT')} {column.get('constraints', '')}" if isinstance(column, dict) and column.get("name") else column
+            for column in schema
+        ]
+    if not isinstance(schema, list) or not all(isinstance(column, str) for column in schema):
+        raise ValueError("schema must be a list of SQL column definitions")
+    schema = [" ".join(column.split()) for column in schema if column and column.strip()]
+    if not schema:
+        raise ValueError("schema has no columns")
+    return schema
+
+
+def _normalize_tables(value):
+    if isinstance(value, dict):
+        # {"todos": [...]} zamiast [{"name": "todos", "schema": [...]}]
+        value = [{"name": name, "schema": schema} for name, schema in value.items()]
+    if not isinstance(value, list):
+        raise ValueError("must be a list of {name, schema} objects")
+    tables = []
+    for index, table in enumerate(value):
+        if not isinstance(table, dict):
+            raise ValueError(f"table #{index} is not an object")
+        name = table.get("name") or table.get("table_name") or table.get("table")
+        if not isinstance(name, str) or not IDENTIFIER.match(name.strip()):
+            raise ValueError(f"table #{index} has an invalid name {name!r}")
+        schema = table.get("schema", table.get("columns"))
+        try:
+            tables.append({"name": name.strip(), "schema": _normalize_columns(schema)})
+        except ValueError as e:
+            raise ValueError(f"table {name!r}: {e}")
+    return tables
+
+
+def _normalize_components(value):
+    if isinstance(value, str):
+        value = [line.strip(" -*\t") for line in re.split(r"\n|;", value)]
+    if isinstance(value, dict):
+        value = [f"{name} - {description}" for name, description in value.items()]
+    if not isinstance(value, list):
+        raise ValueError("must be a list of strings")
+    components = []
+    for item in value:
+        if isinstance(item, dict) and item.get("name"):
+            description = item.get("description") or item.get("responsibility")
+            item = f"{item['name']} - {description}" if description else item["name"]
+        if not isinstance(item, str):
+            raise ValueError(f"unrecognised component {item!r}")
+        if item.strip():
+            components.append(item.strip())
+    return components
+
+
+NORMALIZERS = {
+    "file_structure": _normalize_file_structure,
+    "supabase_tables": _normalize_tables,
+    "components": _normalize_components,
+}
+
+
+def validate_plan(plan, fields=PLAN_FIELDS):
+    """
+    Validates a plan against PLAN_SCHEMA, coercing near-miss shapes (file trees, column maps,
+    component objects) to the declared form.
+    Returns:
+        tuple: (plan with the valid fields, {field: error message} for the invalid ones)
+    """
+    valid, errors = {}, {}
+    if not isinstance(plan, dict):
+        return valid, {field: "plan is not a JSON object" for field in fields}
+    for field in fields:
+        if field not in plan:
+            errors[field] = "missing"
+            continue
+        try:
+            valid[field] = NORMALIZERS[field](plan[field])
+        except (ValueError, TypeError, KeyError) as e:
+            errors[field] = str(e)
+    return valid, errors
+
+
+def parse_plan(text, fields=PLAN_FIELDS):
+    """
+    Extracts, repairs and validates the planner output.
+    Returns:
+        tuple: (plan with the valid fields, {field: error message} for the missing or invalid ones)
+    """
+    plan, repaired = extract_json_object(text)
+    if plan is None:
+        return {}, {field: "no JSON object found in the planner output" for field in fields}
+    if repaired:
+        logging.info("Plan JSON was malformed and has been repaired locally.")
+    return validate_plan(plan, fields)
+
+
+def plan_reask_description(plan, errors, project_description):
+    """Builds the follow-up prompt that asks the planner again for the invalid fields only."""
+    field_schemas = {field: PLAN_SCHEMA["properties"][field] for field in errors}
+    problems = "\n".join(f"- {field}: {error}" for field, error in errors.items())
+    return (
+        f"The plan for {project_description} is incomplete. These fields were missing or invalid:\n{problems}\n\n"
+        f"Valid part of the plan (keep it consistent, do not repeat it):\n{json.dumps(plan, ensure_ascii=False)}\n\n"
+        f"Return ONLY one JSON object with exactly the keys {', '.join(errors)}, conforming to these schemas:\n"
+        f"{json.dumps(field_schemas, indent=2)}\n"
+        "No markdown fences and no text outside the JSON object."
+    )
+
+
+def request_plan_fields(agent, plan, errors, project_description, rounds=PLAN_REASK_ROUNDS):
+    """
+    Targeted re-ask: requests only the invalid plan fields from the planner and merges the valid answers.
+    Args:
+        agent: Planner agent.
+        plan (dict): Valid fields so far.
+        errors (dict): {field: error} from parse_plan().
+        project_description (str): Project, framework and features, for context.
+        rounds (int): Maximum number of follow-up requests.
+    Returns:
+        tuple: (merged plan, remaining {field: error}, tokens used by the follow-up requests)
+    """
+    from crewai import Crew, Process, Task
+    from sonar_fix import crew_token_usage
+
+    plan, errors, tokens = dict(plan), dict(errors), 0
+    for round_number in range(rounds):
+        if not errors:
+            break
+        logging.info(f"Dopytywanie planisty o pola planu {sorted(errors)} (runda {round_number + 1}/{rounds}).")
+        fix_task = Task(
+            description=plan_reask_description(plan, errors, project_description),
+            agent=agent,
+            expected_output=f"JSON object with the keys: {', '.join(errors)}"
+        )
+        fix_crew = Crew(agents=[agent], tasks=[fix_task], process=Process.sequential, verbose=AGENT_VERBOSE, max_rpm=10)
+        fix_result = fix_crew.kickoff()
+        tokens += crew_token_usage(fix_result)
+        logging.debug(f"Plan re-ask result: {fix_result}")
+        fixed, errors = parse_plan(str(fix_result), fields=tuple(errors))
+        plan.update(fixed)
+    return plan, errors, tokens
@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import builtins
+import threading
+from collections import defaultdict
+
+# Profil jest zbierany wyłącznie standardową biblioteką, aby moduł można było załadować przed ciężkimi importami
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_TOP_FUNCTIONS = int(os.getenv("PROFILE_TOP_FUNCTIONS", "25"))
+PROFILE_TOP_IMPORTS = 30
+
+_import_times = {}
+_import_state = threading.local()
+_original_import = None
+_original_sleep = time.sleep
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.splitext(os.path.basename(code.co_filename))[0]}:{code.co_name}"
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    key = f"{'.' * level}{name}"
+    if level == 0 and name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = getattr(_import_state, "stack", None)
+    if stack is None:
+        stack = _import_state.stack = []
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - started
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        if key not in _import_times:
+            _import_times[key] = {"cumulative_ms": round(elapsed * 1000, 3), "self_ms": round((elapsed - children) * 1000, 3), "depth": len(stack)}
+
+
+def start_import_timing():
+    """Starts recording the time of every first-time import (inclusive and self time), like -X importtime."""
+    global _original_import
+    if _original_import is None:
+        _original_import = builtins.__import__
+        builtins.__import__ = _timed_import
+
+
+def stop_import_timing():
+    global _original_import
+    if _original_import is not None:
+        builtins.__import__ = _original_import
+        _original_import = None
+
+
+def import_report():
+    """Returns the import-time breakdown: total of top-level imports and the slowest modules."""
+    top = sorted(_import_times.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)[:PROFILE_TOP_IMPORTS]
+    return {
+        "total_ms": round(sum(t["cumulative_ms"] for t in _import_times.values() if t["depth"] == 0), 3),
+        "modules": [dict(module=name, **times) for name, times in top],
+    }
+
+
+class RunProfiler:
+    """
+    Per-stage profiler of a pipeline run.
+    For each stage it records wall and CPU time, a cProfile of the main thread, and the time spent
+    blocked in time.sleep (rate limiters, polling, retries) by caller. A wall-clock sampler of the
+    main thread produces collapsed stacks ("stage;module:function;... count") for flame graphs.
+    Used as a JobRecorder listener: stage(name) switches stages, finish(status) writes the report.
+    """
+
+    def __init__(self, output_dir, sample_interval=PROFILE_SAMPLE_INTERVAL):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.stages = []
+        self.stacks = defaultdict(int)
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._main_ident = threading.main_thread().ident
+        self._sampler = None
+        self._started_wall = None
+        self._started_cpu = None
+
+    def start(self):
+        self._started_wall = time.perf_counter()
+        self._started_cpu = time.process_time()
+        time.sleep = self._sleep
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+        self.stage("setup")
+
+    def _sleep(self, seconds):
+        label = _frame_label(sys._getframe(1))
+        started = time.perf_counter()
+        try:
+            _original_sleep(seconds)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                if self._current is not None:
+                    self._current["sleep_seconds"] += elapsed
+                    self._current["sleep_by_caller"][label] += elapsed
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._main_ident)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            with self._lock:
+                stage = self._current["name"] if self._current else "setup"
+                self.stacks[";".join([stage.replace(";", ",")] + labels[::-1])] += 1
+
+    def _close_stage(self):
+        stage = self._current
+        if stage is None:
+            return
+        stage["profile"].disable()
+        stage["wall_seconds"] = time.perf_counter() - stage.pop("_wall")
+        stage["cpu_seconds"] = time.process_time() - stage.pop("_cpu")
+        with self._lock:
+            self._current = None
+        self.stages.append(stage)
+
+    def stage(self, name):
+        self._close_stage()
+        stage = {
+            "name": name,
+            "profile": cProfile.Profile(),
+            "sleep_seconds": 0.0,
+            "sleep_by_caller": defaultdict(float),
+            "_wall": time.perf_counter(),
+            "_cpu": time.process_time(),
+        }
+        with self._lock:
+            self._current = stage
+        stage["profile"].enable()
+
+    def _top_functions(self, profile):
+        stats = pstats.Stats(profile)
+        rows = []
+        for (file_name, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(file_name)}:{line}:{function}",
+                "calls": calls,
+                "self_seconds": round(total, 4),
+                "cumulative_seconds": round(cumulative, 4),
+            })
+        rows.sort(key=lambda row: row["cumulative_seconds"], reverse=True)
+        return rows[:PROFILE_TOP_FUNCTIONS]
+
+    def finish(self, status=None, **_):
+        """Stops profiling and writes report.json, stacks.collapsed and one .pstats file per stage."""
+        self._close_stage()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        time.sleep = _original_sleep
+        stop_import_timing()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stages = []
+        for index, stage in enumerate(self.stages):
+            stats_file = f"{index:02d}-{''.join(c if c.isalnum() else '_' for c in stage['name'])[:40]}.pstats"
+            stage["profile"].dump_stats(os.path.join(self.output_dir, stats_file))
+            stages.append({
+                "name": stage["name"],
+                "wall_seconds": round(stage["wall_seconds"], 4),
+                "cpu_seconds": round(stage["cpu_seconds"], 4),
+                # Czas ściany bez CPU procesu: oczekiwanie na LLM, sieć, dysk, sleep
+                "waiting_seconds": round(max(0.0, stage["wall_seconds"] - stage["cpu_seconds"]), 4),
+                "sleep_seconds": round(stage["sleep_seconds"], 4),
+                "sleep_by_caller": {k: round(v, 4) for k, v in sorted(stage["sleep_by_caller"].items(), key=lambda i: -i[1])},
+                "pstats_file": stats_file,
+                "top_functions": self._top_functions(stage["profile"]),
+            })
+
+        report = {
+            "status": status,
+            "wall_seconds": round(time.perf_counter() - self._started_wall, 4),
+            "cpu_seconds": round(time.process_time() - self._started_cpu, 4),
+            "sleep_seconds": round(sum(stage["sleep_seconds"] for stage in stages), 4),
+            "imports": import_report(),
+            "stages": stages,
+            "sample_interval": self.sample_interval,
+            "samples": sum(self.stacks.values()),
+        }
+        with open(os.path.join(self.output_dir, "report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        with open(os.path.join(self.output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        return report
@@ -0,0 +1,94 @@
+import os
+import re
+import stat
+import logging
+import tempfile
+
+# Format "--- <ścieżka_pliku> ---" zwracany przez agentów
+FILE_BLOCK_PATTERN = re.compile(r'---\s*(\S+?)\s*---\s*(.*?)(?=(---|\Z))', re.DOTALL)
+# mkstemp tworzy pliki z prawami 0600; nowe pliki dostają zwykłe prawa (0666 minus umask), istniejące zachowują swoje.
+# Umask odczytujemy raz przy imporcie: os.umask() zmienia ją dla całego procesu.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+def parse_file_blocks(result_str):
+    """
+    Parses agent output in the "--- <filename> ---" format.
+    Args:
+        result_str (str): Raw agent output.
+    Returns:
+        dict: Mapping of relative file path -> file content.
+    """
+    files = {}
+    for match in FILE_BLOCK_PATTERN.finditer(result_str):
+        file_name = match.group(1).strip()
+        file_content = match.group(2).strip()
+        files[file_name] = file_content
+        logging.info(f"Parsed content for {file_name}:\n{file_content[:100]}...")
+    return files
+
+
+def resolve_project_path(project_dir, file_name):
+    """
+    Returns the absolute path of file_name inside project_dir.
+    Raises ValueError if the path would escape the project directory.
+    """
+    root = os.path.abspath(project_dir)
+    file_path = os.path.abspath(os.path.join(root, file_name))
+    if os.path.commonpath([root, file_path]) != root:
+        raise ValueError(f"Path {file_name} escapes project directory {project_dir}")
+    return file_path
+
+
+def read_project_file(project_dir, file_name):
+    """Returns the current content of a project file or None if it does not exist."""
+    try:
+        with open(resolve_project_path(project_dir, file_name), "r", encoding="utf-8") as f:
+            return f.read()
+    except (FileNotFoundError, IsADirectoryError, UnicodeDecodeError):
+        return None
+
+
+def write_project_files(project_dir, files):
+    """
+    Diff-aware writer: writes only files whose content actually changed.
+    Content is normalised to end with a single newline (agent output is stripped), so an
+    unchanged file is recognised. Each file is written atomically (temp file + os.replace),
+    so a crash mid-write never leaves a half-written file behind; an existing file keeps its mode.
+    Args:
+        project_dir (str): Project directory.
+        files (dict): Mapping of relative file path -> new content.
+    Returns:
+        list: Relative paths of files that were created or modified.
+    """
+    changed = []
+    for file_name, content in files.items():
+        try:
+            file_path = resolve_project_path(project_dir, file_name)
+            content = content.rstrip("\n") + "\n" if content else content
+            if read_project_file(project_dir, file_name) == content:
+                logging.debug(f"Unchanged, skipping write: {file_path}")
+                continue
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            try:
+                # Plik zdeduplikowany hardlinkiem do magazynu artefaktów ma prawa obiektu (0444): przywracamy zapis
+                mode = stat.S_IMODE(os.stat(file_path).st_mode) | stat.S_IWUSR
+            except FileNotFoundError:
+                mode = NEW_FILE_MODE
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.chmod(tmp_path, mode)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            changed.append(file_name)
+            logging.info(f"Manually written file: {file_path}")
+        except Exception as e:
+            logging.error(f"Failed to write file {file_name}: {str(e)}")
+    return changed
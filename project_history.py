@@ -0,0 +1,192 @@
+import os
+import re
+import shutil
+import logging
+import subprocess
+
+from job_store import ARTIFACT_SKIP_DIRS
+
+# Migawki etapów w repozytorium git projektu: każdy etap zapisujący pliki kończy się commitem
+# z metadanymi etapu, a --rollback-to przywraca drzewo wybranego etapu bez ponownego uruchamiania LLM.
+GIT_SNAPSHOTS = os.getenv("GIT_SNAPSHOTS", "true").lower() in ("1", "true", "yes")
+GIT_AUTHOR_NAME = os.getenv("GIT_SNAPSHOT_AUTHOR_NAME", "AI Web Factory")
+GIT_AUTHOR_EMAIL = os.getenv("GIT_SNAPSHOT_AUTHOR_EMAIL", "factory@localhost")
+GIT_TIMEOUT = 60
+STAGE_TRAILER = "Factory-Stage"
+JOB_TRAILER = "Factory-Job"
+FILES_TRAILER = "Factory-Files"
+ROLLBACK_TRAILER = "Factory-Rollback-To"
+
+
+class GitError(RuntimeError):
+    pass
+
+
+class ProjectHistory:
+    """
+    Versions a project directory in its own git repository, one commit per pipeline stage.
+    Only the paths reported as changed by a stage are staged (git update-index on an explicit path
+    list, no `git add .` rescan of the tree); the first snapshot of a project stages its whole tree.
+    """
+
+    def __init__(self, project_dir, job_id=None):
+        self.project_dir = os.path.abspath(project_dir)
+        self.job_id = job_id
+        self.git = shutil.which("git")
+        self.env = dict(os.environ)
+        for prefix in ("GIT_AUTHOR", "GIT_COMMITTER"):
+            self.env.setdefault(f"{prefix}_NAME", GIT_AUTHOR_NAME)
+            self.env.setdefault(f"{prefix}_EMAIL", GIT_AUTHOR_EMAIL)
+
+    @property
+    def enabled(self):
+        return GIT_SNAPSHOTS and self.git is not None
+
+    def _run(self, *args, input=None):
+        command = [self.git, "-c", "commit.gpgsign=false", "-c", "core.quotepath=false", *args]
+        completed = subprocess.run(
+            command, cwd=self.project_dir, env=self.env, input=input,
+            capture_output=True, text=True, timeout=GIT_TIMEOUT
+        )
+        if completed.returncode != 0:
+            raise GitError(f"git {args[0]} failed: {completed.stderr.strip()[-500:]}")
+        return completed.stdout
+
+    def _head(self):
+        try:
+            return self._run("rev-parse", "--verify", "-q", "HEAD^{commit}").strip()
+        except GitError:
+            return None
+
+    def _ensure_repo(self):
+        if not os.path.exists(os.path.join(self.project_dir, ".git")):
+            self._run("init", "-q")
+            logging.info(f"Initialised git repository in {self.project_dir}")
+
+    def _all_files(self):
+        paths = []
+        for root, dirs, files in os.walk(self.project_dir):
+            dirs[:] = sorted(d for d in dirs if d not in ARTIFACT_SKIP_DIRS)
+            for name in sorted(files):
+                if name.startswith(".tmp-") or os.path.islink(os.path.join(root, name)):
+                    continue
+                paths.append(os.path.relpath(os.path.join(root, name), self.project_dir).replace(os.sep, "/"))
+        return paths
+
+    def _commit(self, tree, parent, title, trailers):
+        message = title + "\n\n" + "\n".join(f"{key}: {value}" for key, value in trailers.items() if value is not None) + "\n"
+        args = ["commit-tree", tree] + (["-p", parent] if parent else [])
+        commit = self._run(*args, input=message).strip()
+        self._run("update-ref", "-m", f"factory: {title}", "HEAD", commit, *([parent] if parent else []))
+        return commit
+
+    def snapshot(self, stage, changed_files, title=None):
+        """
+        Commits the files a stage changed.
+        Args:
+            stage (str): Stage key stored in the Factory-Stage trailer (e.g. codegen, review); used by --rollback-to.
+            changed_files (iterable): Relative paths written or deleted by the stage.
+            title (str): Commit subject (default: the stage key).
+        Returns:
+            str|None: Commit id, or None if nothing changed, snapshots are disabled or git failed.
+        """
+        if not self.enabled:
+            return None
+        try:
+            self._ensure_repo()
+            parent = self._head()
+            paths = sorted(set(changed_files or ()))
+            if parent is None:
+                # Pierwsza migawka obejmuje całe drzewo (szablon, pliki wygenerowane wcześniej)
+                paths = sorted(set(paths) | set(self._all_files()))
+            if not paths and parent is not None:
+                return None
+            if paths:
+                # --add/--remove: nowe pliki są dodawane, usunięte znikają z indeksu; reszta drzewa nie jest skanowana
+                self._run("update-index", "--add", "--remove", "-z", "--stdin", input="\0".join(paths) + "\0")
+            tree = self._run("write-tree").strip()
+            if parent is not None and tree == self._run("rev-parse", f"{parent}^{{tree}}").strip():
+                logging.info(f"Git snapshot of stage {stage}: no changes.")
+                return None
+            commit = self._commit(tree, parent, title or stage, {
+                STAGE_TRAILER: stage,
+                JOB_TRAILER: self.job_id,
+                FILES_TRAILER: len(paths),
+            })
+            logging.info(f"Git snapshot of stage {stage}: {commit[:12]} ({len(paths)} files staged).")
+            return commit
+        except (GitError, OSError, subprocess.TimeoutExpired) as e:
+            logging.error(f"Git snapshot of stage {stage} failed: {e}")
+            return None
+
+    def snapshots(self, limit=50):
+        """Returns [{"commit", "stage", "job_id", "subject"}] of stage snapshots, newest first."""
+        if not self.enabled or self._head() is None:
+            return []
+        output = self._run(
+            "log", f"-{limit}",
+            f"--format=%H%x1f%s%x1f%(trailers:key={STAGE_TRAILER},valueonly,separator=)%x1f%(trailers:key={JOB_TRAILER},valueonly,separator=)%x1e"
+        )
+        entries = []
+        for record in output.split("\x1e"):
+            fields = record.strip("\n").split("\x1f")
+            if len(fields) != 4 or not fields[2].strip():
+                continue
+            entries.append({"commit": fields[0], "subject": fields[1], "stage": fields[2].strip(), "job_id": fields[3].strip() or None})
+        return entries
+
+    def resolve(self, target):
+        """Resolves a stage key (latest snapshot of that stage) or a commit id to a commit id."""
+        for entry in self.snapshots(limit=500):
+            if entry["stage"] == target:
+                return entry["commit"]
+        if re.fullmatch(r"[0-9a-fA-F]{4,40}", target):
+            try:
+                return self._run("rev-parse", "--verify", "-q", f"{target}^{{commit}}").strip()
+            except GitError:
+                pass
+        raise ValueError(f"BŁĄD: Brak migawki etapu {target} w historii projektu {self.project_dir}.")
+
+    def rollback_to(self, target):
+        """
+        Restores the tracked files of the project to a stage snapshot (git read-tree -u --reset)
+        and records the rollback as a new commit, so the discarded stages stay reachable.
+        Files that are not tracked (node_modules, .factory) are left untouched.
+        Returns:
+            dict: {"commit" (restored snapshot), "head" (new HEAD), "stage"}
+        Raises:
+            ValueError: If there is no such snapshot.
+        """
+        if not self.enabled:
+            raise ValueError("BŁĄD: Migawki git są wyłączone (GIT_SNAPSHOTS) lub brak programu git.")
+        commit = self.resolve(target)
+        self._run("read-tree", "-u", "--reset", commit)
+        head = self._head()
+        tree = self._run("rev-parse", f"{commit}^{{tree}}").strip()
+        if head is not None and tree == self._run("rev-parse", f"{head}^{{tree}}").strip():
+            logging.info(f"Project already at snapshot {commit[:12]}.")
+            return {"commit": commit, "head": head, "stage": target}
+        head = self._commit(tree, head, f"Rollback to {target}", {
+            STAGE_TRAILER: "rollback",
+            JOB_TRAILER: self.job_id,
+            ROLLBACK_TRAILER: commit,
+        })
+        logging.info(f"Project {self.project_dir} rolled back to {target} ({commit[:12]}).")
+        return {"commit": commit, "head": head, "stage": target}
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Stage snapshots of a generated project")
+    parser.add_argument("project_dir", help="Project directory")
+    parser.add_argument("--rollback-to", help="Stage key or commit id to restore")
+    cli_args = parser.parse_args()
+
+    history = ProjectHistory(cli_args.project_dir)
+    if cli_args.rollback_to:
+        print(json.dumps(history.rollback_to(cli_args.rollback_to), indent=2))
+    else:
+        print(json.dumps(history.snapshots(), indent=2))
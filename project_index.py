@@ -0,0 +1,250 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+from collections import Counter
+
+INDEX_DIR = ".factory"
+INDEX_FILE = "index.json"
+INDEX_VERSION = 1
+CHUNK_LINES = int(os.getenv("INDEX_CHUNK_LINES", "40"))
+# Pliki nie dłuższe niż tyle linii trafiają do kontekstu w całości
+FULL_FILE_LINES = int(os.getenv("INDEX_FULL_FILE_LINES", "150"))
+MAX_FILE_BYTES = 512 * 1024
+
+INDEXED_EXTENSIONS = {".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".py", ".html", ".css", ".json", ".md", ".sql", ".yaml", ".yml", ".toml", ".txt"}
+SKIP_DIRS = {"node_modules", ".git", ".next", "__pycache__", ".venv", "venv", "dist", "build", ".deps", ".scannerwork", INDEX_DIR}
+SKIP_FILES = {"package-lock.json", "debug_result.txt", "test_results.json"}
+
+# Definicje symboli: funkcje, klasy, zmienne/komponenty JS, selektory CSS, id elementów HTML
+SYMBOL_PATTERNS = {
+    ".py": [re.compile(r"^\s*(?:async\s+)?def\s+(\w+)"), re.compile(r"^\s*class\s+(\w+)")],
+    ".js": [
+        re.compile(r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*(\w+)"),
+        re.compile(r"^\s*(?:export\s+)?(?:default\s+)?class\s+(\w+)"),
+        re.compile(r"^\s*(?:export\s+)?(?:const|let|var)\s+(\w+)\s*="),
+    ],
+    ".css": [re.compile(r"^\s*([.#]?[\w-][\w\s.#:>+~\[\]=\"'-]*?)\s*\{")],
+    ".html": [re.compile(r"""\bid=["']([\w-]+)["']""")],
+}
+for _ext in (".jsx", ".mjs", ".cjs", ".ts", ".tsx"):
+    SYMBOL_PATTERNS[_ext] = SYMBOL_PATTERNS[".js"]
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+SYMBOL_BOOST = 2.0
+
+
+def tokenize(text):
+    """Lowercase word tokens; camelCase and snake_case identifiers are also split into parts."""
+    tokens = []
+    for word in re.findall(r"[A-Za-z_ąćęłńóśźżĄĆĘŁŃÓŚŹŻ][\wąćęłńóśźżĄĆĘŁŃÓŚŹŻ-]*|\d+", text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        parts = [p.lower() for p in re.findall(r"[A-Z]?[a-ząćęłńóśźż]+|[A-Z]+(?![a-z])|\d+", word.replace("-", "_"))]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return [t for t in tokens if len(t) > 1]
+
+
+def extract_symbols(ext, line):
+    return [m.group(1).strip() for pattern in SYMBOL_PATTERNS.get(ext, []) for m in pattern.finditer(line)]
+
+
+def chunk_file(rel_path, text, chunk_lines=CHUNK_LINES):
+    """
+    Splits a file into chunks of at most chunk_lines lines, preferring to start a new
+    chunk at symbol definitions so that functions and components stay together.
+    """
+    ext = os.path.splitext(rel_path)[1].lower()
+    lines = text.splitlines()
+    chunks = []
+    start = 0
+    symbols = []
+
+    def flush(end):
+        body = "\n".join(lines[start:end])
+        if body.strip():
+            terms = Counter(tokenize(body) + tokenize(rel_path))
+            chunks.append({
+                "path": rel_path,
+                "start_line": start + 1,
+                "end_line": end,
+                "symbols": list(dict.fromkeys(symbols)),
+                "terms": dict(terms),
+                "length": sum(terms.values()),
+            })
+
+    for i, line in enumerate(lines):
+        line_symbols = extract_symbols(ext, line)
+        at_limit = i - start >= chunk_lines
+        # Nowy chunk na początku definicji symbolu, jeśli bieżący ma już sensowny rozmiar
+        if i > start and (at_limit or (line_symbols and i - start >= chunk_lines // 4)):
+            flush(i)
+            start, symbols = i, []
+        symbols.extend(line_symbols)
+    flush(len(lines))
+    return chunks
+
+
+class ProjectIndex:
+    """
+    Incremental lexical (BM25) index over a project's files.
+
+    File hashes are recorded so that refresh() re-chunks only changed files;
+    update_files() is called after the pipeline writes files.
+    """
+
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.index_path = os.path.join(project_dir, INDEX_DIR, INDEX_FILE)
+        self.files = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.files = data.get("files", {})
+        except (OSError, ValueError):
+            self.files = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _iter_files(self):
+        for root, dirs, files in os.walk(self.project_dir):
+            dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+            for name in files:
+                if name in SKIP_FILES or os.path.splitext(name)[1].lower() not in INDEXED_EXTENSIONS:
+                    continue
+                yield os.path.relpath(os.path.join(root, name), self.project_dir).replace(os.sep, "/")
+
+    def _index_file(self, rel_path):
+        """(Re)indexes one file if its content changed. Returns True if the index changed."""
+        file_path = os.path.join(self.project_dir, rel_path)
+        try:
+            stat = os.stat(file_path)
+            entry = self.files.get(rel_path)
+            # Szybka ścieżka: niezmieniony rozmiar i mtime
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                return False
+            if stat.st_size > MAX_FILE_BYTES:
+                return self.files.pop(rel_path, None) is not None
+            with open(file_path, "rb") as f:
+                raw = f.read()
+        except OSError:
+            return self.files.pop(rel_path, None) is not None
+
+        digest = hashlib.sha256(raw).hexdigest()
+        if entry and entry["hash"] == digest:
+            entry["mtime"] = stat.st_mtime_ns
+            return False
+        text = raw.decode("utf-8", errors="replace")
+        self.files[rel_path] = {
+            "hash": digest,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "chunks": chunk_file(rel_path, text),
+        }
+        return True
+
+    def refresh(self):
+        """Brings the index up to date with the project directory. Returns the number of re-indexed files."""
+        seen = set()
+        changed = 0
+        for rel_path in self._iter_files():
+            seen.add(rel_path)
+            changed += self._index_file(rel_path)
+        for rel_path in set(self.files) - seen:
+            del self.files[rel_path]
+            changed += 1
+        self.save()
+        logging.info(f"Project index for {self.project_dir}: {len(self.files)} files, {changed} re-indexed.")
+        return changed
+
+    def update_files(self, rel_paths):
+        """Re-indexes only the given files (e.g., after the pipeline wrote them)."""
+        changed = False
+        for rel_path in rel_paths:
+            changed = self._index_file(rel_path) or changed
+        if changed:
+            self.save()
+
+    def file_list(self):
+        return sorted(self.files)
+
+    def search(self, query, k=8):
+        """
+        Returns the top-k chunks for the query ranked by BM25, with a boost for symbol name matches.
+        Each result contains path, start_line, end_line, symbols, score and the chunk text.
+        """
+        chunks = [chunk for entry in self.files.values() for chunk in entry["chunks"]]
+        query_terms = set(tokenize(query))
+        if not chunks or not query_terms:
+            return []
+
+        n = len(chunks)
+        avg_length = sum(c["length"] for c in chunks) / n or 1
+        df = Counter(term for c in chunks for term in query_terms if term in c["terms"])
+        idf = {term: math.log(1 + (n - df[term] + 0.5) / (df[term] + 0.5)) for term in query_terms}
+
+        scored = []
+        for chunk in chunks:
+            score = 0.0
+            for term in query_terms:
+                tf = chunk["terms"].get(term, 0)
+                if tf:
+                    score += idf[term] * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * chunk["length"] / avg_length))
+            symbol_terms = {t for symbol in chunk["symbols"] for t in tokenize(symbol)}
+            score += SYMBOL_BOOST * len(query_terms & symbol_terms)
+            if score > 0:
+                scored.append((score, chunk))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [self._with_text(chunk, score) for score, chunk in scored[:k]]
+
+    def _with_text(self, chunk, score):
+        try:
+            with open(os.path.join(self.project_dir, chunk["path"]), "r", encoding="utf-8", errors="replace") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        return {
+            "path": chunk["path"],
+            "start_line": chunk["start_line"],
+            "end_line": chunk["end_line"],
+            "symbols": chunk["symbols"],
+            "score": round(score, 3),
+            "text": "\n".join(lines[chunk["start_line"] - 1:chunk["end_line"]]),
+        }
+
+    def context_for(self, query, k=8, full_file_lines=FULL_FILE_LINES):
+        """
+        Returns the edit context for a request: the top-k chunks, where chunks of small files
+        (at most full_file_lines lines) are replaced by the whole file, once per file.
+        """
+        context = []
+        full_files = set()
+        for chunk in self.search(query, k):
+            path = chunk["path"]
+            if path in full_files:
+                continue
+            last_line = self.files[path]["chunks"][-1]["end_line"] if self.files[path]["chunks"] else 0
+            if last_line <= full_file_lines:
+                try:
+                    with open(os.path.join(self.project_dir, path), "r", encoding="utf-8", errors="replace") as f:
+                        text = f.read()
+                except OSError:
+                    continue
+                full_files.add(path)
+                chunk = dict(chunk, start_line=1, end_line=last_line, text=text, full_file=True)
+            context.append(chunk)
+        return context
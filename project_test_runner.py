@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from dep_cache import install_dependencies
+from cancellation import timeout_for, kill_process_group
+from utils import FACTORY_CACHE_DIR
+
+TEST_TIMEOUT = int(os.getenv("TEST_TIMEOUT", "600"))
+TEST_MEMORY_MB = int(os.getenv("TEST_MEMORY_MB", "4096"))
+TEST_MAX_OPEN_FILES = int(os.getenv("TEST_MAX_OPEN_FILES", "4096"))
+# Sandboxy na tym samym systemie plików co magazyn zależności, aby działały reflinki (i hardlinki, jeśli włączone)
+TEST_SANDBOX_DIR = os.getenv("TEST_SANDBOX_DIR", os.path.join(FACTORY_CACHE_DIR, "sandboxes"))
+
+# Zmienne środowiskowe przekazywane do sandboxa; reszta środowiska (m.in. klucze API) nie trafia do testów
+ENV_ALLOWLIST = ("PATH", "LANG", "LC_ALL", "SYSTEMROOT", "TEMP", "TMP", "SUPABASE_URL", "SUPABASE_ANON_KEY", "NODE_OPTIONS")
+SANDBOX_IGNORE = shutil.ignore_patterns("node_modules", ".git", ".next", "__pycache__", ".venv", "venv", ".scannerwork")
+
+RESULTS_FILE = "test_results.json"
+JUNIT_FILE = ".test-results.xml"
+JSON_REPORT_FILE = ".test-results.json"
+
+
+# Ustawia limity zasobów i zastępuje się komendą testową; zamiast preexec_fn, który nie jest bezpieczny
+# przy fork() z wielu wątków (run_test_suites)
+LIMITS_WRAPPER = """
+import os, sys, resource
+for name, value in zip(("RLIMIT_DATA", "RLIMIT_CPU", "RLIMIT_NOFILE"), map(int, sys.argv[1:4])):
+    if value:
+        resource.setrlimit(getattr(resource, name), (value, value))
+os.execvp(sys.argv[5], sys.argv[5:])
+"""
+
+
+def _limit_resources(command, memory_mb, cpu_seconds, max_open_files):
+    """
+    Wraps a command so that it runs with rlimits (POSIX only): prlimit if installed, otherwise a Python exec wrapper.
+    Memory is limited with RLIMIT_DATA rather than RLIMIT_AS: browsers (Playwright's Chromium) and V8 reserve
+    far more address space than they use, so an address space limit kills them.
+    """
+    if os.name != "posix":
+        return command
+    data_bytes = memory_mb << 20 if memory_mb else 0
+    prlimit = shutil.which("prlimit")
+    if prlimit:
+        limits = [f"--{name}={value}" for name, value in (("data", data_bytes), ("cpu", cpu_seconds), ("nofile", max_open_files)) if value]
+        return [prlimit, *limits, "--", *command]
+    return [sys.executable, "-c", LIMITS_WRAPPER, str(data_bytes), str(cpu_seconds or 0), str(max_open_files or 0), "--", *command]
+
+
+def _npm_test_runner(sandbox_dir):
+    """Detects the JS test runner from the "test" script in package.json."""
+    try:
+        with open(os.path.join(sandbox_dir, "package.json"), "r", encoding="utf-8") as f:
+            test_script = json.load(f).get("scripts", {}).get("test", "")
+    except (OSError, ValueError):
+        return None
+    for runner in ("jest", "vitest", "playwright"):
+        if runner in test_script:
+            return runner
+    return None
+
+
+def build_test_plan(framework, sandbox_dir):
+    """
+    Returns (install_steps, test_step) for the framework as argv lists run inside the sandbox.
+    The test step asks the runner for a machine-readable report whenever the runner is known.
+    """
+    if framework == "Next.js":
+        install_steps = [["npm", "install", "--no-audit", "--no-fund"]]
+        runner = _npm_test_runner(sandbox_dir)
+        if runner == "jest":
+            test_step = ["npm", "test", "--", "--ci", "--json", f"--outputFile={JSON_REPORT_FILE}"]
+        elif runner == "vitest":
+            test_step = ["npm", "test", "--", "--run", "--reporter=json", f"--outputFile={JSON_REPORT_FILE}"]
+        elif runner == "playwright":
+            test_step = ["npm", "test", "--", "--reporter=json"]
+        else:
+            test_step = ["npm", "test"]
+        return install_steps, test_step
+    if framework == "Flask":
+        install_steps = []
+        if os.path.exists(os.path.join(sandbox_dir, "requirements.txt")):
+            install_steps.append([sys.executable, "-m", "pip", "install", "--quiet", "--target", ".deps", "-r", "requirements.txt"])
+        return install_steps, [sys.executable, "-m", "pytest", "-q", f"--junitxml={JUNIT_FILE}"]
+    return None, None
+
+
+def parse_junit(path):
+    """Parses a JUnit XML report (pytest --junitxml) into pass/fail records."""
+    records = []
+    for case in ET.parse(path).getroot().iter("testcase"):
+        status, message = "passed", ""
+        for tag in ("failure", "error", "skipped"):
+            element = case.find(tag)
+            if element is not None:
+                status = "failed" if tag == "failure" else tag
+                message = element.get("message", "") or (element.text or "")
+                break
+        records.append({
+            "name": case.get("name"),
+            "suite": case.get("classname"),
+            "status": status,
+            "duration": float(case.get("time") or 0),
+            "message": message[:2000],
+        })
+    return records
+
+
+def parse_jest_json(data):
+    """Parses a Jest/Vitest --json report into pass/fail records."""
+    records = []
+    for suite in data.get("testResults", []):
+        for assertion in suite.get("assertionResults", []):
+            status = assertion.get("status")
+            records.append({
+                "name": assertion.get("fullName") or assertion.get("title"),
+                "suite": suite.get("name"),
+                "status": {"pending": "skipped", "todo": "skipped"}.get(status, status),
+                "duration": (assertion.get("duration") or 0) / 1000,
+                "message": "\n".join(assertion.get("failureMessages") or [])[:2000],
+            })
+    return records
+
+
+def parse_playwright_json(data):
+    """Parses a Playwright --reporter=json report into pass/fail records."""
+    records = []
+
+    def walk(suite, prefix):
+        title = " › ".join(filter(None, [prefix, suite.get("title")]))
+        for spec in suite.get("specs", []):
+            for test in spec.get("tests", []):
+                results = test.get("results") or [{}]
+                last = results[-1]
+                status = last.get("status", "skipped")
+                records.append({
+                    "name": spec.get("title"),
+                    "suite": title,
+                    "status": {"timedOut": "failed", "interrupted": "failed"}.get(status, status),
+                    "duration": (last.get("duration") or 0) / 1000,
+                    "message": ((last.get("error") or {}).get("message") or "")[:2000],
+                })
+        for child in suite.get("suites", []):
+            walk(child, title)
+
+    for suite in data.get("suites", []):
+        walk(suite, "")
+    return records
+
+
+def collect_records(sandbox_dir, stdout):
+    """Collects structured test records from whichever report the runner produced."""
+    junit_path = os.path.join(sandbox_dir, JUNIT_FILE)
+    if os.path.exists(junit_path):
+        return parse_junit(junit_path)
+    json_path = os.path.join(sandbox_dir, JSON_REPORT_FILE)
+    try:
+        if os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        else:
+            # Raport JSON na stdout (Playwright bez PLAYWRIGHT_JSON_OUTPUT_NAME); pomijamy ewentualny prefiks z npm
+            start = stdout.find("{")
+            if start == -1:
+                return []
+            data = json.loads(stdout[start:])
+    except (OSError, ValueError) as e:
+        logging.debug(f"Could not parse test report: {e}")
+        return []
+    # Ten sam plik raportu dla wszystkich runnerów JS: format rozpoznajemy po zawartości
+    if "testResults" in data:
+        return parse_jest_json(data)
+    if "suites" in data:
+        return parse_playwright_json(data)
+    return []
+
+
+def _run_step(command, cwd, env, timeout, token=None):
+    """Runs one sandboxed step, killing the whole process group on timeout or cancellation of the run."""
+    popen_kwargs = {"start_new_session": True} if os.name == "posix" else {}
+    started = time.monotonic()
+    timeout = timeout_for(token, timeout)
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **popen_kwargs)
+    unregister = token.on_cancel(lambda: kill_process_group(process)) if token is not None else (lambda: None)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+        timed_out = False
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        stdout, stderr = process.communicate()
+        timed_out = True
+    except BaseException:
+        kill_process_group(process)
+        raise
+    finally:
+        unregister()
+    if token is not None:
+        token.raise_if_cancelled()
+    return {
+        "command": " ".join(command),
+        "returncode": process.returncode,
+        "timed_out": timed_out,
+        "duration": round(time.monotonic() - started, 3),
+        "stdout": stdout,
+        "stderr": stderr,
+    }
+
+
+def run_project_tests(project_dir, framework, timeout=TEST_TIMEOUT, memory_mb=TEST_MEMORY_MB, keep_sandbox=False, token=None):
+    """
+    Runs a project's test suite in an isolated copy of the project directory.
+    Args:
+        project_dir (str): Project directory (not modified by the run).
+        framework (str): Framework name (Next.js, Flask).
+        timeout (int): Overall time limit in seconds for install + test steps.
+        memory_mb (int): Data segment (heap) limit per step in MB (0 disables the limit).
+        keep_sandbox (bool): Keep the sandbox directory for debugging.
+        token (CancelToken): Cancellation token of the run; running steps are killed when it is cancelled.
+    Returns:
+        dict: Run summary with status, counts, per-test records and step logs.
+    """
+    summary = {"project_dir": project_dir, "framework": framework, "status": "error", "passed": 0, "failed": 0, "skipped": 0, "records": [], "steps": []}
+    os.makedirs(TEST_SANDBOX_DIR, exist_ok=True)
+    sandbox_dir = tempfile.mkdtemp(prefix=f"test-{os.path.basename(os.path.normpath(project_dir))}-", dir=TEST_SANDBOX_DIR)
+    started = time.monotonic()
+    try:
+        shutil.copytree(project_dir, sandbox_dir, ignore=SANDBOX_IGNORE, dirs_exist_ok=True)
+        install_steps, test_step = build_test_plan(framework, sandbox_dir)
+        if test_step is None:
+            summary["status"] = "unsupported"
+            logging.warning(f"Brak zdefiniowanej komendy testowej dla frameworku: {framework}")
+            return summary
+
+        # Zależności z magazynu współdzielonego; zwykła instalacja tylko gdy magazyn zawiedzie
+        try:
+            deps = install_dependencies(sandbox_dir, framework, token=token)
+            if deps is not None:
+                summary["dependencies"] = deps
+                install_steps = []
+        except Exception as e:
+            logging.warning(f"Dependency store unavailable for {project_dir}, falling back to a regular install: {e}")
+
+        env = {name: os.environ[name] for name in ENV_ALLOWLIST if name in os.environ}
+        env.update({"HOME": sandbox_dir, "CI": "1", "PYTHONPATH": os.path.join(sandbox_dir, ".deps"),
+                    "PLAYWRIGHT_JSON_OUTPUT_NAME": JSON_REPORT_FILE})
+
+        for command in install_steps + [test_step]:
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                summary["status"] = "timeout"
+                return summary
+            logging.info(f"Wykonuję komendę testową w sandboxie {sandbox_dir}: {' '.join(command)}")
+            limited = _limit_resources(command, memory_mb, int(remaining) + 1, TEST_MAX_OPEN_FILES)
+            step = _run_step(limited, sandbox_dir, env, remaining, token=token)
+            step["command"] = " ".join(command)
+            summary["steps"].append({k: v[-4000:] if isinstance(v, str) else v for k, v in step.items()})
+            if step["timed_out"]:
+                summary["status"] = "timeout"
+                return summary
+            if command is not test_step and step["returncode"] != 0:
+                summary["status"] = "install_failed"
+                return summary
+
+        records = collect_records(sandbox_dir, step["stdout"])
+        summary["records"] = records
+        for status in ("passed", "failed", "skipped"):
+            summary[status] = sum(1 for r in records if r["status"] == status)
+        summary["failed"] += sum(1 for r in records if r["status"] == "error")
+        summary["status"] = "passed" if step["returncode"] == 0 else "failed"
+        return summary
+    except Exception as e:
+        logging.error(f"Błąd podczas uruchamiania testów dla {project_dir}: {e}")
+        summary["error"] = str(e)
+        return summary
+    finally:
+        summary["duration"] = round(time.monotonic() - started, 3)
+        if keep_sandbox:
+            summary["sandbox_dir"] = sandbox_dir
+        else:
+            shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+
+def run_test_suites(suites, max_workers=None, **kwargs):
+    """
+    Runs several projects' test suites in parallel.
+    Args:
+        suites (list): (project_dir, framework) pairs.
+        max_workers (int): Number of suites run at once (defaults to the number of CPUs).
+    Returns:
+        list: Summaries in the order of suites.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda suite: run_project_tests(*suite, **kwargs), suites))
+
+
+def save_test_results(project_dir, summary):
+    """Stores the run summary next to the project files and returns the file path."""
+    results_path = os.path.join(project_dir, RESULTS_FILE)
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return results_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run generated projects' test suites in parallel sandboxes.")
+    parser.add_argument("projects", nargs="+", help="Project directories")
+    parser.add_argument("--framework", required=True, help="Framework of the projects (e.g., Next.js, Flask)")
+    parser.add_argument("--workers", type=int, help="Number of suites run in parallel")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    results = run_test_suites([(project, args.framework) for project in args.projects], max_workers=args.workers)
+    for result in results:
+        save_test_results(result["project_dir"], result)
+    print(json.dumps([{k: r[k] for k in ("project_dir", "status", "passed", "failed", "skipped", "duration")} for r in results]))
@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from utils import FACTORY_CACHE_DIR
+from cancellation import timeout_for
+
+# Wspólny prefiks promptów (opis projektu, plan, szablon, format odpowiedzi) rejestrowany w pamięci
+# podręcznej kontekstu dostawcy LLM; etapy po planowaniu wysyłają tylko własną końcówkę zadania.
+# PROMPT_CACHE_PROVIDER: auto (Gemini, gdy jest klucz i model gemini), gemini, local (atrapa do testów), none
+PROMPT_CACHE_PROVIDER = os.getenv("PROMPT_CACHE_PROVIDER", "auto").lower()
+PROMPT_CACHE_PATH = os.getenv("PROMPT_CACHE_PATH", os.path.join(FACTORY_CACHE_DIR, "prompt_prefixes.db"))
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "1800"))
+# Dostawcy odrzucają zbyt krótkie konteksty (Gemini: minimum kilka tysięcy tokenów)
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "4096"))
+# Model pamięci podręcznej, jeśli inny niż model agentów (np. wersjonowany gemini-1.5-flash-002)
+PROMPT_CACHE_MODEL = os.getenv("PROMPT_CACHE_MODEL")
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "500"))
+GEMINI_API_URL = os.getenv("GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta")
+# Wpis rejestru używamy tylko, jeśli kontekst u dostawcy przeżyje jeszcze cały etap
+MIN_REMAINING_SECONDS = 300
+
+FILE_OUTPUT_CONVENTIONS = """Format plików w odpowiedziach: pełna zawartość każdego pliku pod nagłówkiem
+--- <ścieżka_pliku_względem_katalogu_projektu> ---
+<zawartość>
+Na przykład:
+--- src/pages/index.js ---
+// kod JavaScript
+--- styles/global.css ---
+/* kod CSS */"""
+
+
+def estimate_tokens(text):
+    """~4 characters per token, as in crew_token_usage()."""
+    return len(text) // 4
+
+
+def prefix_hash(prefix, provider="", model=""):
+    return hashlib.sha256(f"{provider}\0{model}\0{prefix}".encode("utf-8")).hexdigest()
+
+
+def build_shared_prefix(project_name, project_dir, framework, features, plan_data, scaffold_info=None):
+    """
+    Builds the stable project context shared by every stage after planning.
+    The text is deterministic for the same inputs (sorted JSON), so its hash identifies it across runs.
+    """
+    def dump(value):
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+    lines = [
+        "KONTEKST PROJEKTU (wspólny dla wszystkich etapów)",
+        f"Projekt: {project_name}, katalog projektu: '{project_dir}'.",
+        f"Framework: {framework}. Funkcje: {features}.",
+    ]
+    if scaffold_info:
+        lines.append(f"Szablon bazowy {scaffold_info['name']} {scaffold_info['version']} z plikami: {', '.join(sorted(scaffold_info['files']))}.")
+    lines += [
+        f"Plan - struktura plików: {dump(plan_data.get('file_structure', {}))}",
+        f"Plan - tabele Supabase: {dump(plan_data.get('supabase_tables', []))}",
+        f"Plan - komponenty: {dump(plan_data.get('components', []))}",
+        "Klucze Supabase pochodzą ze zmiennych środowiskowych (SUPABASE_URL, SUPABASE_SERVICE_KEY).",
+        FILE_OUTPUT_CONVENTIONS,
+    ]
+    return "\n".join(lines)
+
+
+class PrefixRegistry:
+    """
+    Local registry of shared prompt prefixes keyed on their hash: the provider cache handle and its
+    expiry (so retries and later runs with the same plan reuse a live provider cache instead of creating
+    a new one) and per-prefix reuse counters.
+    """
+
+    def __init__(self, path=PROMPT_CACHE_PATH, max_entries=PROMPT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS prefixes (
+                    hash TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    handle TEXT,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    expires_at REAL,
+                    last_used_at REAL NOT NULL,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prefixes_last_used ON prefixes (last_used_at)")
+
+    def lookup(self, key):
+        """Returns the provider handle of a prefix if its provider cache is still live, else None."""
+        with self._lock:
+            row = self._conn.execute("SELECT handle, expires_at FROM prefixes WHERE hash = ?", (key,)).fetchone()
+        if row is None or row[0] is None or (row[1] or 0) < time.time() + MIN_REMAINING_SECONDS:
+            return None
+        return row[0]
+
+    def register(self, key, provider, model, tokens, handle=None, expires_at=None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO prefixes (hash, provider, model, handle, tokens, created_at, expires_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hash) DO UPDATE SET handle = excluded.handle, expires_at = excluded.expires_at, last_used_at = excluded.last_used_at
+            """, (key, provider, model, handle, tokens, now, expires_at, now))
+            self._conn.execute(
+                "DELETE FROM prefixes WHERE hash NOT IN (SELECT hash FROM prefixes ORDER BY last_used_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+
+    def record_use(self, key, cached):
+        """Counts one stage prompt built on the prefix; `cached` if it was served from the provider cache."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE prefixes SET uses = uses + 1, cached_tokens = cached_tokens + CASE WHEN ? THEN tokens ELSE 0 END, last_used_at = ? WHERE hash = ?",
+                (1 if cached else 0, time.time(), key)
+            )
+
+    def stats(self):
+        """Returns prefix count, total uses, reuses (uses beyond the first per prefix) and tokens served from provider caches."""
+        with self._lock:
+            prefixes, uses, reuses, cached_tokens = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(uses), 0), COALESCE(SUM(MAX(uses - 1, 0)), 0), COALESCE(SUM(cached_tokens), 0) FROM prefixes"
+            ).fetchone()
+        return {"prefixes": prefixes, "uses": uses, "reuses": reuses, "cached_tokens": cached_tokens}
+
+    def close(self):
+        self._conn.close()
+
+
+class ContextCacheProvider:
+    """
+    Provider context-cache facility. create() uploads a prefix and returns its handle; bind() makes an
+    agent's LLM calls start from the cached context, so the prefix is no longer sent with each prompt.
+    """
+
+    name = "none"
+
+    def create(self, model, text, ttl, token=None):
+        """
+        Returns:
+            tuple: (handle, expires_at) or None if the provider did not cache the text.
+        """
+        return None
+
+    def bind(self, agent, handle):
+        """Returns True if the agent's calls now use the cached context."""
+        return False
+
+
+class GeminiContextCache(ContextCacheProvider):
+    """Gemini explicit context caching (cachedContents API); agents are bound through litellm's cached_content parameter."""
+
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def create(self, model, text, ttl, token=None):
+        import requests
+
+        response = requests.post(
+            f"{GEMINI_API_URL}/cachedContents", params={"key": self.api_key},
+            json={"model": f"models/{model}", "contents": [{"role": "user", "parts": [{"text": text}]}], "ttl": f"{int(ttl)}s"},
+            timeout=timeout_for(token)
+        )
+        if response.status_code != 200:
+            logging.warning(f"Gemini context cache not created ({response.status_code}): {response.text[:300]}")
+            return None
+        return response.json()["name"], time.time() + ttl
+
+    def bind(self, agent, handle):
+        params = getattr(agent.llm, "additional_params", None)
+        if not isinstance(params, dict):
+            return False
+        params["cached_content"] = handle
+        # Gemini nie przyjmuje system_instruction razem z cached_content: rola agenta trafia do treści zadania
+        agent.use_system_prompt = False
+        return True
+
+
+class LocalContextCache(ContextCacheProvider):
+    """
+    In-process stand-in for a provider cache (PROMPT_CACHE_PROVIDER=local), for tests and load runs
+    with a fake LLM backend: it stores the prefixes and which agent is bound to which handle.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.contexts = {}
+        self.bound = {}
+
+    def create(self, model, text, ttl, token=None):
+        handle = f"local/{prefix_hash(text, self.name, model)[:16]}"
+        self.contexts[handle] = text
+        return handle, time.time() + ttl
+
+    def bind(self, agent, handle):
+        if handle not in self.contexts:
+            return False
+        self.bound[id(agent)] = handle
+        return True
+
+    def context_for(self, agent):
+        """The cached prefix an agent's calls start from (what the provider would prepend), or None."""
+        handle = self.bound.get(id(agent))
+        return self.contexts.get(handle) if handle else None
+
+
+def get_provider(name=PROMPT_CACHE_PROVIDER, api_key=None, model=""):
+    """Returns the configured context-cache provider (`auto`: Gemini for gemini models with an API key)."""
+    if name == "auto":
+        name = "gemini" if api_key and "gemini" in (model or "") else "none"
+    if name == "gemini":
+        if not api_key:
+            logging.warning("PROMPT_CACHE_PROVIDER=gemini bez GOOGLE_API_KEY, pamięć podręczna kontekstu wyłączona.")
+            return ContextCacheProvider()
+        return GeminiContextCache(api_key)
+    if name == "local":
+        return LocalContextCache()
+    return ContextCacheProvider()
+
+
+def agent_model(agent):
+    """Model name of an agent's LLM without the litellm provider prefix (gemini/...)."""
+    model = getattr(agent.llm, "model", None) or getattr(agent.llm, "model_name", None) or ""
+    return model.split("/", 1)[-1]
+
+
+class PromptContext:
+    """
+    Prompt assembly for the stages after planning: a stable shared prefix plus a per-stage suffix.
+    When the prefix is in a provider cache, bound agents get only their suffix; otherwise the prefix is
+    inlined at the very start of the task (identical leading text, which providers with implicit prefix
+    caching reuse across calls of the same agent, e.g. continuation rounds).
+    """
+
+    def __init__(self, prefix, provider=None, registry=None, ttl=PROMPT_CACHE_TTL_SECONDS, min_tokens=PROMPT_CACHE_MIN_TOKENS):
+        self.prefix = prefix
+        self.provider = provider or ContextCacheProvider()
+        self.registry = registry
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.tokens = estimate_tokens(prefix)
+        self.handle = None
+        self.model = ""
+        self.key = prefix_hash(prefix)
+        self._bound = set()
+
+    def prepare(self, agents, token=None):
+        """
+        Registers the prefix with the provider cache (reusing a live one from the registry) and binds the agents.
+        Provider errors are logged and leave the prompts inlined.
+        """
+        self.model = PROMPT_CACHE_MODEL or (agent_model(agents[0]) if agents else "")
+        self.key = prefix_hash(self.prefix, self.provider.name, self.model)
+        if self.provider.name != "none" and self.tokens >= self.min_tokens:
+            self.handle = self.registry.lookup(self.key) if self.registry else None
+            if self.handle:
+                logging.info(f"Prompt prefix {self.key[:12]} reused from the registry ({self.provider.name} {self.handle}).")
+            else:
+                try:
+                    created = self.provider.create(self.model, self.prefix, self.ttl, token=token)
+                except Exception as e:
+                    logging.warning(f"Prompt prefix cache ({self.provider.name}) failed: {e}")
+                    created = None
+                if created:
+                    self.handle, expires_at = created
+                    if self.registry:
+                        self.registry.register(self.key, self.provider.name, self.model, self.tokens, self.handle, expires_at)
+                    logging.info(f"Prompt prefix {self.key[:12]} cached by {self.provider.name} ({self.tokens} tokens, ttl {self.ttl}s).")
+        elif self.provider.name != "none":
+            logging.info(f"Prompt prefix ({self.tokens} tokens) below PROMPT_CACHE_MIN_TOKENS, inlined into the prompts.")
+        if self.handle:
+            for agent in agents:
+                if self.provider.bind(agent, self.handle):
+                    self._bound.add(id(agent))
+        elif self.registry:
+            self.registry.register(self.key, "inline", self.model, self.tokens)
+        return self
+
+    def describe(self, agent, suffix, inline_prefix=True):
+        """
+        Returns the task description for a stage.
+        Args:
+            agent: Agent running the task.
+            suffix (str): Stage-specific part of the task.
+            inline_prefix (bool): Whether the stage needs the context when it is not cached; stages that
+                did without it keep their short prompt instead of paying for the full prefix.
+        """
+        cached = id(agent) in self._bound
+        if self.registry and (cached or inline_prefix):
+            self.registry.record_use(self.key, cached)
+        if cached:
+            return f"Kontekst projektu został przekazany wcześniej (pamięć podręczna kontekstu).\n{suffix}"
+        if inline_prefix:
+            return f"{self.prefix}\n\n{suffix}"
+        return suffix
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    registry = PrefixRegistry()
+    print(json.dumps(registry.stats(), indent=2))
+    registry.close()
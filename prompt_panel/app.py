@@ -1,15 +1,127 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify
 import subprocess
+import threading
+import hashlib
+import sys
 import os
 
+# Moduły fabryki (job_store, utils) leżą w katalogu nadrzędnym
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from config import get_settings
+# .env przed importem modułów fabryki, które czytają zmienne środowiskowe przy imporcie
+settings = get_settings()
+from job_store import JobStore, new_job_id
+from generation_mirror import get_mirror
+from artifact_store import ArtifactStore
+from job_broker import JOB_BROKER_URL, BrokerError, get_broker
+from job_worker import start_status_sync
+from cancellation import kill_process_group
+from fake_generator import FAKE_GENERATOR, FAKE_GENERATOR_SCRIPT
+from job_scheduler import FairScheduler, QueueFull
+
 app = Flask(__name__)
+job_store = JobStore()
+# Z JOB_BROKER_URL zadania trafiają do brokera i wykonują je workery (generate_project.py --worker)
+broker = get_broker(JOB_BROKER_URL) if JOB_BROKER_URL else None
+# Procesy generate_project.py uruchomione przez panel (id zadania -> Popen), aby można je było anulować.
+# Proces sam pilnuje swojego limitu czasu; PANEL_JOB_TIMEOUT to zabezpieczenie, gdyby się zawiesił
+# (domyślnie limit przebiegu + 60 s; bez limitu przebiegu i PANEL_JOB_TIMEOUT panel czeka bez limitu).
+PANEL_JOB_TIMEOUT = float(os.getenv("PANEL_JOB_TIMEOUT", str(settings.run_deadline_seconds + 60 if settings.run_deadline_seconds else 0))) or None
+running_processes = {}
+running_lock = threading.Lock()
+# Sprawdzenie miejsca w kolejce, rekord zadania i zgłoszenie do harmonogramu wykonywane atomowo
+admission_lock = threading.Lock()
+# Klucze API panelu (oddzielone przecinkami); zadania z kluczem są rozliczane per klucz, pozostałe per adres klienta
+PANEL_API_KEYS = {key.strip() for key in os.getenv("PANEL_API_KEYS", "").split(",") if key.strip()}
+
+
+def stop_process(process):
+    """SIGTERM (the run cancels itself and its child processes), then SIGKILL of the process group after the grace period."""
+    process.terminate()
+    try:
+        process.wait(timeout=settings.cancel_grace_seconds + 1)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def request_tenant():
+    """
+    Tenant of a request for fair scheduling: a valid API key from PANEL_API_KEYS (hashed), else the client
+    address. Client-chosen names (headers, form fields) are not used, so a caller cannot rotate them to
+    get around the per-tenant queue limit. Returns None for an unknown API key.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        if api_key not in PANEL_API_KEYS:
+            return None
+        return 'key-' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+    return request.remote_addr or 'anonymous'
+
+
+def run_generation(job_id, command):
+    """Runs generate_project.py for a job and records a failure the process could not record itself."""
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+        with running_lock:
+            running_processes[job_id] = process
+        try:
+            _, stderr = process.communicate(timeout=PANEL_JOB_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            stop_process(process)
+            _, stderr = process.communicate()
+            job_store.finish_job(job_id, 'failed', error=f"Process did not finish within {PANEL_JOB_TIMEOUT:.0f}s")
+        finally:
+            with running_lock:
+                running_processes.pop(job_id, None)
+        if process.returncode != 0:
+            # Proces mógł paść przed zarejestrowaniem wyniku (np. brak zmiennych środowiskowych przy imporcie)
+            job = job_store.get_job(job_id)
+            if job and job['status'] in ('queued', 'running'):
+                job_store.finish_job(job_id, 'failed', error=stderr.decode('utf-8', errors='replace')[-2000:])
+    except Exception as e:
+        job_store.finish_job(job_id, 'failed', error=str(e))
+
+
+def start_scheduled_job(job):
+    if broker is not None:
+        # Zadanie przekazane workerom; slot zwalnia synchronizacja statusów (start_status_sync) po statusie końcowym
+        try:
+            broker.submit(job.job_id, job.payload)
+        except BrokerError as e:
+            job_store.finish_job(job.job_id, 'failed', error=f"broker unavailable: {e}")
+            raise
+        return
+
+    def run():
+        try:
+            run_generation(job.job_id, job.payload)
+        finally:
+            scheduler.finished(job.job_id)
+
+    threading.Thread(target=run, name=f"panel-job-{job.job_id}", daemon=True).start()
+
+
+# Każde zadanie przechodzi przez harmonogram (limit współbieżności, sprawiedliwy podział, 429); z brokerem
+# SCHEDULER_MAX_RUNNING ogranicza liczbę zadań przekazanych workerom naraz (powinien być >= sumie slotów workerów)
+scheduler = FairScheduler(start_scheduled_job)
+# Kolejka harmonogramu jest tylko w pamięci: zadania czekające w niej przed restartem panelu już nie ruszą
+# (z brokerem pomijamy zadania, które zdążyły do niego trafić)
+orphaned = job_store.cancel_queued_jobs(
+    "panel restarted before the job started", keep=(lambda job_id: broker.get(job_id) is not None) if broker is not None else None
+)
+if orphaned:
+    app.logger.warning(f"Cancelled {orphaned} jobs left queued by a previous panel process.")
+
 @app.route('/run_script', methods=['POST'])
 def run_script():
+    """
+    Submits a generate or edit job through the fair scheduler (also with a broker, where "running" means
+    handed to the workers): 202 with the job id and its status (running, or queued with the queue
+    position), 401 for an unknown API key, or 429 with Retry-After when the queues are full.
+    """
     project = request.form.get('project', '')
     framework = request.form.get('framework', '')
     features = request.form.get('features', '')
@@ -19,6 +131,9 @@ def run_script():
     # Construct the command to run generate_project.py
     # Assuming generate_project.py is in the parent directory of prompt_panel
     script_path = os.path.join(os.path.dirname(__file__), '..', 'generate_project.py')
+    if FAKE_GENERATOR:
+        # Testy obciążeniowe (load_test.py): ten sam model procesów, bez LLM
+        script_path = FAKE_GENERATOR_SCRIPT
     command = ['python', script_path]
 
     if project:
@@ -28,30 +143,132 @@ def run_script():
     if features:
         command.extend(['--features', features])
     if edit:
-        command.extend(['--edit', edit])
+        # --edit to flaga generate_project.py (bez wartości), jak w job_worker.build_command
+        command.append('--edit')
     if changes:
         command.extend(['--changes', changes])
 
-    result = None
-    error = None
+    params = {k: v for k, v in {'project': project, 'framework': framework, 'features': features, 'edit': edit, 'changes': changes}.items() if v}
+    tenant = request_tenant()
+    if tenant is None:
+        return jsonify({"error": "invalid API key"}), 401
+    # Edycje są interaktywne (krótkie, użytkownik czeka), generowanie to praca zbiorcza
+    latency_class = 'interactive' if edit else 'bulk'
+    job_id = new_job_id()
+    if broker is not None:
+        payload = {
+            'project': project,
+            'mode': 'edit' if edit else 'generate',
+            'params': {k: v for k, v in {'framework': framework, 'features': features, 'changes': changes}.items() if v}
+        }
+    else:
+        command.extend(['--job-id', job_id])
+        payload = command
+    with admission_lock:
+        try:
+            # Rekord zadania przed zgłoszeniem, aby status był od razu widoczny w historii
+            job_store.create_job(project, 'edit' if edit else 'generate', params, job_id=job_id)
+            admission = scheduler.submit(job_id, tenant, latency_class, payload=payload)
+        except QueueFull as e:
+            job_store.finish_job(job_id, 'cancelled', error=f"rejected: {e}")
+            return jsonify({"error": f"too busy: {e}", "retry_after": e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+    return jsonify({"id": job_id, "tenant": tenant, "class": latency_class, **admission}), 202
+
+@app.route('/api/scheduler')
+def scheduler_stats():
+    """Running and queued jobs per latency class and tenant, and the scheduler limits."""
+    return jsonify(scheduler.stats())
+
+@app.route('/api/jobs')
+def list_jobs():
+    """Paginated job history, newest first. Query params: project, status, limit, offset."""
     try:
-        # Run the script as a subprocess
-        # Consider activating a virtual environment if necessary
-        # For now, assuming python and the script's dependencies are in the PATH
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        result = stdout.decode('utf-8')
-        error = stderr.decode('utf-8')
-    except Exception as e:
-        error = str(e)
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    return jsonify(job_store.list_jobs(
+        project=request.args.get('project') or None,
+        status=request.args.get('status') or None,
+        limit=limit,
+        offset=offset
+    ))
 
-    # For now, just redirect back to the index or show a simple status
-    # A more robust solution would stream logs or display results properly
-    if error:
-        return f"Error running script: <pre>{error}</pre>"
-    else:
-        return f"Script output: <pre>{result}</pre>"
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Job details with stage timings, token counts and the artifact manifest."""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    job['queue_position'] = scheduler.position(job_id)
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancels a queued or running job; the run stops its LLM/HTTP calls and child processes within about a second."""
+    job = job_store.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job['status'] not in ('queued', 'running'):
+        return jsonify({"error": f"job is already {job['status']}"}), 409
+    with running_lock:
+        process = running_processes.get(job_id)
+    if process is not None:
+        stop_process(process)
+    elif not scheduler.cancel(job_id) and broker is not None:
+        broker.cancel(job_id, reason="cancelled from the panel")
+    job = job_store.get_job(job_id)
+    if job['status'] in ('queued', 'running'):
+        job_store.finish_job(job_id, 'cancelled', error="cancelled from the panel")
+    return jsonify({"id": job_id, "status": job_store.get_job(job_id)['status']})
+
+@app.route('/api/projects/<project_name>/generation')
+def get_generation(project_name):
+    """Latest project_generations row served from the local mirror, with its freshness."""
+    try:
+        max_age = float(request.args.get('max_age', 30))
+    except ValueError:
+        return jsonify({"error": "max_age must be a number"}), 400
+    generation, freshness = get_mirror().get_latest(project_name, max_age=max_age)
+    if generation is None:
+        return jsonify({"error": "project not found", "freshness": freshness}), 404
+    return jsonify({"generation": generation, "freshness": freshness})
+
+@app.route('/api/projects/<project_name>/export')
+def export_project(project_name):
+    """Latest (or ?snapshot=<id>) project snapshot streamed as tar.zst straight from the artifact store."""
+    snapshot_id = request.args.get('snapshot')
+    if snapshot_id is not None and not snapshot_id.isdigit():
+        return jsonify({"error": "snapshot must be an integer"}), 400
+    store = ArtifactStore()
+    try:
+        stream = store.export_stream(project_name, int(snapshot_id) if snapshot_id else None)
+    except ValueError as e:
+        store.close()
+        # Projekt wygenerowany przez workera na innym hoście: archiwum z brokera
+        archive = broker.latest_archive(project_name) if broker is not None and snapshot_id is None else None
+        if archive is None:
+            return jsonify({"error": str(e)}), 404
+        return Response(archive, mimetype='application/zstd', headers={
+            'Content-Disposition': f'attachment; filename="{project_name}.tar.zst"'
+        })
+
+    def generate():
+        try:
+            yield from stream
+        finally:
+            store.close()
+
+    return Response(generate(), mimetype='application/zstd', headers={
+        'Content-Disposition': f'attachment; filename="{project_name}.tar.zst"'
+    })
 
 if __name__ == '__main__':
+    if get_mirror().rest_url:
+        # Odczyty statusu w panelu nie czekają na sieć; mirror odświeża się w tle
+        get_mirror().start_background_sync()
+    if broker is not None:
+        # Statusy, etapy i manifesty raportowane przez workery trafiają do lokalnej historii zadań
+        start_status_sync(broker, job_store, on_finished=scheduler.finished)
     # Consider running with debug=True for development: app.run(debug=True)
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=int(os.getenv('PANEL_PORT', '5000')))
\ No newline at end of file
@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import gzip
+import copy
+import queue
+import atexit
+import shutil
+import logging
+import threading
+from collections import defaultdict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from utils import LOG_MODE
+
+DEBUG_MODE = LOG_MODE == "debug"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BLOCK_TIMEOUT = 1.0
+# Twardy limit rekordu w kolejce (ogranicza pamięć); pełne odpowiedzi LLM trafiają do archiwum wyników etapów
+LOG_MAX_RECORD_CHARS = int(os.getenv("LOG_MAX_RECORD_CHARS", "20000"))
+LOG_CONSOLE_MAX_CHARS = int(os.getenv("LOG_CONSOLE_MAX_CHARS", "20000" if DEBUG_MODE else "2000"))
+# Duże rekordy z tego samego miejsca w kodzie są próbkowane: zostaje co N-ty (1 = bez próbkowania)
+LOG_SAMPLE_THRESHOLD = int(os.getenv("LOG_SAMPLE_THRESHOLD", "4000"))
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "1" if DEBUG_MODE else "10"))
+LOG_ARCHIVE_MAX_BYTES = int(os.getenv("LOG_ARCHIVE_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ARCHIVE_BACKUPS = int(os.getenv("LOG_ARCHIVE_BACKUPS", "10"))
+# Biblioteki, których logi w trybie produkcyjnym są ograniczone do ostrzeżeń
+NOISY_LOGGERS = ("httpx", "httpcore", "urllib3", "LiteLLM", "litellm", "openai", "google", "grpc", "hpack")
+
+
+def _truncate(text, limit):
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} chars truncated]"
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Non-blocking handler: records are truncated and large ones sampled in the calling thread,
+    then queued for the listener thread, which does the formatting and I/O. When the queue is full
+    records below WARNING are dropped (and counted) instead of blocking the pipeline.
+    """
+
+    def __init__(self, log_queue, max_chars=LOG_MAX_RECORD_CHARS, sample_threshold=LOG_SAMPLE_THRESHOLD, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__(log_queue)
+        self.max_chars = max_chars
+        self.sample_threshold = sample_threshold
+        self.sample_rate = max(1, sample_rate)
+        self.dropped = 0
+        self.sampled_out = 0
+        self._large_counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        message = record.getMessage()
+        if len(message) > self.sample_threshold and self.sample_rate > 1 and record.levelno < logging.WARNING:
+            with self._lock:
+                count = self._large_counts[(record.pathname, record.lineno)]
+                self._large_counts[(record.pathname, record.lineno)] += 1
+            if count % self.sample_rate:
+                self.sampled_out += 1
+                return None
+        record = copy.copy(record)
+        record.msg = _truncate(message, self.max_chars)
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            record = self.prepare(record)
+            if record is not None:
+                self.enqueue(record)
+        except Exception:
+            self.handleError(record)
+
+    def enqueue(self, record):
+        try:
+            if record.levelno >= logging.WARNING:
+                # Ostrzeżenia i błędy czekają chwilę na miejsce w kolejce zamiast przepadać
+                self.queue.put(record, timeout=LOG_BLOCK_TIMEOUT)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TruncatingFormatter(logging.Formatter):
+    def __init__(self, fmt=LOG_FORMAT, limit=LOG_CONSOLE_MAX_CHARS):
+        super().__init__(fmt)
+        self.limit = limit
+
+    def format(self, record):
+        return _truncate(super().format(record), self.limit)
+
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler whose rotated segments are gzip-compressed (run.log.1.gz, run.log.2.gz, ...)."""
+
+    def __init__(self, filename, max_bytes=LOG_ARCHIVE_MAX_BYTES, backup_count=LOG_ARCHIVE_BACKUPS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+
+class RunLog:
+    """
+    Logging of one run: the listener thread, the per-run log archive and the raw outputs of the stages.
+    Layout of run_dir: run.log.gz (+ rotated run.log.N.gz segments) and outputs/NN-<stage>.txt.gz.
+    """
+
+    def __init__(self, listener, handler, run_dir=None):
+        self.listener = listener
+        self.handler = handler
+        self.run_dir = run_dir
+        self._outputs = 0
+        self._closed = False
+
+    def archive_output(self, name, text):
+        """Stores a full raw stage output (compressed). Returns the file path, or None without a run directory."""
+        if not self.run_dir:
+            return None
+        self._outputs += 1
+        safe_name = re.sub(r"[^\w.-]+", "_", name).strip("_")[:60]
+        path = os.path.join(self.run_dir, "outputs", f"{self._outputs:02d}-{safe_name}.txt.gz")
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                f.write(str(text))
+        except OSError as e:
+            logging.error(f"Failed to archive output of {name}: {e}")
+            return None
+        logging.debug(f"Raw output of {name} archived in {path}")
+        return path
+
+    def close(self):
+        """Flushes the queue, stops the listener and compresses the active log file."""
+        if self._closed:
+            return
+        self._closed = True
+        if self.handler.dropped or self.handler.sampled_out:
+            logging.warning(f"Logging: {self.handler.dropped} records dropped (queue full), {self.handler.sampled_out} large records sampled out.")
+        self.listener.stop()
+        for handler in self.listener.handlers:
+            handler.close()
+            if isinstance(handler, GzipRotatingFileHandler) and os.path.exists(handler.baseFilename):
+                GzipRotatingFileHandler._compress(handler.baseFilename, handler.baseFilename + ".gz")
+        logging.getLogger().removeHandler(self.handler)
+
+
+def setup_logging(run_dir=None, debug=DEBUG_MODE):
+    """
+    Installs the queue-based logging pipeline on the root logger.
+    Args:
+        run_dir (str): Directory of the per-run archive (e.g. projects/<name>/.factory/logs/<job id>); None for console only.
+        debug (bool): Debug verbosity (DEBUG level, no sampling) instead of production (INFO, sampled, quiet libraries).
+    Returns:
+        RunLog: Handle for archiving stage outputs; closed automatically at exit.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(logging.NOTSET if debug else logging.WARNING)
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(TruncatingFormatter())
+    handlers = [console]
+    if run_dir:
+        os.makedirs(run_dir, exist_ok=True)
+        archive = GzipRotatingFileHandler(os.path.join(run_dir, "run.log"))
+        archive.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(archive)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue, sample_rate=LOG_SAMPLE_RATE if not debug else 1)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    root.addHandler(queue_handler)
+
+    run_log = RunLog(listener, queue_handler, run_dir)
+    atexit.register(run_log.close)
+    return run_log
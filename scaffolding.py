@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import shutil
+import logging
+
+SCAFFOLDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scaffolds")
+SCAFFOLD_MARKER = ".scaffold.json"
+
+# Mapowanie wartości --framework na katalog w bibliotece szablonów
+FRAMEWORK_SCAFFOLDS = {
+    "next.js": "nextjs",
+    "nextjs": "nextjs",
+    "next": "nextjs",
+    "flask": "flask",
+}
+
+
+def _version_key(name):
+    return int(name[1:]) if re.fullmatch(r"v\d+", name) else -1
+
+
+def resolve_scaffold(framework, version=None):
+    """
+    Finds the scaffold for a framework.
+    Args:
+        framework (str): Value of --framework (e.g., Next.js, Flask).
+        version (str): Scaffold version directory (e.g., "v1"); the newest one is used if not given.
+    Returns:
+        dict: Manifest extended with "name", "path" and "files_dir", or None if there is no scaffold.
+    """
+    name = FRAMEWORK_SCAFFOLDS.get((framework or "").strip().lower())
+    if not name:
+        return None
+    scaffold_root = os.path.join(SCAFFOLDS_DIR, name)
+    versions = sorted((d for d in os.listdir(scaffold_root) if _version_key(d) >= 0), key=_version_key) if os.path.isdir(scaffold_root) else []
+    if version is None and versions:
+        version = versions[-1]
+    if not version or version not in versions:
+        return None
+
+    path = os.path.join(scaffold_root, version)
+    with open(os.path.join(path, "manifest.json"), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.update({"name": name, "release": version, "path": path, "files_dir": os.path.join(path, "files")})
+    return manifest
+
+
+def scaffold_files(scaffold):
+    """Returns the project-relative paths of all files in a scaffold."""
+    files = []
+    for root, dirs, names in os.walk(scaffold["files_dir"]):
+        dirs[:] = [d for d in dirs if d != "__pycache__"]
+        for file_name in names:
+            if file_name.endswith((".pyc", ".pyo")):
+                continue
+            files.append(os.path.relpath(os.path.join(root, file_name), scaffold["files_dir"]).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def project_slug(project_name):
+    """Returns an npm-compatible package name for the project."""
+    return re.sub(r"[^a-z0-9._-]+", "-", project_name.lower()).strip("-._") or "project"
+
+
+def materialize_scaffold(framework, project_dir, project_name, version=None):
+    """
+    Copies the framework scaffold into the project directory.
+    Existing project files are never overwritten. Placeholders {{project_name}} and
+    {{project_slug}} are substituted in the files listed as "templated" in the manifest.
+    Args:
+        framework (str): Value of --framework.
+        project_dir (str): Project directory.
+        project_name (str): Project name.
+        version (str): Scaffold version directory; the newest one is used if not given.
+    Returns:
+        dict: {"name", "version", "files"} of the materialised scaffold, or None if there is no scaffold for the framework.
+    """
+    scaffold = resolve_scaffold(framework, version)
+    if scaffold is None:
+        logging.info(f"No scaffold template for framework {framework}. The code generator will create all files.")
+        return None
+
+    replacements = {"{{project_name}}": project_name, "{{project_slug}}": project_slug(project_name)}
+    templated = set(scaffold.get("templated", []))
+    written = []
+    for rel_path in scaffold_files(scaffold):
+        source = os.path.join(scaffold["files_dir"], rel_path)
+        target = os.path.join(project_dir, rel_path)
+        if os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if rel_path in templated:
+            with open(source, "r", encoding="utf-8") as f:
+                content = f.read()
+            for placeholder, value in replacements.items():
+                content = content.replace(placeholder, value)
+            with open(target, "w", encoding="utf-8") as f:
+                f.write(content)
+        else:
+            shutil.copy2(source, target)
+        written.append(rel_path)
+
+    info = {"name": scaffold["name"], "version": scaffold["version"], "release": scaffold["release"], "files": scaffold_files(scaffold)}
+    with open(os.path.join(project_dir, SCAFFOLD_MARKER), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    logging.info(f"Materialised scaffold {scaffold['name']} {scaffold['version']} into {project_dir} ({len(written)} files written).")
+    return info
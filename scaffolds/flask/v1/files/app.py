@@ -0,0 +1,23 @@
+from dotenv import load_dotenv
+from flask import Flask, render_template
+
+load_dotenv()
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_mapping(APP_NAME="{{project_name}}")
+    if config:
+        app.config.update(config)
+
+    @app.route('/')
+    def index():
+        return render_template('index.html')
+
+    return app
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,11 @@
+import os
+from supabase import create_client, Client
+
+
+def get_supabase() -> Client:
+    """Creates a Supabase client from SUPABASE_URL and SUPABASE_SERVICE_KEY."""
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
+    if not supabase_url or not supabase_key:
+        raise ValueError("Brak wymaganych zmiennych: SUPABASE_URL lub SUPABASE_SERVICE_KEY")
+    return create_client(supabase_url, supabase_key)
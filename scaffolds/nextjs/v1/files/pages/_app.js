@@ -0,0 +1,5 @@
+import '@/styles/globals.css';
+
+export default function App({ Component, pageProps }) {
+  return <Component {...pageProps} />;
+}
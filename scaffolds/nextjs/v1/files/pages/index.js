@@ -0,0 +1,14 @@
+import Head from 'next/head';
+
+export default function Home() {
+  return (
+    <>
+      <Head>
+        <title>{{project_name}}</title>
+      </Head>
+      <main>
+        <h1>{{project_name}}</h1>
+      </main>
+    </>
+  );
+}
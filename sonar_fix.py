@@ -0,0 +1,219 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from project_files import parse_file_blocks, read_project_file, write_project_files
+from utils import AGENT_VERBOSE
+
+
+def issue_file_path(issue, project_key):
+    """
+    Returns the project-relative file path of a SonarQube issue.
+    SonarQube component keys look like "<projectKey>:<path/to/file>".
+    """
+    component = issue.get("component", "")
+    prefix = f"{project_key}:"
+    if component.startswith(prefix):
+        return component[len(prefix):]
+    return component.split(":", 1)[-1] if ":" in component else None
+
+
+def group_issues(issues, project_key):
+    """
+    Groups SonarQube issues by file and then by rule.
+    Args:
+        issues (list): Issues as returned by /api/issues/search.
+        project_key (str): SonarQube project key used to strip component prefixes.
+    Returns:
+        dict: {file_path: {rule: [issue, ...]}}. Issues without a file component are dropped.
+    """
+    grouped = defaultdict(lambda: defaultdict(list))
+    for issue in issues:
+        file_path = issue_file_path(issue, project_key)
+        if not file_path:
+            logging.debug(f"Skipping SonarQube issue without file component: {issue.get('key')}")
+            continue
+        grouped[file_path][issue.get("rule", "unknown")].append(issue)
+    return grouped
+
+
+class FixBudget:
+    """Token and wall-clock budget shared by all fix tasks of one fix loop."""
+
+    def __init__(self, max_tokens=200000, max_seconds=900):
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.tokens_used = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens):
+        with self._lock:
+            self.tokens_used += tokens
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def exhausted(self):
+        return self.tokens_used >= self.max_tokens or self.elapsed >= self.max_seconds
+
+
+def crew_token_usage(crew_output, fallback_text=""):
+    """
+    Returns the total token count reported by a CrewAI kickoff result.
+    Falls back to a ~4 characters per token estimate when usage metrics are missing.
+    """
+    usage = getattr(crew_output, "token_usage", None)
+    total = getattr(usage, "total_tokens", None)
+    if isinstance(total, int) and total > 0:
+        return total
+    return (len(fallback_text) + len(str(crew_output))) // 4
+
+
+class SonarFixEngine:
+    """
+    Iterative fix-and-rescan loop for SonarQube issues.
+
+    Issues are grouped by file and rule, and every file gets its own fix task that
+    sees only that file's content and issues. Fix tasks run with bounded concurrency,
+    results go through the diff-aware writer, and only touched files are rescanned.
+    The loop stops when no issues remain, when a round makes no progress, or when
+    the token/time budget runs out.
+    """
+
+    def __init__(self, agent_factory, project_dir, project_key, rescan, max_workers=4, max_rounds=3, budget=None):
+        """
+        Args:
+            agent_factory (callable): Returns a fresh SelfImproveAgent; one agent per fix task
+                so that concurrent crews never share agent state.
+            project_dir (str): Project directory.
+            project_key (str): SonarQube project key.
+            rescan (callable): rescan(file_paths) -> list of current issues for those files, or None on failure.
+            max_workers (int): Maximum number of concurrent fix tasks.
+            max_rounds (int): Maximum number of fix-and-rescan rounds.
+            budget (FixBudget): Token/time budget for the whole loop.
+        """
+        self.agent_factory = agent_factory
+        self.project_dir = project_dir
+        self.project_key = project_key
+        self.rescan = rescan
+        self.max_workers = max_workers
+        self.max_rounds = max_rounds
+        self.budget = budget or FixBudget()
+
+    def _fix_file(self, file_path, issues_by_rule):
+        """Runs one fix task for a single file. Returns True if the file was changed."""
+        from crewai import Crew, Process
+
+        if self.budget.exhausted:
+            return False
+
+        file_content = read_project_file(self.project_dir, file_path)
+        if file_content is None:
+            logging.warning(f"SonarQube issue refers to a missing file: {file_path}. Skipping.")
+            return False
+
+        issues = [issue for rule_issues in issues_by_rule.values() for issue in rule_issues]
+        agent = self.agent_factory()
+        fix_task = agent.create_fix_task(file_path, file_content, issues)
+        fix_crew = Crew(
+            agents=[agent],
+            tasks=[fix_task],
+            process=Process.sequential,
+            verbose=AGENT_VERBOSE,
+            max_rpm=10
+        )
+        fix_result = fix_crew.kickoff()
+        self.budget.consume(crew_token_usage(fix_result, fix_task.description))
+        logging.debug(f"SelfImproveAgent fix result for {file_path}: {fix_result}")
+
+        # Accept only the file this task was responsible for
+        fixed = parse_file_blocks(str(fix_result)).get(file_path)
+        if not fixed:
+            logging.warning(f"SelfImproveAgent returned no content for {file_path}.")
+            return False
+        return bool(write_project_files(self.project_dir, {file_path: fixed}))
+
+    def run(self, issues):
+        """
+        Runs the fix loop.
+        Args:
+            issues (list): Initial SonarQube issues.
+        Returns:
+            dict: Summary with remaining issues, touched files, rounds, tokens used and stop reason.
+        """
+        remaining = group_issues(issues, self.project_key)
+        touched_total = set()
+        stop_reason = "max_rounds"
+        rounds = 0
+
+        while remaining and rounds < self.max_rounds:
+            if self.budget.exhausted:
+                stop_reason = "budget_exhausted"
+                break
+            rounds += 1
+
+            issue_count = sum(len(i) for rules in remaining.values() for i in rules.values())
+            logging.info(f"SonarQube fix round {rounds}: {issue_count} issues in {len(remaining)} files.")
+
+            touched = set()
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(self._fix_file, file_path, issues_by_rule): file_path
+                    for file_path, issues_by_rule in remaining.items()
+                }
+                for future in as_completed(futures):
+                    file_path = futures[future]
+                    try:
+                        if future.result():
+                            touched.add(file_path)
+                    except Exception as e:
+                        logging.error(f"Fix task for {file_path} failed: {e}")
+
+            if not touched:
+                stop_reason = "no_progress"
+                break
+            touched_total.update(touched)
+
+            rescanned = self.rescan(sorted(touched))
+            if rescanned is None:
+                logging.warning("Rescan of touched files failed. Stopping fix loop.")
+                stop_reason = "rescan_failed"
+                break
+
+            # Untouched files keep their previous issues; touched files get fresh results
+            for file_path in touched:
+                remaining.pop(file_path, None)
+            for file_path, issues_by_rule in group_issues(rescanned, self.project_key).items():
+                if file_path in touched:
+                    remaining[file_path] = issues_by_rule
+
+            new_count = sum(len(i) for rules in remaining.values() for i in rules.values())
+            if new_count >= issue_count:
+                stop_reason = "no_progress"
+                break
+
+        remaining_issues = [i for rules in remaining.values() for issues in rules.values() for i in issues]
+        summary = {
+            "stop_reason": "converged" if not remaining_issues else stop_reason,
+            "rounds": rounds,
+            "remaining_issues": len(remaining_issues),
+            "touched_files": sorted(touched_total),
+            "tokens_used": self.budget.tokens_used,
+            "elapsed_seconds": round(self.budget.elapsed, 2),
+        }
+        logging.info(f"SonarQube fix loop finished: {summary}")
+        return summary
+
+
+def budget_from_env():
+    """Builds a FixBudget from SONAR_FIX_MAX_TOKENS / SONAR_FIX_MAX_SECONDS."""
+    return FixBudget(
+        max_tokens=int(os.getenv("SONAR_FIX_MAX_TOKENS", "200000")),
+        max_seconds=float(os.getenv("SONAR_FIX_MAX_SECONDS", "900")),
+    )
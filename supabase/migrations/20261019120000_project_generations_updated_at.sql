@@ -0,0 +1,34 @@
+-- Kolumna updated_at w project_generations: kursor synchronizacji lokalnego mirrora (generation_mirror.py)
+-- to (updated_at, id), więc każda zmiana wiersza - także przez innych klientów - musi przesuwać updated_at.
+-- Zastosowanie: `supabase db push` (albo wklejenie w SQL Editor projektu Supabase).
+
+ALTER TABLE public.project_generations ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE;
+
+-- Istniejące wiersze: najpóźniejszy znany czas zmiany zamiast jednego wspólnego now()
+UPDATE public.project_generations
+SET updated_at = COALESCE(end_time, start_time, created_at, NOW())
+WHERE updated_at IS NULL;
+
+ALTER TABLE public.project_generations
+  ALTER COLUMN updated_at SET DEFAULT NOW(),
+  ALTER COLUMN updated_at SET NOT NULL;
+
+-- updated_at ustawia baza przy każdym UPDATE; klienci (generate_project.py, n8n) nie muszą go podawać
+CREATE OR REPLACE FUNCTION public.set_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS project_generations_set_updated_at ON public.project_generations;
+CREATE TRIGGER project_generations_set_updated_at
+  BEFORE UPDATE ON public.project_generations
+  FOR EACH ROW
+  EXECUTE FUNCTION public.set_updated_at();
+
+-- Stronicowanie mirrora: ORDER BY updated_at, id z filtrem (updated_at, id) > kursor
+CREATE INDEX IF NOT EXISTS idx_project_generations_updated_at_id ON public.project_generations (updated_at, id);
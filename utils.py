@@ -1,5 +1,13 @@
 import os
 
+# Katalog cache współdzielony przez wszystkie uruchomienia na tym hoście (lint, zależności, plany)
+FACTORY_CACHE_DIR = os.getenv("FACTORY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ai-web-factory"))
+# Limit tokenów wyjściowych pojedynczej odpowiedzi LLM (dłuższe wyniki są kontynuowane, zob. continuation.py)
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("LLM_MAX_OUTPUT_TOKENS", "4096"))
+# Tryb logowania: "production" (INFO, skrócone i próbkowane logi) lub "debug" (pełne logi, verbose agentów i crew)
+LOG_MODE = os.getenv("LOG_MODE", "production").lower()
+AGENT_VERBOSE = LOG_MODE == "debug"
+
 def get_secret(secret_name):
     """
     Retrieves a secret from Docker secrets or environment variables.